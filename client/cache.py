@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+#            cache.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import shutil
+import ctypes
+import ctypes.util
+import logging
+import tempfile
+import threading
+
+# Cache modes of the cache_mode option. With none the page cache is left as
+# it is.
+MODES = ('none', 'cold', 'warm', 'staged')
+POSIX_FADV_DONTNEED = 4
+STAGE_DIR = '/dev/shm'
+READ_SIZE = 1024 * 1024
+
+def load_fadvise():
+    """Finds posix_fadvise(), which Python 2 does not expose.
+
+    @return: function taking a file descriptor, offset, length and advice,
+             or None if posix_fadvise() is not available.
+
+    """
+    if hasattr(os, 'posix_fadvise'):
+        return os.posix_fadvise
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                            use_errno=True)
+        posix_fadvise = getattr(libc, 'posix_fadvise64', None)
+        if posix_fadvise is None:
+            posix_fadvise = libc.posix_fadvise
+    except (OSError, AttributeError), e:
+        logging.warning("Unable to load posix_fadvise(): %s" % e)
+        return None
+    posix_fadvise.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64,
+                                ctypes.c_int]
+    def fadvise(fd, offset, length, advice):
+        # posix_fadvise() returns the error number instead of setting errno.
+        errno = posix_fadvise(fd, offset, length, advice)
+        if errno != 0:
+            raise OSError(errno, os.strerror(errno))
+    return fadvise
+
+fadvise = load_fadvise()
+
+def evict(filelist):
+    """Drops the pages of the files in I{filelist} from the page cache.
+
+    Dirty pages cannot be dropped, so each file is synced first. Pages that
+    are mapped by other processes may stay in the cache.
+
+    @param filelist: Paths of the files.
+    @type filelist: list of strings
+
+    """
+    if fadvise is None:
+        raise CacheError("posix_fadvise() is not available, unable to evict "
+                        "files from the page cache")
+    for path in filelist:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fdatasync(fd)
+            fadvise(fd, 0, 0, POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+def warm(filelist):
+    """Reads the files in I{filelist}, so they are in the page cache.
+
+    @param filelist: Paths of the files.
+    @type filelist: list of strings
+
+    """
+    buf = bytearray(READ_SIZE)
+    for path in filelist:
+        f = open(path, 'rb', 0)
+        try:
+            while f.readinto(buf) > 0:
+                pass
+        finally:
+            f.close()
+
+
+class Stager(object):
+    """Copies of file sets in a tmpfs, shared by the test sets using them.
+
+    Each file set is copied once, when it is first staged, and removed when
+    every test set that staged it has released it.
+
+    """
+    def __init__(self):
+        self.staged = {}
+        self.lock = threading.Lock()
+    def stage(self, path, directory=STAGE_DIR):
+        """Copies I{path} into I{directory}, unless it is already staged.
+
+        @param path: The file or directory to stage.
+        @type path: string
+        @param directory: A directory in a tmpfs.
+        @type directory: string
+        @return: string with the path of the copy. It has the same name as
+                 I{path}.
+
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            if path in self.staged:
+                self.staged[path][2] += 1
+                return self.staged[path][1]
+            temp_dir = tempfile.mkdtemp(prefix='spodtest-staged-',
+                                        dir=directory)
+            copy = os.path.join(temp_dir, os.path.basename(path))
+            logging.info("Staging %s in %s" % (path, copy))
+            try:
+                if os.path.isdir(path):
+                    shutil.copytree(path, copy, symlinks=True)
+                else:
+                    shutil.copy2(path, copy)
+            except (IOError, OSError, shutil.Error), e:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                raise CacheError("Unable to stage %s in %s: %s" % (
+                                    path, directory, e))
+            self.staged[path] = [temp_dir, copy, 1]
+            return copy
+    def release(self, path):
+        """Releases a file set staged with L{stage}, removing the copy if no
+        other test set uses it.
+
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            if path not in self.staged:
+                return
+            self.staged[path][2] -= 1
+            if self.staged[path][2] == 0:
+                shutil.rmtree(self.staged[path][0], ignore_errors=True)
+                del self.staged[path]
+
+stager = Stager()
+
+
+class Error(Exception):
+    pass
+
+class CacheError(Error):
+    pass
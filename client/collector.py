@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+#
+#            collector.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import signal
+import logging
+import threading
+
+import engine
+import timer
+import sampler
+
+# Shell script run on the remote host. It lists the block devices once, and
+# then prints the counters between @sample and @end lines until it is
+# killed. Only a POSIX shell and the tools every Linux host has are needed.
+SCRIPT = """ls /sys/block | sed 's/^/@device /'
+while :; do
+echo @sample
+grep '^cpu' /proc/stat
+cat /proc/diskstats
+grep -E '^(MemTotal|MemAvailable):' /proc/meminfo
+sed 's/^/@pressure /' /proc/pressure/memory 2>/dev/null
+echo @end
+sleep %(interval)s || exit
+done"""
+# Fields of a remote utilisation summary. cpu, cpu_max_core, iowait,
+# disk_write and disk_busy are as in L{sampler.FIELDS}. mem_used is the
+# largest share of memory that was not available, and mem_pressure the share
+# of time some task was stalled waiting for memory, where the kernel reports
+# it.
+FIELDS = ('cpu', 'cpu_max_core', 'iowait', 'disk_write', 'disk_busy',
+            'mem_used', 'mem_pressure')
+# Seconds to wait for a sample after a run, on top of the interval, before
+# the run is left without one.
+SAMPLE_GRACE = 5.0
+
+
+class RemoteSnapshot(sampler.Snapshot):
+    """The counters of the remote host at one point in time. """
+    def __init__(self, time, lines, devices):
+        """Parses a snapshot printed by L{SCRIPT}.
+
+        @param time: When the snapshot was received, by L{timer.monotonic}.
+        @type time: float
+        @param lines: Lines between @sample and @end.
+        @type lines: list of strings
+        @param devices: Names of the block devices of the remote host.
+        @type devices: list of strings
+
+        """
+        self.time = time
+        (self.cpu, self.cores) = sampler.parse_stat(lines)
+        self.disks = sampler.parse_diskstats(lines, devices)
+        self.net = {}
+        self.mem_total = None
+        self.mem_available = None
+        self.stalled = None
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            if fields[0] == 'MemTotal:':
+                self.mem_total = int(fields[1])
+            elif fields[0] == 'MemAvailable:':
+                self.mem_available = int(fields[1])
+            elif fields[:2] == ['@pressure', 'some']:
+                for field in fields[2:]:
+                    if field.startswith('total='):
+                        self.stalled = int(field[len('total='):])
+    def is_valid(self):
+        """Checks whether the CPU times were found. """
+        return self.cpu is not None
+    def get_mem_used(self):
+        """Gets the share of memory that was not available.
+
+        @return: float, or None if it is not known.
+
+        """
+        if not self.mem_total or self.mem_available is None:
+            return None
+        return 1.0 - float(self.mem_available)/self.mem_total
+    def get_utilisation(self, previous, snapshots=None):
+        """Gets the utilisation of the remote host since I{previous}.
+
+        @param snapshots: The snapshots from I{previous} to this one, whose
+                          largest memory use is reported.
+        @type snapshots: list of L{RemoteSnapshot}
+        @return: dict with the keys in L{FIELDS}, with None for values that
+                 cannot be found.
+
+        """
+        utilisation = super(RemoteSnapshot, self).get_utilisation(previous,
+                                                                    {})
+        result = dict((field, utilisation.get(field)) for field in FIELDS)
+        if snapshots is None:
+            snapshots = [previous, self]
+        used = [snapshot.get_mem_used() for snapshot in snapshots
+                if snapshot.get_mem_used() is not None]
+        if len(used) > 0:
+            result['mem_used'] = max(used)
+        elapsed = self.time - previous.time
+        if self.stalled is not None and previous.stalled is not None and \
+                elapsed > 0:
+            # The stall time is counted in microseconds.
+            result['mem_pressure'] = min(1.0,
+                        (self.stalled - previous.stalled)/1000000.0/elapsed)
+        return result
+
+
+class RemoteCollector(object):
+    """Samples the utilisation of the remote host while a test set runs.
+
+    L{SCRIPT} is started on the host with one ssh session, or with a local
+    shell for the local host, and prints the counters of the host every
+    I{interval} seconds. Each snapshot is stamped with the local time it is
+    received, so no clocks have to be synchronised, and the utilisation of a
+    run is found from the snapshots around its start and end.
+
+    """
+    def __init__(self, target, interval=1.0, ssh_args=None):
+        """Initializes a collector that has not been started.
+
+        @param target: The host, or user@host, to sample, or None for the
+                       local host.
+        @type target: string
+        @param interval: Seconds between snapshots.
+        @type interval: float
+        @param ssh_args: Extra arguments for ssh.
+        @type ssh_args: list of strings
+
+        """
+        self.target = target
+        self.interval = interval
+        if ssh_args is None:
+            ssh_args = []
+        self.ssh_args = ssh_args
+        self.devices = []
+        self.lines = None
+        self.snapshots = []
+        self.job = None
+        self.thread = None
+        self.stopped = False
+        self.condition = threading.Condition()
+    def get_host(self):
+        """Gets the name of the sampled host. """
+        if self.target is None:
+            return 'localhost'
+        return self.target
+    def get_argv(self):
+        """Gets the command that runs L{SCRIPT} on the host.
+
+        @return: list of strings
+
+        """
+        script = SCRIPT % {'interval': "%g" % self.interval}
+        if self.target is None:
+            return ['sh', '-c', script]
+        return (['ssh', '-oBatchMode=yes'] + self.ssh_args +
+                [self.target, script])
+    def start(self):
+        """Starts the script, and reads its output in a thread of its own.
+
+        Waits for the first snapshot, so the first run has one before it.
+        Raises a L{CollectorError} if the script cannot be started.
+
+        """
+        self.stopped = False
+        self.snapshots = []
+        self.job = engine.Job(self.get_argv(), line_callback=self.read_line,
+                            stderr_callback=logging.debug)
+        runner = engine.Engine()
+        try:
+            runner.start(self.job)
+        except OSError, e:
+            raise CollectorError("Unable to sample %s: %s" % (
+                                self.get_host(), e))
+        self.thread = threading.Thread(target=self.run, args=(runner,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.wait_for(0)
+    def run(self, runner):
+        """Reads the output of the script until it exits or is stopped. """
+        try:
+            runner.wait([self.job])
+        except engine.EngineError, e:
+            logging.warning("Sampling of %s failed: %s" % (self.get_host(),
+                                                            e))
+        else:
+            if not self.stopped:
+                logging.warning("Sampling of %s exited with %s" % (
+                                self.get_host(), self.job.returncode))
+        finally:
+            self.condition.acquire()
+            try:
+                self.stopped = True
+                self.condition.notify_all()
+            finally:
+                self.condition.release()
+    def read_line(self, line):
+        """Collects a line printed by the script, and keeps a snapshot when
+        it ends.
+
+        """
+        line = line.rstrip('\n')
+        if line.startswith('@device '):
+            self.devices.append(line[len('@device '):].strip())
+        elif line == '@sample':
+            self.lines = []
+        elif line == '@end' and self.lines is not None:
+            snapshot = RemoteSnapshot(timer.monotonic(), self.lines,
+                                    self.devices)
+            self.lines = None
+            if not snapshot.is_valid():
+                return
+            self.condition.acquire()
+            try:
+                self.snapshots.append(snapshot)
+                self.condition.notify_all()
+            finally:
+                self.condition.release()
+        elif self.lines is not None:
+            self.lines.append(line)
+    def wait_for(self, time):
+        """Waits until a snapshot received after I{time} has arrived, the
+        script has exited, or L{SAMPLE_GRACE} seconds more than the interval
+        have passed.
+
+        """
+        deadline = timer.monotonic() + self.interval + SAMPLE_GRACE
+        self.condition.acquire()
+        try:
+            while not self.stopped and (len(self.snapshots) == 0 or
+                                        self.snapshots[-1].time < time):
+                remaining = deadline - timer.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return list(self.snapshots)
+        finally:
+            self.condition.release()
+    def get_utilisation(self, start, end):
+        """Gets the utilisation of the host over a run.
+
+        The utilisation is taken between the last snapshot received before
+        the run started and the first one received after it ended, so runs
+        shorter than the interval are covered by a longer window.
+
+        @param start: When the run started, by L{timer.monotonic}.
+        @type start: float
+        @param end: When the run ended.
+        @type end: float
+        @return: dict with the keys in L{FIELDS}, or None if there are not
+                 two snapshots around the run.
+
+        """
+        snapshots = self.wait_for(end)
+        before = [i for (i, snapshot) in enumerate(snapshots)
+                    if snapshot.time <= start]
+        after = [i for (i, snapshot) in enumerate(snapshots)
+                    if snapshot.time >= end]
+        first = 0
+        if len(before) > 0:
+            first = before[-1]
+        last = len(snapshots) - 1
+        if len(after) > 0:
+            last = after[0]
+        if last <= first:
+            return None
+        return snapshots[last].get_utilisation(snapshots[first],
+                                                snapshots[first:last + 1])
+    def stop(self):
+        """Stops the script and waits for the thread to finish. """
+        if self.thread is None:
+            return
+        self.condition.acquire()
+        try:
+            self.stopped = True
+        finally:
+            self.condition.release()
+        if not self.job.is_done():
+            self.job.signal(signal.SIGTERM)
+        self.thread.join()
+        self.thread = None
+
+
+class Error(Exception):
+    pass
+
+class CollectorError(Error):
+    pass
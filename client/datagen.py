@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+#
+#            datagen.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import math
+import json
+import random
+import shutil
+import hashlib
+import logging
+import binascii
+import optparse
+
+PROFILE_FILE = 'fs_profile'
+GENERATOR_VERSION = 1
+# Size of the block file contents are taken from. Incompressible blocks are
+# larger than the window of the compressors the testers use, so repeating
+# the block does not make large files compressible.
+BLOCK_SIZE = 16 * 1024 * 1024
+WORDS = ('spod', 'test', 'transfer', 'data', 'set', 'file', 'speed', 'host',
+        'network', 'protocol', 'option', 'cipher', 'block', 'stream')
+
+# Size distributions and directory layouts of the data set profiles. Sizes
+# are in bytes. Files are spread over the leaf directories of a tree that is
+# depth levels deep with fanout directories in each.
+PROFILES = {
+    'tiny': {
+        'files': 100000,
+        'distribution': 'uniform',
+        'min_size': 1,
+        'max_size': 4096,
+        'depth': 2,
+        'fanout': 16,
+    },
+    'huge': {
+        'files': 4,
+        'distribution': 'fixed',
+        'size': 1024 * 1024 * 1024,
+        'depth': 0,
+        'fanout': 1,
+    },
+    'lognormal': {
+        'files': 10000,
+        'distribution': 'lognormal',
+        'median_size': 64 * 1024,
+        'sigma': 2.0,
+        'max_size': 256 * 1024 * 1024,
+        'depth': 2,
+        'fanout': 8,
+    },
+    'deep': {
+        'files': 20000,
+        'distribution': 'uniform',
+        'min_size': 1,
+        'max_size': 16 * 1024,
+        'depth': 10,
+        'fanout': 2,
+    },
+}
+CONTENTS = ('incompressible', 'compressible')
+
+def get_parameters(profile, seed, content='incompressible', files=None,
+                    total_size=None):
+    """Gets the parameters that decide the contents of a data set.
+
+    @param profile: Name of a profile in L{PROFILES}.
+    @type profile: string
+    @param seed: Seed for the random number generator.
+    @type seed: int
+    @param content: Either C{incompressible} or C{compressible}.
+    @type content: string
+    @param files: Number of files, overriding the profile.
+    @type files: int
+    @param total_size: Total size in bytes. File sizes from the profile are
+                       scaled to add up to this.
+    @type total_size: int
+    @return: dict
+
+    """
+    if profile not in PROFILES:
+        raise DataGenError("Unknown profile %s, must be one of: %s" % (
+                            profile, ", ".join(sorted(PROFILES))))
+    if content not in CONTENTS:
+        raise DataGenError("Unknown content %s, must be one of: %s" % (
+                            content, ", ".join(CONTENTS)))
+    params = dict(PROFILES[profile])
+    params.update({
+        'profile': profile,
+        'seed': seed,
+        'content': content,
+        'total_size': total_size,
+        'version': GENERATOR_VERSION,
+    })
+    if files is not None:
+        params['files'] = files
+    return params
+
+def get_hash(params):
+    """Gets a hash identifying the data set generated from I{params}.
+
+    @return: string
+
+    """
+    return hashlib.sha1(json.dumps(params, sort_keys=True)).hexdigest()
+
+def get_sizes(params, rng):
+    """Draws the size of each file.
+
+    @return: list of int
+
+    """
+    sizes = []
+    for i in range(params['files']):
+        if params['distribution'] == 'fixed':
+            size = params['size']
+        elif params['distribution'] == 'uniform':
+            size = rng.randint(params['min_size'], params['max_size'])
+        else:
+            size = int(rng.lognormvariate(math.log(params['median_size']),
+                                            params['sigma']))
+            size = min(size, params['max_size'])
+        sizes.append(size)
+    total_size = params['total_size']
+    if total_size is not None and len(sizes) > 0:
+        scale = float(total_size)/max(1, sum(sizes))
+        sizes = [int(size * scale) for size in sizes]
+        # Rounding leaves a few bytes, give them to the last file.
+        sizes[-1] += total_size - sum(sizes)
+    return sizes
+
+def get_dirs(params):
+    """Gets the relative paths of the leaf directories.
+
+    @return: list of strings, with '' for the root of the data set.
+
+    """
+    dirs = ['']
+    for level in range(params['depth']):
+        dirs = [os.path.join(d, 'd%03d' % i)
+                for d in dirs for i in range(params['fanout'])]
+    return dirs
+
+def get_block(params, rng):
+    """Creates the block that file contents are taken from.
+
+    @return: string of L{BLOCK_SIZE} bytes.
+
+    """
+    if params['content'] == 'incompressible':
+        return binascii.unhexlify('%0*x' % (BLOCK_SIZE * 2,
+                                    rng.getrandbits(BLOCK_SIZE * 8)))
+    words = []
+    length = 0
+    while length < BLOCK_SIZE:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:BLOCK_SIZE]
+
+def write_file(path, size, block, offset):
+    """Writes I{size} bytes from I{block} to I{path}, starting at I{offset}
+    in the block and wrapping around at its end.
+
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+    try:
+        view = memoryview(block)
+        while size > 0:
+            n = min(size, len(block) - offset)
+            written = os.write(fd, view[offset:offset + n])
+            size -= written
+            offset = (offset + written) % len(block)
+    finally:
+        os.close(fd)
+
+def read_hash(directory):
+    """Reads the hash of the profile a data set was generated from.
+
+    @return: string, or None if I{directory} is not a generated data set.
+
+    """
+    try:
+        f = open(os.path.join(directory, PROFILE_FILE), 'r')
+    except IOError, ioe:
+        return None
+    try:
+        return json.load(f).get('hash')
+    except ValueError, ve:
+        return None
+    finally:
+        f.close()
+
+def generate(directory, params, name=None, force=False):
+    """Generates a data set in I{directory}.
+
+    If I{directory} already holds a data set generated from the same
+    parameters, it is reused as it is. C{fs_profile} is written last, so a
+    data set that was only partly generated is never reused.
+
+    @param directory: Directory to generate the data set in.
+    @type directory: string
+    @param params: Parameters from L{get_parameters}.
+    @type params: dict
+    @param name: Name of the file set, written to C{fs_name}. Defaults to
+                 the profile and seed.
+    @type name: string
+    @param force: Whether to delete I{directory} if it holds something other
+                  than this data set.
+    @type force: bool
+    @return: bool, True if the data set was generated and False if an
+             existing one was reused.
+
+    """
+    digest = get_hash(params)
+    if read_hash(directory) == digest:
+        logging.info("Reusing data set %s with profile hash %s" % (
+                    directory, digest))
+        return False
+    if os.path.exists(directory) and (not os.path.isdir(directory) or
+                                        len(os.listdir(directory)) > 0):
+        if not force:
+            raise DataGenError(("%s exists and is not a data set generated "
+                                "with these parameters") % directory)
+        logging.warning("Deleting %s to generate a new data set" % directory)
+        shutil.rmtree(directory)
+    if name is None:
+        name = "%s-%s" % (params['profile'], params['seed'])
+    rng = random.Random(params['seed'])
+    sizes = get_sizes(params, rng)
+    dirs = get_dirs(params)
+    block = get_block(params, rng)
+    for d in dirs:
+        path = os.path.join(directory, d)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    for (i, size) in enumerate(sizes):
+        path = os.path.join(directory, dirs[i % len(dirs)], 'f%07d' % i)
+        write_file(path, size, block, rng.randrange(len(block)))
+    f = open(os.path.join(directory, 'fs_name'), 'w')
+    f.write("%s\n" % name)
+    f.close()
+    f = open(os.path.join(directory, PROFILE_FILE), 'w')
+    json.dump({'hash': digest, 'parameters': params}, f, sort_keys=True,
+                indent=1)
+    f.close()
+    logging.info("Generated data set %s with %d files and %d bytes" % (
+                directory, len(sizes), sum(sizes)))
+    return True
+
+def main(args):
+    """Runs the generate subcommand.
+
+    @param args: Command line arguments after the subcommand.
+    @type args: list of strings
+    @return: int exit status
+
+    """
+    parser = optparse.OptionParser(
+        usage="%prog generate [options] DIRECTORY",
+        description=("Generates a data set from a profile and a seed. "
+                    "Profiles: %s.") % ", ".join(sorted(PROFILES)))
+    parser.add_option("-p", "--profile", default="lognormal",
+                    help="size distribution profile [default: %default]")
+    parser.add_option("-s", "--seed", type="int", default=0,
+                    help="random seed [default: %default]")
+    parser.add_option("-c", "--content", default="incompressible",
+                    choices=CONTENTS,
+                    help=("incompressible or compressible "
+                        "[default: %default]"))
+    parser.add_option("-n", "--name", help="file set name for fs_name")
+    parser.add_option("--files", type="int",
+                    help="number of files, overriding the profile")
+    parser.add_option("--total-size", type="int",
+                    help="total size in bytes, overriding the profile")
+    parser.add_option("-f", "--force", action="store_true", default=False,
+                    help="delete DIRECTORY if it holds another data set")
+    (options, arguments) = parser.parse_args(args)
+    if len(arguments) != 1:
+        parser.error("exactly one DIRECTORY is required")
+    try:
+        params = get_parameters(options.profile, options.seed,
+                                options.content, options.files,
+                                options.total_size)
+        if generate(arguments[0], params, options.name, options.force):
+            sys.stdout.write("Generated %s\n" % arguments[0])
+        else:
+            sys.stdout.write("Reusing %s\n" % arguments[0])
+    except (DataGenError, OSError, IOError), e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    return 0
+
+
+class Error(Exception):
+    pass
+
+class DataGenError(Error):
+    pass
@@ -20,5 +20,13 @@
 import doctest
 
 import testers.base
+import testers.local
+import resultdb
+import report
+import overhead
 
 doctest.testmod(testers.base)
+doctest.testmod(testers.local)
+doctest.testmod(resultdb)
+doctest.testmod(report)
+doctest.testmod(overhead)
@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+#
+#            engine.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import pty
+import fcntl
+import errno
+import select
+import signal
+import struct
+import termios
+import logging
+import resource
+import subprocess
+
+import timer
+
+# Seconds between SIGTERM and SIGKILL when a job is cancelled.
+KILL_GRACE = 5.0
+# Seconds between checks for exited processes that have closed their output.
+REAP_INTERVAL = 0.005
+# Seconds between checks for exited processes whose output is still open,
+# which happens when a process leaves a child behind in the background.
+OPEN_REAP_INTERVAL = 0.05
+# Argument that separates the commands of a pipeline.
+PIPE = '|'
+
+def split_pipeline(argv):
+    """Splits I{argv} into the commands of a pipeline.
+
+    @return: list of argument lists, with one command if I{argv} has no
+             L{PIPE} arguments.
+
+    """
+    commands = [[]]
+    for arg in argv:
+        if arg == PIPE:
+            commands.append([])
+        else:
+            commands[-1].append(arg)
+    if any(len(command) == 0 for command in commands):
+        raise EngineError("Empty command in pipeline: %s" % " ".join(argv))
+    return commands
+
+def join_process_group(pgid):
+    """Creates a preexec_fn that puts a process in the group I{pgid}. """
+    def preexec():
+        os.setpgid(0, pgid)
+    return preexec
+
+def add_rusage(a, b):
+    """Adds the resource usage of two processes.
+
+    @return: resource.struct_rusage, with the larger of the maximum resident
+             set sizes.
+
+    """
+    values = [x + y for (x, y) in zip(a, b)]
+    values[2] = max(a.ru_maxrss, b.ru_maxrss)
+    return resource.struct_rusage(values)
+
+def set_controlling_terminal():
+    """Makes standard output the controlling terminal of a new session.
+
+    Used as preexec_fn for commands that only draw their progress meter when
+    they are in the foreground of their terminal.
+
+    """
+    os.setsid()
+    fcntl.ioctl(1, termios.TIOCSCTTY, 0)
+
+class Job(object):
+    """A command run by an L{Engine}.
+
+    The command is given as an argument list and is executed directly,
+    without a shell. It is started in its own process group, so that
+    cancelling the job also stops any processes it has started, such as ssh.
+
+    The argument list may hold a pipeline, with the commands separated by
+    L{PIPE} arguments. Every command of a pipeline is in the same process
+    group, standard output is read from the last command and standard error
+    from all of them. The job fails if any command fails, and its resource
+    usage is that of all the commands.
+
+    """
+    def __init__(self, argv, line_callback=None, stderr_callback=None,
+                    use_pty=False, timeout=None, discard_output=False):
+        """Initializes a job that has not been started.
+
+        @param argv: The command and its arguments.
+        @type argv: list of strings
+        @param line_callback: Called with each line the command writes to
+                              standard output. Both newlines and carriage
+                              returns end a line.
+        @type line_callback: function
+        @param stderr_callback: Called with each line the command writes to
+                                standard error. If this is None, standard
+                                error is not redirected.
+        @type stderr_callback: function
+        @param use_pty: Whether standard output should be a pseudo terminal.
+        @type use_pty: bool
+        @param timeout: Seconds the job may run before it is cancelled.
+        @type timeout: float
+        @param discard_output: Whether standard output should go to
+                               /dev/null instead of being read. A process
+                               that leaves a child in the background
+                               holding its output is then reaped as soon
+                               as it exits.
+        @type discard_output: bool
+
+        """
+        self.argv = argv
+        self.line_callback = line_callback
+        self.stderr_callback = stderr_callback
+        self.use_pty = use_pty
+        self.timeout = timeout
+        self.discard_output = discard_output
+        self.process = None
+        self.processes = []
+        self.returncodes = {}
+        self.returncode = None
+        self.rusage = None
+        self.start_time = None
+        self.end_time = None
+        self.cancel_time = None
+        self.killed = False
+        # Maps open file descriptors to [callback, unfinished line, file
+        # object or None].
+        self.outputs = {}
+    def __str__(self):
+        return " ".join(self.argv)
+    def start(self):
+        """Starts the command.
+
+        @return: list of file descriptors to read output from.
+
+        """
+        commands = split_pipeline(self.argv)
+        if len(commands) > 1:
+            return self.start_pipeline(commands)
+        stderr = None
+        if self.stderr_callback is not None:
+            stderr = subprocess.PIPE
+        self.start_time = timer.monotonic()
+        if self.use_pty:
+            (master, slave) = pty.openpty()
+            fcntl.ioctl(slave, termios.TIOCSWINSZ,
+                        struct.pack('HHHH', 24, 200, 0, 0))
+            try:
+                self.process = subprocess.Popen(self.argv, stdout=slave,
+                                    stderr=stderr, close_fds=True,
+                                    preexec_fn=set_controlling_terminal)
+            finally:
+                os.close(slave)
+            self.outputs[master] = [self.line_callback, '', None]
+        elif self.discard_output:
+            devnull = open(os.devnull, 'w')
+            try:
+                self.process = subprocess.Popen(self.argv, stdout=devnull,
+                                    stderr=stderr, close_fds=True,
+                                    preexec_fn=os.setsid)
+            finally:
+                devnull.close()
+        else:
+            self.process = subprocess.Popen(self.argv, stdout=subprocess.PIPE,
+                                    stderr=stderr, close_fds=True,
+                                    preexec_fn=os.setsid)
+            self.outputs[self.process.stdout.fileno()] = [
+                            self.line_callback, '', self.process.stdout]
+        self.processes = [self.process]
+        if self.process.stderr is not None:
+            self.outputs[self.process.stderr.fileno()] = [
+                            self.stderr_callback, '', self.process.stderr]
+        return self.set_nonblocking()
+    def start_pipeline(self, commands):
+        """Starts the commands of a pipeline.
+
+        Pipelines are never run on a pseudo terminal, and stay in the session
+        of SPODTest.
+
+        @return: list of file descriptors to read output from.
+
+        """
+        stderr = None
+        if self.stderr_callback is not None:
+            (stderr_read, stderr) = os.pipe()
+            self.outputs[stderr_read] = [self.stderr_callback, '', None]
+        self.start_time = timer.monotonic()
+        stdin = None
+        try:
+            for command in commands:
+                if len(self.processes) == 0:
+                    # A process can only join a group in its own session,
+                    # so the pipeline gets a new group rather than a new
+                    # session.
+                    preexec = join_process_group(0)
+                else:
+                    preexec = join_process_group(self.processes[0].pid)
+                process = subprocess.Popen(command, stdin=stdin,
+                                    stdout=subprocess.PIPE, stderr=stderr,
+                                    close_fds=True, preexec_fn=preexec)
+                self.processes.append(process)
+                if stdin is not None:
+                    # Only the next command reads from the pipe.
+                    stdin.close()
+                stdin = process.stdout
+        except:
+            if len(self.processes) > 0:
+                self.process = self.processes[0]
+                self.signal(signal.SIGKILL)
+                for process in self.processes:
+                    os.waitpid(process.pid, 0)
+            raise
+        finally:
+            if stderr is not None:
+                os.close(stderr)
+        self.process = self.processes[0]
+        self.outputs[stdin.fileno()] = [self.line_callback, '', stdin]
+        return self.set_nonblocking()
+    def set_nonblocking(self):
+        """Makes the outputs of the job non-blocking.
+
+        @return: list of the file descriptors of the outputs.
+
+        """
+        for fd in self.outputs:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        return self.outputs.keys()
+    def is_done(self):
+        """Checks whether the command has exited and been waited for.
+
+        @return: bool
+
+        """
+        return self.returncode is not None
+    def is_cancelled(self):
+        """Checks whether the job has been cancelled.
+
+        @return: bool
+
+        """
+        return self.cancel_time is not None
+    def get_duration(self):
+        """Gets the time from the job was started until it exited.
+
+        @return: float seconds, or None if the job has not finished.
+
+        """
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+    def read(self, fd):
+        """Reads available output from I{fd} and passes complete lines on.
+
+        @return: bool, False if I{fd} has reached end of file.
+
+        """
+        try:
+            data = os.read(fd, 65536)
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return True
+            if e.errno != errno.EIO:
+                raise
+            # The other end of a pseudo terminal has been closed.
+            data = ''
+        (callback, buf, fileobj) = self.outputs[fd]
+        if not data:
+            if buf and callback is not None:
+                callback(buf)
+            self.close(fd)
+            return False
+        lines = re.split(r'[\r\n]', buf + data)
+        self.outputs[fd][1] = lines.pop()
+        if callback is not None:
+            for line in lines:
+                if line:
+                    callback(line)
+        return True
+    def close(self, fd):
+        """Closes the output I{fd}. """
+        fileobj = self.outputs.pop(fd)[2]
+        if fileobj is not None:
+            fileobj.close()
+        else:
+            os.close(fd)
+    def reap(self, block=False):
+        """Waits for the processes of the job, if they have exited.
+
+        The return value of a pipeline is that of the last command that
+        failed, as with pipefail in bash.
+
+        @param block: Whether to wait until the processes have exited.
+        @type block: bool
+        @return: bool indicating whether every process has been waited for.
+
+        """
+        if self.returncode is not None:
+            return True
+        for process in self.processes:
+            if process.pid in self.returncodes:
+                continue
+            try:
+                (pid, status, rusage) = os.wait4(process.pid,
+                                            0 if block else os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    return False
+                raise
+            if pid == 0:
+                return False
+            if os.WIFSIGNALED(status):
+                returncode = -os.WTERMSIG(status)
+            else:
+                returncode = os.WEXITSTATUS(status)
+            # Keeps subprocess from waiting for the process again.
+            process.returncode = returncode
+            self.returncodes[process.pid] = returncode
+            if self.rusage is None:
+                self.rusage = rusage
+            else:
+                self.rusage = add_rusage(self.rusage, rusage)
+        self.end_time = timer.monotonic()
+        self.returncode = 0
+        for process in self.processes:
+            if process.returncode != 0:
+                self.returncode = process.returncode
+        return True
+    def cancel(self):
+        """Asks the command and everything it started to terminate.
+
+        The process group is killed if it has not exited L{KILL_GRACE}
+        seconds later.
+
+        """
+        if self.is_done() or self.process is None:
+            return
+        if self.cancel_time is None:
+            self.cancel_time = timer.monotonic()
+            logging.warning("Cancelling %s" % self)
+            self.signal(signal.SIGTERM)
+    def signal(self, signum):
+        try:
+            os.killpg(self.process.pid, signum)
+        except OSError, e:
+            if e.errno != errno.ESRCH:
+                raise
+    def check_deadlines(self, now):
+        """Cancels or kills the job if it has run out of time.
+
+        @return: float seconds until the next deadline of the job, or None.
+
+        """
+        if self.is_done():
+            return None
+        if self.cancel_time is not None:
+            if self.killed:
+                return None
+            remaining = self.cancel_time + KILL_GRACE - now
+            if remaining <= 0:
+                self.killed = True
+                self.signal(signal.SIGKILL)
+                return None
+            return remaining
+        if self.timeout is not None:
+            remaining = self.start_time + self.timeout - now
+            if remaining <= 0:
+                self.cancel()
+                return KILL_GRACE
+            return remaining
+        return None
+
+
+class Engine(object):
+    """Runs several jobs at the same time from a single thread.
+
+    The output of every running job is read with poll(), so no job blocks on
+    a full pipe and no thread is needed per job.
+
+    """
+    def __init__(self):
+        self.jobs = []
+        self.poller = select.poll()
+        self.fd_jobs = {}
+    def start(self, job):
+        """Starts I{job}.
+
+        @param job: The job to start.
+        @type job: L{Job}
+        @return: the started job.
+
+        """
+        logging.debug("Starting command: %s" % job)
+        for fd in job.start():
+            self.fd_jobs[fd] = job
+            self.poller.register(fd, select.POLLIN | select.POLLPRI)
+        self.jobs.append(job)
+        return job
+    def cancel(self, job=None):
+        """Cancels I{job}, or every running job if I{job} is None. """
+        if job is not None:
+            job.cancel()
+            return
+        for job in self.jobs:
+            job.cancel()
+    def wait(self, jobs=None):
+        """Runs until the given jobs have finished.
+
+        If the wait is interrupted, for instance by KeyboardInterrupt, all
+        running jobs are cancelled and killed before the exception is passed
+        on.
+
+        @param jobs: The jobs to wait for. Defaults to all started jobs.
+        @type jobs: list of L{Job}
+        @return: list of the jobs waited for.
+
+        """
+        if jobs is None:
+            jobs = list(self.jobs)
+        try:
+            while not all(job.is_done() for job in jobs):
+                self.poll()
+        except BaseException:
+            for job in self.jobs:
+                if not job.is_done():
+                    job.signal(signal.SIGKILL)
+                    job.reap(block=True)
+            raise
+        self.jobs = [job for job in self.jobs if not job.is_done()]
+        return jobs
+    def run(self, job):
+        """Starts I{job} and waits for it to finish.
+
+        @return: the finished job.
+
+        """
+        self.start(job)
+        self.wait([job])
+        return job
+    def poll(self):
+        """Reads available output, reaps exited jobs and handles timeouts.
+
+        """
+        now = timer.monotonic()
+        timeout = None
+        for job in self.jobs:
+            remaining = job.check_deadlines(now)
+            if remaining is not None and (timeout is None or
+                                            remaining < timeout):
+                timeout = remaining
+        waiting = [job for job in self.jobs
+                    if len(job.outputs) == 0 and not job.is_done()]
+        if len(waiting) > 0 and len(self.fd_jobs) == 0 and timeout is None \
+            and len(waiting) == 1:
+            # Nothing else to do, so wait for the process to exit.
+            waiting[0].reap(block=True)
+            return
+        if len(waiting) > 0:
+            timeout = min(timeout or REAP_INTERVAL, REAP_INTERVAL)
+        elif len(self.fd_jobs) > 0:
+            timeout = min(timeout or OPEN_REAP_INTERVAL, OPEN_REAP_INTERVAL)
+        if timeout is None:
+            timeout_ms = -1
+        else:
+            timeout_ms = max(0, int(timeout * 1000))
+        try:
+            events = self.poller.poll(timeout_ms)
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            events = []
+        for (fd, event) in events:
+            job = self.fd_jobs[fd]
+            if not job.read(fd):
+                self.unregister(fd)
+        for job in self.jobs:
+            if job.is_done() or not job.reap():
+                continue
+            # Output still open after the process has exited is held by
+            # something it left behind, so only what is there now is read.
+            for fd in job.outputs.keys():
+                while job.read(fd):
+                    if fd not in job.outputs or not self.readable(fd):
+                        break
+                if fd in job.outputs:
+                    job.close(fd)
+                self.unregister(fd)
+    def readable(self, fd):
+        """Checks whether I{fd} has output that can be read right away. """
+        return len(select.select([fd], [], [], 0)[0]) > 0
+    def unregister(self, fd):
+        """Stops polling I{fd}. """
+        if fd in self.fd_jobs:
+            self.poller.unregister(fd)
+            del self.fd_jobs[fd]
+
+
+class Error(Exception):
+    pass
+
+class EngineError(Error):
+    pass
@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+#
+#            linkemu.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import random
+import socket
+import logging
+import threading
+
+import timer
+
+ADDRESS = '127.0.0.1'
+# Config sections named LINK_PREFIX and a name define link profiles of their
+# own.
+LINK_PREFIX = 'link.'
+# Largest number of bytes read from a socket at a time.
+READ_SIZE = 64 * 1024
+# Bytes queued in each direction on top of those in flight, like the buffer
+# of a router. The reader stops reading when it is full, so the sender is
+# slowed down by TCP flow control.
+QUEUE_SIZE = 256 * 1024
+DEFAULT_BURST = 64 * 1024
+# Seconds between checks for new connections, so the proxy notices that it
+# has been stopped.
+ACCEPT_INTERVAL = 0.1
+
+
+class LinkProfile(object):
+    """The delay, jitter and bandwidth of an emulated link.
+
+    Upload is the direction from the commands to the host, which the files
+    are sent in, and download the direction back.
+
+    """
+    def __init__(self, name, delay, jitter=0.0, bandwidth=None,
+                    upload_bandwidth=None, burst=DEFAULT_BURST):
+        """Initializes a link profile.
+
+        @param name: Name of the profile.
+        @type name: string
+        @param delay: One way delay in milliseconds.
+        @type delay: float
+        @param jitter: Standard deviation of the delay in milliseconds.
+        @type jitter: float
+        @param bandwidth: Bandwidth in Mbit/s, or None for no limit.
+        @type bandwidth: float
+        @param upload_bandwidth: Bandwidth of the upload direction in
+                                 Mbit/s, if it differs from I{bandwidth}.
+        @type upload_bandwidth: float
+        @param burst: Most bytes sent at once at full speed.
+        @type burst: int
+
+        """
+        self.name = name
+        self.delay = delay
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        if upload_bandwidth is None:
+            upload_bandwidth = bandwidth
+        self.upload_bandwidth = upload_bandwidth
+        self.burst = burst
+    def get_rate(self, upload):
+        """Gets the bandwidth of a direction.
+
+        @param upload: Whether to get the upload direction.
+        @type upload: bool
+        @return: float bytes per second, or None for no limit.
+
+        """
+        bandwidth = self.bandwidth
+        if upload:
+            bandwidth = self.upload_bandwidth
+        if bandwidth is None:
+            return None
+        return bandwidth * 1000000.0 / 8
+    def __str__(self):
+        bandwidth = "unlimited"
+        if self.bandwidth is not None:
+            bandwidth = "%g/%g Mbit/s" % (self.bandwidth,
+                                            self.upload_bandwidth)
+        return "%s (%gms +- %gms, %s, burst %d bytes)" % (self.name,
+                    self.delay, self.jitter, bandwidth, self.burst)
+
+# Links the profiles are modelled on. The delays are one way, so the round
+# trip time is twice the delay.
+PROFILES = {
+    'lan': LinkProfile('lan', 0.1, 0.0, 1000, burst=256 * 1024),
+    'metro': LinkProfile('metro', 5, 0.5, 100),
+    'transatlantic': LinkProfile('transatlantic', 40, 2, 100),
+    'transpacific': LinkProfile('transpacific', 75, 3, 100),
+    'adsl': LinkProfile('adsl', 20, 5, 8, 1, burst=16 * 1024),
+    'mobile': LinkProfile('mobile', 35, 15, 20, 5, burst=16 * 1024),
+    'satellite': LinkProfile('satellite', 300, 10, 20, 3, burst=16 * 1024),
+}
+
+def read_profile(config, name):
+    """Reads the link profile I{name} from the config section
+    C{link.I{name}}, or gets the built in profile.
+
+    Options that a section leaves out are taken from the built in profile of
+    the same name, if there is one.
+
+    @return: L{LinkProfile}
+
+    """
+    section = LINK_PREFIX + name
+    base = PROFILES.get(name)
+    if not config.has_section(section):
+        if base is None:
+            raise LinkEmulationError(("Unknown link profile %s, must be one "
+                                "of: %s, or have a section %s") % (name,
+                                ", ".join(sorted(PROFILES)), section))
+        return base
+    if base is None:
+        base = LinkProfile(name, 0.0)
+    values = {}
+    for option in ('delay', 'jitter', 'bandwidth', 'upload_bandwidth'):
+        values[option] = getattr(base, option)
+        if config.has_option(section, option):
+            values[option] = config.getfloat(section, option)
+    burst = base.burst
+    if config.has_option(section, 'burst'):
+        burst = config.getint(section, 'burst')
+    if values['delay'] < 0 or values['jitter'] < 0 or burst < 1:
+        raise LinkEmulationError(("The delay and jitter of link profile %s "
+                                "must not be negative, and burst must be "
+                                "positive") % name)
+    if not config.has_option(section, 'upload_bandwidth'):
+        values['upload_bandwidth'] = None
+        if base.upload_bandwidth != base.bandwidth:
+            values['upload_bandwidth'] = base.upload_bandwidth
+    return LinkProfile(name, values['delay'], values['jitter'],
+                        values['bandwidth'], values['upload_bandwidth'], burst)
+
+
+class TokenBucket(object):
+    """Limits the rate of a direction, letting up to I{burst} bytes through
+    at once.
+
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.time = timer.monotonic()
+    def reserve(self, size, now):
+        """Takes I{size} bytes from the bucket.
+
+        @return: float time, by L{timer.monotonic}, when the bytes have been
+                 sent at the rate of the bucket.
+
+        """
+        if self.rate is None:
+            return now
+        if now > self.time:
+            self.tokens = min(self.burst,
+                                self.tokens + (now - self.time) * self.rate)
+            self.time = now
+        self.tokens -= size
+        if self.tokens < 0:
+            self.time += -self.tokens/self.rate
+            self.tokens = 0.0
+        return self.time
+
+
+class Channel(object):
+    """One direction of a proxied connection.
+
+    A reader thread stamps each chunk it reads with the time it is to be
+    delivered, from the bandwidth and delay of the link, and a writer thread
+    sends the chunks when their time has come. Chunks are never reordered,
+    so the jitter only delays them.
+
+    """
+    def __init__(self, source, destination, profile, upload, rng,
+                    finished):
+        """Initializes a direction that has not been started.
+
+        @param source: Socket to read from.
+        @param destination: Socket to write to.
+        @param profile: The emulated link.
+        @type profile: L{LinkProfile}
+        @param upload: Whether this is the upload direction.
+        @type upload: bool
+        @param rng: Random numbers for the jitter.
+        @type rng: random.Random
+        @param finished: Called when the direction has been closed.
+        @type finished: function
+
+        """
+        self.source = source
+        self.destination = destination
+        self.profile = profile
+        self.rng = rng
+        self.finished = finished
+        rate = profile.get_rate(upload)
+        self.bucket = TokenBucket(rate, profile.burst)
+        self.read_size = min(READ_SIZE, profile.burst)
+        # Room for the bytes in flight over the delay, and for the queue.
+        self.limit = QUEUE_SIZE + profile.burst
+        if rate is not None:
+            self.limit += int(rate * (profile.delay + 4 * profile.jitter)
+                                / 1000.0)
+        self.queue = []
+        self.queued = 0
+        self.last_release = 0.0
+        self.condition = threading.Condition()
+        self.threads = []
+    def start(self):
+        for target in (self.read, self.write):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+    def get_delay(self):
+        """Gets the delay of a chunk in seconds, with jitter. """
+        delay = self.profile.delay
+        if self.profile.jitter > 0:
+            delay = max(0.0, self.rng.gauss(delay, self.profile.jitter))
+        return delay/1000.0
+    def put(self, item, size):
+        """Queues I{item}, waiting while the queue is full. """
+        self.condition.acquire()
+        try:
+            while self.queued > 0 and self.queued + size > self.limit:
+                self.condition.wait()
+            self.queue.append(item)
+            self.queued += size
+            self.condition.notify_all()
+        finally:
+            self.condition.release()
+    def get(self):
+        """Takes the next item from the queue, waiting for one. """
+        self.condition.acquire()
+        try:
+            while len(self.queue) == 0:
+                self.condition.wait()
+            item = self.queue.pop(0)
+            if item is not None:
+                self.queued -= len(item[1])
+            self.condition.notify_all()
+            return item
+        finally:
+            self.condition.release()
+    def read(self):
+        """Reads chunks from the source until it is closed. """
+        try:
+            while True:
+                data = self.source.recv(self.read_size)
+                if not data:
+                    break
+                sent = self.bucket.reserve(len(data), timer.monotonic())
+                release = max(self.last_release, sent + self.get_delay())
+                self.last_release = release
+                self.put((release, data), len(data))
+        except socket.error, e:
+            logging.debug("Link emulation read failed: %s" % e)
+        self.put(None, 0)
+    def write(self):
+        """Sends the queued chunks when their time has come. """
+        try:
+            while True:
+                item = self.get()
+                if item is None:
+                    break
+                (release, data) = item
+                wait = release - timer.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                self.destination.sendall(data)
+            self.destination.shutdown(socket.SHUT_WR)
+        except socket.error, e:
+            logging.debug("Link emulation write failed: %s" % e)
+            # Makes the reader of this direction stop as well.
+            shutdown(self.source)
+            self.drain()
+        self.finished()
+    def drain(self):
+        """Throws away what the reader queues until it has stopped. """
+        while self.get() is not None:
+            pass
+
+
+def shutdown(sock):
+    """Shuts a socket down in both directions, ignoring errors. """
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except socket.error, e:
+        pass
+
+
+class Connection(object):
+    """A connection through the proxy, with a L{Channel} in each
+    direction.
+
+    """
+    def __init__(self, client, server, profile, rng):
+        self.client = client
+        self.server = server
+        self.remaining = 2
+        self.lock = threading.Lock()
+        self.channels = [
+            Channel(client, server, profile, True, rng, self.finished),
+            Channel(server, client, profile, False, rng, self.finished),
+        ]
+    def start(self):
+        for channel in self.channels:
+            channel.start()
+    def finished(self):
+        """Closes the sockets when both directions are done. """
+        self.lock.acquire()
+        try:
+            self.remaining -= 1
+            done = self.remaining == 0
+        finally:
+            self.lock.release()
+        if done:
+            self.client.close()
+            self.server.close()
+    def close(self):
+        """Breaks the connection off. """
+        shutdown(self.client)
+        shutdown(self.server)
+
+
+class LinkProxy(object):
+    """A TCP proxy on the loopback interface that emulates a link.
+
+    Every connection to the proxy is forwarded to I{port} on the loopback
+    interface, with the delay, jitter and bandwidth of the profile added in
+    user space. No root access or traffic control is needed. Each direction
+    is handled by two threads, so only a few connections should be made
+    through it at a time.
+
+    """
+    def __init__(self, profile, port, address=ADDRESS, seed=0):
+        """Initializes a proxy that has not been started.
+
+        @param profile: The emulated link.
+        @type profile: L{LinkProfile}
+        @param port: Port to forward connections to.
+        @type port: int
+        @param seed: Seed of the jitter, so runs see the same delays.
+        @type seed: int
+
+        """
+        self.profile = profile
+        self.target = (address, port)
+        self.address = address
+        self.port = None
+        self.rng = random.Random(seed)
+        self.listener = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.connections = []
+    def listen(self):
+        """Starts listening on a free port, without accepting connections
+        yet, so the port is known before the commands are built.
+
+        @return: int port
+
+        """
+        if self.listener is not None:
+            return self.port
+        try:
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR,
+                                    1)
+            self.listener.bind((self.address, 0))
+            self.listener.listen(16)
+        except socket.error, e:
+            self.listener = None
+            raise LinkEmulationError("Unable to start link proxy: %s" % e)
+        self.listener.settimeout(ACCEPT_INTERVAL)
+        self.port = self.listener.getsockname()[1]
+        return self.port
+    def start(self):
+        """Starts accepting connections. """
+        if self.thread is not None:
+            return
+        self.listen()
+        logging.info("Emulating %s on port %d" % (self.profile, self.port))
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    def run(self):
+        """Accepts connections until the proxy is stopped. """
+        while not self.stopped.is_set():
+            try:
+                (client, peer) = self.listener.accept()
+            except socket.timeout:
+                continue
+            except socket.error, e:
+                if not self.stopped.is_set():
+                    logging.warning("Link proxy stopped accepting: %s" % e)
+                return
+            client.settimeout(None)
+            try:
+                server = socket.create_connection(self.target)
+            except socket.error, e:
+                logging.warning("Link proxy is unable to connect to %s:%d: "
+                                "%s" % (self.target + (e,)))
+                client.close()
+                continue
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = Connection(client, server, self.profile, self.rng)
+            self.connections.append(connection)
+            connection.start()
+    def stop(self):
+        """Stops the proxy and breaks off its connections. """
+        if self.listener is None:
+            return
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.listener.close()
+        self.listener = None
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        self.port = None
+
+
+class Error(Exception):
+    pass
+
+class LinkEmulationError(Error):
+    pass
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+#
+#            localsshd.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import errno
+import shutil
+import socket
+import getpass
+import logging
+import tempfile
+import subprocess
+
+ADDRESS = '127.0.0.1'
+# sshd must be started with an absolute path, and is often not in the PATH
+# of normal users.
+SSHD_DIRS = ('/usr/sbin', '/usr/local/sbin', '/sbin')
+# Seconds to wait for sshd to accept connections.
+START_TIMEOUT = 10.0
+START_INTERVAL = 0.05
+CONFIG = """Port %(port)d
+ListenAddress %(address)s
+HostKey %(host_key)s
+PidFile %(directory)s/sshd.pid
+AuthorizedKeysFile %(directory)s/authorized_keys
+AllowUsers %(user)s
+PermitRootLogin yes
+PubkeyAuthentication yes
+PasswordAuthentication no
+KbdInteractiveAuthentication no
+UsePAM no
+StrictModes no
+Subsystem sftp internal-sftp
+"""
+
+def find_sshd():
+    """Finds the sshd program.
+
+    @return: string with the absolute path of sshd.
+
+    """
+    directories = os.environ.get('PATH', '').split(os.pathsep)
+    for directory in directories + list(SSHD_DIRS):
+        path = os.path.join(directory, 'sshd')
+        if os.path.isabs(path) and os.access(path, os.X_OK):
+            return path
+    raise LocalSSHDError("Unable to find sshd")
+
+def find_free_port(address=ADDRESS):
+    """Asks the kernel for a free TCP port on I{address}.
+
+    The port is free when this returns, but nothing keeps other programs
+    from taking it before sshd does.
+
+    @return: int
+
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind((address, 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+
+class LocalSSHD(object):
+    """A throwaway sshd on a high port of the loopback interface.
+
+    The server only lets the current user log in, with a client key made
+    for it, so the ssh based testers can run without a remote host. The
+    host key, client key and configuration are kept in a temporary
+    directory that is removed when the server is stopped.
+
+    """
+    def __init__(self, address=ADDRESS):
+        self.address = address
+        self.user = getpass.getuser()
+        self.port = None
+        self.directory = None
+        self.process = None
+    def get_directory(self):
+        """Gets the directory of the server, creating it if needed.
+
+        The port and the paths of the keys are decided here, so the ssh
+        options are known before the server is started.
+
+        @return: string
+
+        """
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='spodtest-sshd-')
+            self.port = find_free_port(self.address)
+        return self.directory
+    def get_path(self, name):
+        """Gets the path of the file I{name} in the server directory. """
+        return os.path.join(self.get_directory(), name)
+    def get_ssh_options(self, port=None):
+        """Gets the ssh options needed to log in to the server.
+
+        @param port: Port to connect to instead of that of the server, such
+                     as that of a proxy in front of it.
+        @type port: int
+        @return: list of strings on the form Key=Value.
+
+        """
+        self.get_directory()
+        if port is None:
+            port = self.port
+        return ['Port=%d' % port,
+                'IdentityFile=%s' % self.get_path('id_client'),
+                'IdentitiesOnly=yes',
+                'UserKnownHostsFile=/dev/null',
+                'StrictHostKeyChecking=no',
+                'BatchMode=yes']
+    def generate_key(self, name):
+        """Generates a key pair without a passphrase as I{name}. """
+        path = self.get_path(name)
+        command = ['ssh-keygen', '-q', '-t', 'rsa', '-b', '2048', '-N', '',
+                    '-C', 'spodtest', '-f', path]
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+        except OSError, e:
+            raise LocalSSHDError("Unable to run ssh-keygen: %s" % e)
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            raise LocalSSHDError("ssh-keygen failed: %s" % output.strip())
+        return path
+    def write_config(self):
+        """Writes the keys and configuration of the server.
+
+        @return: string with the path of the configuration file.
+
+        """
+        host_key = self.generate_key('host_key')
+        client_key = self.generate_key('id_client')
+        shutil.copy(client_key + '.pub', self.get_path('authorized_keys'))
+        path = self.get_path('sshd_config')
+        f = open(path, 'w')
+        f.write(CONFIG % {'port': self.port, 'address': self.address,
+                        'host_key': host_key, 'user': self.user,
+                        'directory': self.get_directory()})
+        f.close()
+        return path
+    def start(self):
+        """Starts the server and waits until it accepts connections.
+
+        Raises a L{LocalSSHDError} if it does not start.
+
+        """
+        if self.process is not None:
+            return
+        try:
+            config = self.write_config()
+            argv = [find_sshd(), '-D', '-e', '-f', config]
+            logging.info("Starting local sshd on %s port %d" % (self.address,
+                                                                self.port))
+            log = open(self.get_path('sshd.log'), 'w')
+            try:
+                self.process = subprocess.Popen(argv, stdout=log,
+                                    stderr=subprocess.STDOUT, close_fds=True)
+            finally:
+                log.close()
+            self.wait()
+        except (OSError, LocalSSHDError), e:
+            self.stop()
+            raise LocalSSHDError("Unable to start local sshd: %s" % e)
+    def wait(self):
+        """Waits until the server accepts connections. """
+        deadline = time.time() + START_TIMEOUT
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise LocalSSHDError("sshd exited with %d: %s" % (
+                                    self.process.returncode, self.get_log()))
+            try:
+                s = socket.create_connection((self.address, self.port),
+                                                START_INTERVAL)
+            except socket.error, e:
+                if e.args and e.args[0] not in (errno.ECONNREFUSED,
+                                                errno.ETIMEDOUT):
+                    raise LocalSSHDError("Unable to connect to sshd: %s" % e)
+                time.sleep(START_INTERVAL)
+            else:
+                s.close()
+                return
+        raise LocalSSHDError("sshd did not accept connections within %.0f "
+                            "seconds" % START_TIMEOUT)
+    def get_log(self):
+        """Gets what sshd has logged.
+
+        @return: string
+
+        """
+        try:
+            f = open(self.get_path('sshd.log'))
+        except IOError:
+            return ''
+        try:
+            return f.read().strip()
+        finally:
+            f.close()
+    def stop(self):
+        """Stops the server and removes its directory. """
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.terminate()
+                self.process.wait()
+            self.process = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+            self.port = None
+
+
+class Error(Exception):
+    pass
+
+class LocalSSHDError(Error):
+    pass
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+#
+#            manifest.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import stat
+import gzip
+import json
+import errno
+import logging
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+MANIFEST_NAME = 'fs_manifest'
+MANIFEST_VERSION = 1
+# Files in the root of a data set that are not part of the data set itself.
+IGNORED_FILES = ('fs_name', 'fs_profile')
+# Number of directories stat'ed at the same time.
+WORKERS = 8
+
+def list_dir(path):
+    """Lists the files and directories in I{path}.
+
+    Uses scandir where it is available, which saves a stat() call for each
+    directory entry on most file systems.
+
+    @param path: Directory to list.
+    @type path: string
+    @return: tuple of (files, dirs), where files is a dict mapping file names
+             to [size, mtime, inode] and dirs is a sorted list of
+             subdirectory names. Symbolic links to directories are not
+             followed.
+
+    """
+    files = {}
+    dirs = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.name)
+                continue
+            try:
+                st = entry.stat()
+            except OSError, e:
+                logging.warning("Unable to stat %s: %s" % (entry.path, e))
+                continue
+            files[entry.name] = [st.st_size, st.st_mtime, st.st_ino]
+    else:
+        for name in os.listdir(path):
+            full = os.path.join(path, name)
+            try:
+                st = os.lstat(full)
+                if stat.S_ISDIR(st.st_mode):
+                    dirs.append(name)
+                    continue
+                if stat.S_ISLNK(st.st_mode):
+                    st = os.stat(full)
+            except OSError, e:
+                logging.warning("Unable to stat %s: %s" % (full, e))
+                continue
+            files[name] = [st.st_size, st.st_mtime, st.st_ino]
+    dirs.sort()
+    return (files, dirs)
+
+def get_path(root):
+    """Gets the path of the manifest of the data set in I{root}.
+
+    @param root: Absolute path of the root directory of the data set.
+    @type root: string
+    @return: string
+
+    """
+    root = root.rstrip(os.sep)
+    return os.path.join(os.path.dirname(root), "%s.%s" % (
+                        os.path.basename(root), MANIFEST_NAME))
+
+
+class Manifest(object):
+    """Cached listing of every file in a data set.
+
+    The manifest is stored next to the data set rather than inside it, as
+    C{NAME.fs_manifest} in the directory holding the data set directory
+    C{NAME}, so it is not transferred with the data set. It keeps the
+    modification time of each directory together with the size,
+    modification time and inode of each file in it.
+    When the manifest is updated, only directories whose modification time
+    has changed are listed again.
+
+    Note that changing the contents of a file without creating, removing or
+    renaming any files does not change the modification time of its
+    directory, so such changes are not picked up.
+
+    The manifest also keeps the digests of the files computed by
+    L{verify}, with the size and modification time of each file when it was
+    hashed, so they are only computed again for files that have changed.
+
+    """
+    def __init__(self, root):
+        """Initializes the manifest of the data set in I{root}.
+
+        @param root: Root directory of the data set.
+        @type root: string
+
+        """
+        self.root = os.path.abspath(root)
+        self.path = get_path(self.root)
+        self.dirs = {}
+        self.hashes = {}
+        self.changed = False
+    def load(self):
+        """Loads the stored manifest, if there is one.
+
+        A manifest that cannot be read is ignored, and the data set will be
+        listed from scratch.
+
+        @return: bool indicating whether a manifest was loaded.
+
+        """
+        try:
+            f = gzip.open(self.path, 'rb')
+            try:
+                data = json.loads(f.read())
+            finally:
+                f.close()
+        except IOError, ioe:
+            if ioe.errno != errno.ENOENT:
+                logging.warning("Unable to read manifest %s: %s" % (
+                                self.path, ioe))
+            return False
+        except ValueError, ve:
+            logging.warning("Ignoring corrupt manifest %s: %s" % (
+                            self.path, ve))
+            return False
+        if data.get('version') != MANIFEST_VERSION:
+            return False
+        self.dirs = data['dirs']
+        self.hashes = data.get('hashes', {})
+        return True
+    def save(self):
+        """Stores the manifest, if it has changed since it was loaded.
+
+        @return: bool indicating whether the manifest was stored.
+
+        """
+        if not self.changed:
+            return False
+        try:
+            f = gzip.open(self.path, 'wb')
+            try:
+                f.write(json.dumps({
+                    'version': MANIFEST_VERSION,
+                    'dirs': self.dirs,
+                    'hashes': self.hashes,
+                    }))
+            finally:
+                f.close()
+        except (IOError, UnicodeError), e:
+            logging.warning("Unable to store manifest %s: %s" % (
+                            self.path, e))
+            return False
+        self.changed = False
+        return True
+    def update(self, workers=WORKERS):
+        """Brings the manifest up to date with the data set.
+
+        Each level of the directory tree is handled by a pool of threads, so
+        that several directories are listed at the same time.
+
+        @param workers: Number of threads listing directories.
+        @type workers: int
+
+        """
+        seen = set()
+        pool = ThreadPool(workers)
+        try:
+            level = ['']
+            while len(level) > 0:
+                next_level = []
+                for (reldir, entry) in pool.map(self._scan_dir, level):
+                    seen.add(reldir)
+                    if entry is None:
+                        continue
+                    for d in entry['dirs']:
+                        next_level.append(os.path.join(reldir, d))
+                level = next_level
+        finally:
+            # The workers exit on their own once closed. Joining the pool
+            # would wait for its result handler to wake up, which takes up
+            # to a tenth of a second.
+            pool.close()
+        for reldir in self.dirs.keys():
+            if reldir not in seen:
+                del self.dirs[reldir]
+                self.changed = True
+    def _scan_dir(self, reldir):
+        """Lists I{reldir} if it has changed since the manifest was stored.
+
+        @return: tuple of (reldir, entry), where entry is None if the
+                 directory could not be read.
+
+        """
+        path = os.path.join(self.root, reldir)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError, e:
+            logging.warning("Unable to stat %s: %s" % (path, e))
+            return (reldir, None)
+        entry = self.dirs.get(reldir)
+        if entry is not None and entry['mtime'] == mtime:
+            return (reldir, entry)
+        try:
+            (files, dirs) = list_dir(path)
+        except OSError, e:
+            logging.warning("Unable to list %s: %s" % (path, e))
+            return (reldir, None)
+        if reldir == '':
+            for name in IGNORED_FILES:
+                files.pop(name, None)
+        entry = {'mtime': mtime, 'files': files, 'dirs': dirs}
+        # Only this thread touches this key, and dict assignment is atomic.
+        self.dirs[reldir] = entry
+        self.changed = True
+        return (reldir, entry)
+    def get_hash(self, relpath, algorithm, size, mtime):
+        """Gets the stored digest of the file I{relpath}.
+
+        @param relpath: Path of the file relative to the root.
+        @type relpath: string
+        @param algorithm: Name of the hash algorithm.
+        @type algorithm: string
+        @param size: Size of the file now.
+        @type size: int
+        @param mtime: Modification time of the file now.
+        @type mtime: float
+        @return: string with the hex digest, or None if the file has not
+                 been hashed or has changed since.
+
+        """
+        entry = self.hashes.get(algorithm, {}).get(relpath)
+        if entry is None or entry[0] != size or entry[1] != mtime:
+            return None
+        return entry[2]
+    def set_hashes(self, algorithm, hashes):
+        """Replaces the stored digests of I{algorithm}, so files that are
+        gone are forgotten.
+
+        @param hashes: dict mapping paths relative to the root to lists of
+                       [size, mtime, hex digest].
+        @type hashes: dict
+
+        """
+        if self.hashes.get(algorithm) == hashes:
+            return
+        self.hashes[algorithm] = hashes
+        self.changed = True
+    def get_files(self):
+        """Gets every file in the data set.
+
+        @return: list of (path, [size, mtime, inode]) tuples, sorted by path.
+
+        """
+        files = []
+        for (reldir, entry) in self.dirs.items():
+            directory = os.path.join(self.root, reldir)
+            for (name, info) in entry['files'].items():
+                files.append((os.path.join(directory, name), info))
+        files.sort()
+        return files
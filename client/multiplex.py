@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+#            multiplex.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import hashlib
+import logging
+
+import engine
+
+class ControlMaster(object):
+    """A shared SSH connection that other ssh processes are routed through.
+
+    The master connection is set up with C{ControlMaster} and
+    C{ControlPersist}, so key exchange and authentication happen once, when
+    the master is started. Commands using the options from
+    L{get_client_options} open a new session on the existing connection
+    instead of connecting to the host themselves.
+
+    Ciphers and compression are decided by the master connection, so a
+    separate master is needed for each set of such options.
+
+    """
+    def __init__(self, target, ssh_args, directory):
+        """Initializes a master connection that has not been started.
+
+        @param target: The host, or user@host, to connect to.
+        @type target: string
+        @param ssh_args: Extra ssh arguments for the connection, such as the
+                         cipher to use.
+        @type ssh_args: list of strings
+        @param directory: Directory to create the control socket in.
+        @type directory: string
+
+        """
+        self.target = target
+        self.ssh_args = list(ssh_args)
+        key = "%s %s" % (target, " ".join(self.ssh_args))
+        # Unix socket paths are short, so only a prefix of the hash is used.
+        self.path = os.path.join(directory,
+                                'cm-%s' % hashlib.sha1(key).hexdigest()[:12])
+        self.handshake_time = None
+        self.started = False
+    def get_client_options(self):
+        """Gets the ssh options that route a connection through the master.
+
+        @return: list of strings on the form Key=Value.
+
+        """
+        return ['ControlMaster=no', 'ControlPath=%s' % self.path]
+    def start(self):
+        """Connects to the host and times the connection setup.
+
+        ssh is started with C{-f}, so it goes to the background once it has
+        authenticated. The time until then is the handshake time, covering
+        the TCP connection, key exchange and authentication. The master in
+        the background would keep a pipe on its output open, so the output
+        is discarded and the exit of the foreground ssh is waited for
+        directly.
+
+        @return: bool indicating whether the master was started.
+
+        """
+        if self.started:
+            return True
+        argv = ['ssh', '-f', '-N',
+                '-oControlMaster=yes',
+                '-oControlPath=%s' % self.path,
+                '-oControlPersist=yes',
+                '-oBatchMode=yes'] + self.ssh_args + [self.target]
+        job = engine.Engine().run(engine.Job(argv, discard_output=True))
+        if job.returncode != 0:
+            logging.error(("Unable to start SSH master connection to %s, "
+                            "commands will connect on their own: %s "
+                            "returned %d") % (self.target, job,
+                            job.returncode))
+            return False
+        self.handshake_time = job.get_duration()
+        self.started = True
+        logging.info("SSH master connection to %s set up in %.3f seconds" % (
+                    self.target, self.handshake_time))
+        return True
+    def stop(self):
+        """Closes the master connection. """
+        if not self.started:
+            return
+        argv = ['ssh', '-oControlPath=%s' % self.path, '-O', 'exit',
+                self.target]
+        job = engine.Engine().run(engine.Job(argv,
+                                            stderr_callback=logging.debug))
+        if job.returncode != 0:
+            logging.warning("Unable to stop SSH master connection to %s" %
+                            self.target)
+        self.started = False
+    def get_handshake_time(self):
+        """Gets the time used to set up the master connection.
+
+        @return: float seconds, or None if the master has not been started.
+
+        """
+        return self.handshake_time
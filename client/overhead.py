@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+#
+#            overhead.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import optparse
+
+from lxml import etree
+
+import stats
+import report
+import datagen
+import resultdb
+
+# Fields a configuration is identified by. The file set is left out, as the
+# model is fitted over the data sets of a graded series.
+KEY_FIELDS = ('type', 'encryption', 'compression', 'compression_level',
+                'host', 'options')
+# Default total sizes of a graded series. At least two sizes are needed to
+# tell the fixed cost from the bandwidth.
+DEFAULT_SIZES = (16 * 1024 * 1024, 64 * 1024 * 1024)
+
+def get_series(files, sizes):
+    """Gets the data sets of a graded series, as every combination of a
+    number of files and a total size.
+
+    @return: list of tuples of (number of files, total size in bytes)
+
+    """
+    return [(n, size) for size in sizes for n in files]
+
+def generate_series(directory, files, sizes, profile='tiny', seed=0,
+                    content='incompressible'):
+    """Generates the data sets of a graded series with L{datagen}.
+
+    Data sets already generated with the same parameters are reused. Each
+    data set is in its own directory, and its file set is named after the
+    number of files and the total size.
+
+    @param directory: Directory to generate the data sets in.
+    @type directory: string
+    @param files: Numbers of files.
+    @type files: list of int
+    @param sizes: Total sizes in bytes.
+    @type sizes: list of int
+    @param profile: Profile the files are laid out and sized by.
+    @type profile: string
+    @return: list of strings with the paths of the data sets.
+
+    """
+    paths = []
+    for (n, size) in get_series(files, sizes):
+        name = "graded-%dx%d" % (n, size)
+        path = os.path.join(directory, "%s-%s-%d" % (profile, content, seed),
+                            name)
+        params = datagen.get_parameters(profile, seed, content, files=n,
+                                        total_size=size)
+        datagen.generate(path, params, name=name)
+        paths.append(path)
+    return paths
+
+
+class Model(object):
+    """Transfer time as time = fixed_cost + per_file_cost * files +
+    bytes / bandwidth, fitted to the results of one configuration.
+
+    """
+    def __init__(self, points):
+        """Fits the model to I{points} with least squares.
+
+        If every point has the same total size, the cost of the bytes cannot
+        be told from the fixed cost, so it is counted in the fixed cost and
+        the bandwidth is unknown.
+
+        @param points: tuples of (number of files, total size in bytes,
+                       transfer time in seconds).
+        @type points: list of tuples
+        @raise OverheadError: If the points do not vary enough to fit the
+                              model.
+
+        """
+        self.points = points
+        self.fixed_cost = None
+        self.per_file_cost = None
+        self.bandwidth = None
+        sizes = set(size for (n, size, seconds) in points)
+        if len(sizes) > 1:
+            rows = [[1.0, n, size] for (n, size, seconds) in points]
+        else:
+            rows = [[1.0, n] for (n, size, seconds) in points]
+        fit = stats.least_squares(rows,
+                                [seconds for (n, size, seconds) in points])
+        if fit is None:
+            raise OverheadError(("Unable to fit the model to %d results, "
+                                "they need at least two numbers of files") %
+                                len(points))
+        (coefficients, self.r_squared) = fit
+        self.fixed_cost = coefficients[0]
+        self.per_file_cost = coefficients[1]
+        if len(coefficients) > 2 and coefficients[2] > 0:
+            self.bandwidth = 1.0/coefficients[2]
+    def predict(self, files, size):
+        """Gets the predicted transfer time of I{files} files with I{size}
+        bytes in total.
+
+        @return: float seconds
+
+        """
+        seconds = self.fixed_cost + self.per_file_cost * files
+        if self.bandwidth is not None:
+            seconds += size/self.bandwidth
+        return seconds
+    def get_file_share(self):
+        """Gets the share of the predicted time spent on the per file cost,
+        for the data set with the most files.
+
+        A share near 1 means the transfers are bound by latency, and a share
+        near 0 that they are bound by bandwidth.
+
+        @return: float, or None if the predicted time is not positive.
+
+        """
+        (files, size, seconds) = max(self.points)
+        seconds = self.predict(files, size)
+        if seconds <= 0:
+            return None
+        return max(0.0, self.per_file_cost * files)/seconds
+
+
+def fit_test_cases(test_cases):
+    """Fits a L{Model} for each command of I{test_cases}.
+
+    @param test_cases: Finished test cases.
+    @type test_cases: list of L{TestCase<testers.base.TestCase>}
+    @return: list of tuples of (command, L{Model}), leaving out commands
+             whose results do not fit.
+
+    """
+    points = {}
+    commands = []
+    for test_case in test_cases:
+        if len(test_case.get_samples()) == 0:
+            continue
+        if test_case.command not in points:
+            commands.append(test_case.command)
+        points.setdefault(test_case.command, []).append((
+                test_case.f.get_num_files(), test_case.f.get_size(),
+                test_case.get_transfer_time()))
+    models = []
+    for command in commands:
+        try:
+            models.append((command, Model(points[command])))
+        except OverheadError, e:
+            pass
+    return models
+
+def describe(model):
+    """Describes the coefficients of I{model} on one line. """
+    bandwidth = '-'
+    if model.bandwidth is not None:
+        bandwidth = "%s MiB/s" % report.format_speed(model.bandwidth)
+    share = model.get_file_share()
+    return ("fixed %.3fs, per file %.3fms, bandwidth %s, file share %s, "
+            "R2 %s" % (model.fixed_cost, model.per_file_cost * 1000.0,
+                        bandwidth,
+                        report.format_number(share, "%.2f"),
+                        report.format_number(model.r_squared, "%.3f")))
+
+def iter_xml(path):
+    """Reads the points of the results in a SPODTest XML document.
+
+    Results that failed verification are left out, since they did not
+    transfer every file:
+
+    >>> from StringIO import StringIO
+    >>> doc = StringIO('<spodtest>'
+    ...     '<testcase type="cp" num_files="1" total_size="100" '
+    ...     'transfer_time="2.0"/>'
+    ...     '<testcase type="cp" num_files="10" total_size="100" '
+    ...     'transfer_time="1.0" valid="no"/></spodtest>')
+    >>> [num_files for (key, num_files, size, seconds) in iter_xml(doc)]
+    [1]
+
+    @return: generator of tuples of (key, number of files, total size,
+             transfer time).
+
+    """
+    for (event, element) in etree.iterparse(path, tag="testcase"):
+        attrib = dict(element.attrib)
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+        if attrib.get('valid') == 'no':
+            continue
+        attrib['host'] = attrib.get('to')
+        attrib['options'] = resultdb.get_options(attrib)
+        try:
+            yield (tuple(attrib.get(field) for field in KEY_FIELDS),
+                    int(attrib['num_files']), int(attrib['total_size']),
+                    float(attrib['transfer_time']))
+        except (KeyError, ValueError), e:
+            continue
+
+def iter_database(path):
+    """Reads the points of the results in a L{result
+    database<resultdb.ResultDB>}, leaving out results that failed
+    verification.
+
+    @return: generator of tuples of (key, number of files, total size,
+             transfer time).
+
+    """
+    db = resultdb.ResultDB(path)
+    try:
+        cursor = db.connection.execute(
+            "SELECT %s, num_files, total_size, transfer_time "
+            "FROM testcase WHERE transfer_time IS NOT NULL AND "
+            "num_files IS NOT NULL AND total_size IS NOT NULL AND %s" % (
+                ", ".join(KEY_FIELDS), resultdb.VALID))
+        for row in cursor:
+            yield (tuple(row[field] for field in KEY_FIELDS),
+                    row['num_files'], row['total_size'], row['transfer_time'])
+    finally:
+        db.close()
+
+def main(args):
+    """Runs the overhead subcommand.
+
+    @param args: Command line arguments after the subcommand.
+    @type args: list of strings
+    @return: int exit status
+
+    """
+    parser = optparse.OptionParser(
+        usage="%prog overhead [options] RESULTS...",
+        description=("Fits time = fixed_cost + per_file_cost * files + "
+                    "bytes / bandwidth to the results of each "
+                    "configuration, from XML documents or result "
+                    "databases."))
+    parser.add_option("-t", "--type",
+                    help="only fit results of this test type")
+    (options, arguments) = parser.parse_args(args)
+    if len(arguments) == 0:
+        parser.error("at least one XML document or database is required")
+    points = {}
+    try:
+        for path in arguments:
+            if report.is_database(path):
+                results = iter_database(path)
+            else:
+                results = iter_xml(path)
+            for (key, files, size, seconds) in results:
+                if options.type is not None and key[0] != options.type:
+                    continue
+                points.setdefault(key, []).append((files, size, seconds))
+    except (IOError, etree.XMLSyntaxError, resultdb.ResultDBError), e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    out = sys.stdout
+    out.write("%s\tfixed_cost\tper_file_cost\tbandwidth\tfile_share\t"
+                "r_squared\tpoints\n" % "\t".join(KEY_FIELDS))
+    for key in sorted(points):
+        try:
+            model = Model(points[key])
+        except OverheadError, e:
+            sys.stderr.write("%s: %s\n" % (" ".join(map(str, key)), e))
+            continue
+        bandwidth = '-'
+        if model.bandwidth is not None:
+            bandwidth = report.format_speed(model.bandwidth)
+        out.write("%s\t%.4f\t%.6f\t%s\t%s\t%s\t%d\n" % (
+                "\t".join(map(str, key)), model.fixed_cost,
+                model.per_file_cost, bandwidth,
+                report.format_number(model.get_file_share(), "%.2f"),
+                report.format_number(model.r_squared, "%.3f"),
+                len(model.points)))
+    return 0
+
+
+class Error(Exception):
+    pass
+
+class OverheadError(Error):
+    pass
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+#            phases.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+# ssh option that makes ssh log the messages in MARKERS.
+SSH_OPTION = 'LogLevel=DEBUG1'
+# Events in a connection, and the debug messages of OpenSSH that mark them.
+# Only the first message marking an event is used.
+MARKERS = (
+    ('connected', 'Connection established.'),
+    ('key_exchanged', 'SSH2_MSG_NEWKEYS received'),
+    ('authenticated', 'Authenticated to '),
+    ('authenticated', 'Authentication succeeded'),
+    ('session', 'Sending command: '),
+    ('session', 'Sending subsystem: '),
+    # A session on a shared connection, which has no connection setup.
+    ('session', 'master session id'),
+    ('exited', 'rtype exit-status'),
+)
+# Phases of a run, as the events they start and end with. start and end are
+# the start and end of the run, and first_byte is the first transferred
+# bytes as shown by the progress output of the command.
+PHASES = (
+    ('connect', 'start', 'connected'),
+    ('key_exchange', 'connected', 'key_exchanged'),
+    ('authentication', 'key_exchanged', 'authenticated'),
+    ('session_setup', 'authenticated', 'session'),
+    ('first_byte', 'session', 'first_byte'),
+    ('transfer', 'first_byte', 'exited'),
+    ('teardown', 'exited', 'end'),
+)
+
+class PhaseLog(object):
+    """Times the events of an ssh connection from its debug output.
+
+    Each line ssh writes to standard error is added with the time it was
+    read. The time between two events is the time of a phase of the run.
+
+    """
+    def __init__(self):
+        self.events = {}
+    def add(self, elapsed, line):
+        """Adds a line of debug output.
+
+        @param elapsed: Seconds since the command was started.
+        @type elapsed: float
+        @param line: The line.
+        @type line: string
+
+        """
+        for (event, marker) in MARKERS:
+            if event not in self.events and marker in line:
+                self.events[event] = elapsed
+    def get_phases(self, duration, first_byte_time=None):
+        """Gets the time of each phase that both events were seen for.
+
+        Without a time for the first byte, the transfer is counted from the
+        start of the session and there is no first byte phase.
+
+        @param duration: Seconds from start to end of the run.
+        @type duration: float
+        @param first_byte_time: Seconds from the start of the run until the
+                                first bytes were transferred.
+        @type first_byte_time: float
+        @return: list of tuples of (phase, float seconds), in the order of
+                 L{PHASES}.
+
+        """
+        events = dict(self.events, start=0.0, end=duration)
+        if first_byte_time is not None:
+            events['first_byte'] = first_byte_time
+        elif 'session' in events:
+            events['first_byte'] = events['session']
+        phases = []
+        for (phase, start, end) in PHASES:
+            if start not in events or end not in events:
+                continue
+            if phase == 'first_byte' and first_byte_time is None:
+                continue
+            phases.append((phase, max(0.0, events[end] - events[start])))
+        return phases
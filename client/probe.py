@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+#
+#            probe.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import pipes
+import errno
+import signal
+import ctypes
+import ctypes.util
+import socket
+import logging
+import threading
+
+import engine
+import timer
+
+# Port the receiver listens on, unless probe_port is set.
+PORT = 5301
+# Path of this module, which is run to send the files of a probe.
+SCRIPT_PATH = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+# Largest number of bytes given to one sendfile() call.
+SEND_SIZE = 1024 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+# Seconds to wait for the receiver to listen.
+START_TIMEOUT = 30.0
+# Receiver run on the host with Python 2 or 3. It counts the bytes of every
+# connection, answers with the count when the sender has finished, and exits
+# when the ssh session or shell that started it has gone away.
+RECEIVER = """import os, sys, socket, select, threading
+def serve(conn):
+    total = 0
+    buf = bytearray(262144)
+    while True:
+        n = conn.recv_into(buf)
+        if not n:
+            break
+        total += n
+    conn.sendall(('%d\\n' % total).encode())
+    conn.close()
+listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+listener.bind((sys.argv[2], int(sys.argv[1])))
+listener.listen(16)
+sys.stdout.write('listening %d\\n' % listener.getsockname()[1])
+sys.stdout.flush()
+parent = os.getppid()
+while os.getppid() == parent:
+    if select.select([listener], [], [], 1.0)[0]:
+        conn = listener.accept()[0]
+        t = threading.Thread(target=serve, args=(conn,))
+        t.daemon = True
+        t.start()
+"""
+
+def load_sendfile():
+    """Finds sendfile(), which Python 2 does not expose.
+
+    @return: function taking the socket and file descriptors, an offset and
+             a count, and returning the number of bytes sent, or None if
+             sendfile() is not available.
+
+    """
+    if hasattr(os, 'sendfile'):
+        return os.sendfile
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                            use_errno=True)
+        sendfile64 = getattr(libc, 'sendfile64', None)
+        if sendfile64 is None:
+            sendfile64 = libc.sendfile
+    except (OSError, AttributeError), e:
+        logging.warning("Unable to load sendfile(): %s" % e)
+        return None
+    sendfile64.argtypes = [ctypes.c_int, ctypes.c_int,
+                            ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    sendfile64.restype = ctypes.c_ssize_t
+    def sendfile(out_fd, in_fd, offset, count):
+        position = ctypes.c_int64(offset)
+        sent = sendfile64(out_fd, in_fd, ctypes.byref(position), count)
+        if sent < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return sent
+    return sendfile
+
+sendfile = load_sendfile()
+
+def list_files(path):
+    """Lists the files of I{path}, for the sender run on its own. Test cases
+    send the file lists of their L{FileObject<testers.base.FileObject>}
+    instead.
+
+    @return: sorted list of strings
+
+    """
+    if not os.path.isdir(path):
+        return [path]
+    files = []
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        files.extend(os.path.join(dirpath, name) for name in filenames)
+    return sorted(files)
+
+def send_file(sock, path):
+    """Sends the file I{path} over I{sock}, with sendfile() where it is
+    available so the data is not copied through user space.
+
+    @return: int bytes sent
+
+    """
+    f = open(path, 'rb')
+    try:
+        size = os.fstat(f.fileno()).st_size
+        offset = 0
+        if sendfile is not None:
+            while offset < size:
+                try:
+                    sent = sendfile(sock.fileno(), f.fileno(), offset,
+                                    min(SEND_SIZE, size - offset))
+                except OSError, e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                if sent == 0:
+                    break
+                offset += sent
+            return offset
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                return offset
+            sock.sendall(data)
+            offset += len(data)
+    finally:
+        f.close()
+
+def send(host, port, files):
+    """Sends I{files} to the receiver on I{host} over one connection, and
+    waits until the receiver has counted them.
+
+    @param files: Paths of the files to send.
+    @type files: list of strings
+    @return: int bytes sent
+    @raise ProbeError: If the receiver did not get every byte.
+
+    """
+    sock = socket.create_connection((host, port))
+    try:
+        total = 0
+        for name in files:
+            total += send_file(sock, name)
+        sock.shutdown(socket.SHUT_WR)
+        answer = ''
+        while True:
+            data = sock.recv(64)
+            if not data:
+                break
+            answer += data
+    finally:
+        sock.close()
+    try:
+        received = int(answer.strip())
+    except ValueError, e:
+        raise ProbeError("The receiver did not count the bytes")
+    if received != total:
+        raise ProbeError("Sent %d bytes, the receiver got %d" % (total,
+                                                                received))
+    return total
+
+def send_streams(host, port, filelists, timeout=None):
+    """Sends each of I{filelists} over a connection of its own, all at the
+    same time, with L{send}.
+
+    Each connection is sent by a thread. sendfile() does not hold the
+    interpreter lock, so the threads send in parallel.
+
+    @param filelists: The files of each connection.
+    @type filelists: list of lists of strings
+    @param timeout: Seconds to wait for the connections, or None to wait
+                    until they are done.
+    @type timeout: float
+    @return: float seconds from the start of the first connection to the
+             end of the last.
+    @raise ProbeError: If a connection failed or did not finish in time.
+
+    """
+    errors = []
+    def run(files):
+        try:
+            send(host, port, files)
+        except (socket.error, IOError, OSError, ProbeError), e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(files,))
+                for files in filelists]
+    start = timer.monotonic()
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        if timeout is None:
+            thread.join()
+        else:
+            thread.join(max(0, start + timeout - timer.monotonic()))
+    seconds = timer.monotonic() - start
+    if any(thread.is_alive() for thread in threads):
+        raise ProbeError("Probe to %s:%d did not finish in %g seconds" % (
+                        host, port, timeout))
+    if len(errors) > 0:
+        raise ProbeError("Probe to %s:%d failed: %s" % (host, port,
+                                                        errors[0]))
+    return seconds
+
+def get_sender_argv(host, port, path):
+    """Gets the command that sends the files of I{path} to the receiver.
+
+    @return: list of strings
+
+    """
+    return [sys.executable, SCRIPT_PATH, 'send', host, str(port), path]
+
+def parse_sent(line):
+    """Parses the line the sender writes when it has finished, on the form
+    C{sent BYTES SECONDS}.
+
+    @return: tuple of (int bytes sent, float seconds spent sending), or None
+             if I{line} is not the line of the sender.
+
+    """
+    fields = line.split()
+    if len(fields) != 3 or fields[0] != 'sent':
+        return None
+    try:
+        return (int(fields[1]), float(fields[2]))
+    except ValueError, e:
+        return None
+
+def main(args):
+    """Runs the sender, as C{probe.py send HOST PORT PATH}.
+
+    The files are listed before the sending is timed, so the time written
+    with the number of bytes sent leaves out the startup of the sender.
+
+    @return: int exit status
+
+    """
+    if len(args) != 4 or args[0] != 'send':
+        sys.stderr.write("Usage: %s send HOST PORT PATH\n" % sys.argv[0])
+        return 2
+    try:
+        files = list_files(args[3])
+        start = timer.monotonic()
+        total = send(args[1], int(args[2]), files)
+        seconds = timer.monotonic() - start
+    except (socket.error, IOError, OSError, ValueError, ProbeError), e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    sys.stdout.write("sent %d %.6f\n" % (total, seconds))
+    return 0
+
+
+class Receiver(object):
+    """The receiver of the probes, started on the host with one ssh session,
+    or with a local shell for the local host, for the duration of a test set.
+
+    """
+    def __init__(self, target, port=PORT, ssh_args=None):
+        """Initializes a receiver that has not been started.
+
+        @param target: The host, or user@host, to run the receiver on, or
+                       None for the local host.
+        @type target: string
+        @param port: Port to listen on, or 0 for any free port.
+        @type port: int
+        @param ssh_args: Extra arguments for ssh.
+        @type ssh_args: list of strings
+
+        """
+        self.target = target
+        self.port = port
+        if ssh_args is None:
+            ssh_args = []
+        self.ssh_args = ssh_args
+        self.job = None
+        self.thread = None
+        self.ready = threading.Event()
+    def get_argv(self):
+        """Gets the command that starts the receiver.
+
+        The receiver listens on every interface of a remote host, and only
+        on the loopback interface of the local host.
+
+        @return: list of strings
+
+        """
+        address = ''
+        if self.target is None:
+            address = '127.0.0.1'
+        command = ("exec \"$(command -v python3 || command -v python)\" "
+                    "-c %s %d %s" % (pipes.quote(RECEIVER), self.port,
+                                    pipes.quote(address)))
+        if self.target is None:
+            return ['sh', '-c', command]
+        return (['ssh', '-oBatchMode=yes'] + self.ssh_args +
+                [self.target, command])
+    def get_host(self):
+        """Gets the name of the host the receiver runs on. """
+        if self.target is None:
+            return 'localhost'
+        return self.target
+    def start(self):
+        """Starts the receiver and waits until it listens.
+
+        Raises a L{ProbeError} if it does not start.
+
+        """
+        if self.job is not None:
+            return
+        self.ready.clear()
+        self.job = engine.Job(self.get_argv(), line_callback=self.read_line,
+                            stderr_callback=logging.debug)
+        runner = engine.Engine()
+        try:
+            runner.start(self.job)
+        except OSError, e:
+            self.job = None
+            raise ProbeError("Unable to start the receiver on %s: %s" % (
+                            self.get_host(), e))
+        self.thread = threading.Thread(target=self.run, args=(runner,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.ready.wait(START_TIMEOUT)
+        if not self.ready.is_set() or self.job.is_done():
+            self.stop()
+            raise ProbeError("The receiver on %s did not start listening" %
+                            self.get_host())
+    def run(self, runner):
+        """Reads the output of the receiver until it exits. """
+        try:
+            runner.wait([self.job])
+        finally:
+            # Wakes up start() if the receiver exited without listening.
+            self.ready.set()
+    def read_line(self, line):
+        fields = line.split()
+        if len(fields) == 2 and fields[0] == 'listening':
+            self.port = int(fields[1])
+            self.ready.set()
+    def stop(self):
+        """Stops the receiver. """
+        if self.job is None:
+            return
+        if not self.job.is_done():
+            self.job.signal(signal.SIGTERM)
+        self.thread.join()
+        self.job = None
+        self.thread = None
+
+
+class Error(Exception):
+    pass
+
+class ProbeError(Error):
+    pass
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#
+#            progress.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+
+UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4,
+            'P': 1024**5}
+
+class ProgressParser(object):
+    """Base class for parsing progress output from a transfer command.
+
+    Each line of output is passed to L{parse}, which returns the total
+    number of bytes transferred so far if the line was a progress line.
+    Subclasses override L{parse}; the base class finds no progress lines.
+
+    """
+    def parse(self, line):
+        """Parses a line of output.
+
+        @param line: A line of output, without line endings.
+        @type line: string
+        @return: int total bytes transferred, or None if I{line} is not a
+                 progress line.
+
+        """
+        return None
+
+
+class RSyncProgressParser(ProgressParser):
+    """Parses the output of rsync C{--info=progress2}.
+
+    The lines look like::
+
+        1,234,567  12%   11.77MB/s    0:00:01 (xfr#3, to-chk=10/14)
+
+    where the first number is the total number of bytes transferred.
+
+    """
+    line_re = re.compile(r'^\s*([\d,]+)\s+\d+%\s+\S+/s')
+    def parse(self, line):
+        match = self.line_re.match(line)
+        if match is None:
+            return None
+        return int(match.group(1).replace(',', ''))
+
+
+class MeterProgressParser(ProgressParser):
+    """Parses the progress meter shown by scp and sftp.
+
+    The lines look like::
+
+        filename                 45%  123MB  12.3MB/s   00:03 ETA
+
+    The meter only shows the bytes of the current file, so the parser keeps
+    track of completed files to give a running total.
+
+    """
+    line_re = re.compile(r'^(.*?)\s+(\d+)%\s+(\d+(?:\.\d+)?)\s*([KMGTP]?)B\s')
+    def __init__(self):
+        self.completed = 0
+        self.current_name = None
+        self.current_percent = 0
+        self.current_bytes = 0
+    def parse(self, line):
+        match = self.line_re.match(line)
+        if match is None:
+            return None
+        name = match.group(1).strip()
+        percent = int(match.group(2))
+        nbytes = int(float(match.group(3)) * UNITS[match.group(4)])
+        if name != self.current_name or percent < self.current_percent:
+            # A new file has started, the previous one is done.
+            self.completed += self.current_bytes
+            self.current_name = name
+        self.current_percent = percent
+        self.current_bytes = nbytes
+        return self.completed + self.current_bytes
+
+
+class ProgressSeries(object):
+    """Bytes transferred over time for a single run of a command.
+
+    Samples closer together than I{interval} seconds are dropped, except for
+    the last one, to keep the series short for long transfers.
+
+    """
+    def __init__(self, interval=0.5):
+        """Initializes an empty series.
+
+        @param interval: Minimum number of seconds between kept samples.
+        @type interval: float
+
+        """
+        self.interval = interval
+        self.points = []
+        self.last = None
+    def add(self, elapsed, nbytes):
+        """Adds a sample to the series.
+
+        @param elapsed: Seconds since the command was started.
+        @type elapsed: float
+        @param nbytes: Total bytes transferred at I{elapsed}.
+        @type nbytes: int
+
+        """
+        self.last = (elapsed, nbytes)
+        if len(self.points) == 0 or (nbytes > 0 and self.points[-1][1] == 0) \
+            or elapsed - self.points[-1][0] >= self.interval:
+            self.points.append(self.last)
+    def finish(self):
+        """Keeps the last sample added, even if it is within I{interval}.
+
+        """
+        if self.last is not None and (len(self.points) == 0 or
+                                        self.points[-1] is not self.last):
+            self.points.append(self.last)
+    def get_points(self):
+        """Gets the kept samples.
+
+        @return: list of (elapsed, bytes) tuples.
+
+        """
+        return self.points
+    def get_first_byte_time(self):
+        """Gets the time until the first bytes were transferred.
+
+        @return: float seconds, or None if no bytes were transferred.
+
+        """
+        for (elapsed, nbytes) in self.points:
+            if nbytes > 0:
+                return elapsed
+        return None
+    def get_steady_state_speed(self):
+        """Gets the throughput while between 10% and 90% of the bytes were
+        transferred.
+
+        This leaves out connection setup and the slow start of the transfer,
+        as well as the tail of the transfer.
+
+        @return: float bytes per second, or None if the series is too short.
+
+        """
+        window = self._steady_state_window()
+        if window is None:
+            return None
+        ((t1, b1), (t2, b2)) = window
+        return float(b2 - b1)/(t2 - t1)
+    def get_ramp_up_time(self):
+        """Gets the time from the first byte until the throughput between two
+        samples first reaches 90% of the steady state throughput.
+
+        @return: float seconds, or None if the series is too short.
+
+        """
+        steady = self.get_steady_state_speed()
+        first_byte = self.get_first_byte_time()
+        if steady is None or first_byte is None:
+            return None
+        for ((t1, b1), (t2, b2)) in zip(self.points, self.points[1:]):
+            if t2 > t1 and float(b2 - b1)/(t2 - t1) >= 0.9 * steady:
+                return max(0.0, t1 - first_byte)
+        return None
+    def _steady_state_window(self):
+        if len(self.points) < 2:
+            return None
+        total = self.points[-1][1]
+        start = None
+        end = None
+        for point in self.points:
+            if start is None and point[1] >= 0.1 * total:
+                start = point
+            if point[1] <= 0.9 * total:
+                end = point
+        if start is None or end is None or end[0] <= start[0]:
+            # Too few samples inside the window, use the whole transfer
+            # after the first byte instead.
+            first = [p for p in self.points if p[1] > 0]
+            if len(first) == 0 or self.points[-1][0] <= first[0][0]:
+                return None
+            return (first[0], self.points[-1])
+        return (start, end)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+#
+#            remotedir.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import time
+import uuid
+import pipes
+import shutil
+import logging
+import tempfile
+import posixpath
+
+import engine
+
+# A leading ~ or ~user of a path, which the remote shell expands to a home
+# directory when it is not quoted.
+TILDE = re.compile(r'^~[A-Za-z0-9._-]*(?=/|$)')
+
+def quote_path(path):
+    """Quotes I{path} for the remote shell, like C{pipes.quote}, but keeps
+    a leading C{~} or C{~user} unquoted so it is still expanded. The rest
+    of the path is quoted, as in C{~/'data/a b'}.
+
+    @return: string
+
+    """
+    match = TILDE.match(path)
+    if match is None:
+        return pipes.quote(path)
+    rest = path[match.end():].lstrip('/')
+    if rest == '':
+        return path[:match.end()]
+    return "%s/%s" % (path[:match.end()], pipes.quote(rest))
+
+def run(target, command, ssh_args=None):
+    """Runs the shell command I{command} on I{target} with ssh, or with a
+    local shell if I{target} is None.
+
+    @return: bool indicating whether the command succeeded.
+
+    """
+    if target is None:
+        argv = ['sh', '-c', command]
+    else:
+        argv = ['ssh', '-oBatchMode=yes'] + (ssh_args or []) + [target, command]
+    job = engine.Engine().run(engine.Job(argv, stderr_callback=logging.debug))
+    return job.returncode == 0
+
+def make_tree(target, path, dirs, ssh_args=None):
+    """Creates the directory I{path} and the directories I{dirs} in it with
+    one ssh session, or a local shell if I{target} is None.
+
+    @param dirs: Paths relative to I{path}.
+    @type dirs: list of strings
+    @return: bool indicating whether the directories were created.
+
+    """
+    command = "mkdir -p %s && cd %s" % (quote_path(path), quote_path(path))
+    if len(dirs) > 0:
+        command += " && mkdir -p %s" % " ".join(pipes.quote(d) for d in dirs)
+    return run(target, command, ssh_args)
+
+
+class RemoteDirs(object):
+    """Separate directories on the remote host for each run of a command.
+
+    Every directory is created under one base directory in the target
+    folder, named after the time and a random string, so runs never find
+    files left by an earlier run. Directories are created in batches with
+    one ssh session each, and the base directory is removed with a single
+    session when the test set has finished.
+
+    Without a target the directories are made on the local host, for the
+    commands that do not use ssh.
+
+    """
+    def __init__(self, target, target_folder, ssh_args=None):
+        """Initializes the directories for a test set.
+
+        @param target: The host, or user@host, to create directories on, or
+                       None for the local host.
+        @type target: string
+        @param target_folder: Folder to create the directories in.
+        @type target_folder: string
+        @param ssh_args: Extra arguments for ssh.
+        @type ssh_args: list of strings
+
+        """
+        self.target = target
+        self.base = posixpath.join(target_folder, "spodtest-%s-%s" % (
+                                    time.strftime("%Y%m%d%H%M%S"),
+                                    uuid.uuid4().hex[:8]))
+        if ssh_args is None:
+            ssh_args = []
+        self.ssh_args = ssh_args
+        self.count = 0
+        self.pending = []
+        self.used = False
+    def allocate(self, number):
+        """Allocates I{number} new directories. They are created by the next
+        call to L{create}.
+
+        @return: list of strings with the paths of the directories.
+
+        """
+        names = ["%d" % (self.count + i) for i in range(number)]
+        self.count += number
+        self.pending.extend(names)
+        return [posixpath.join(self.base, name) for name in names]
+    def create(self):
+        """Creates the allocated directories in one ssh session.
+
+        @return: bool indicating whether the directories were created.
+
+        """
+        if len(self.pending) == 0:
+            return True
+        command = "mkdir -p %s && cd %s && mkdir %s" % (
+                    quote_path(self.base), quote_path(self.base),
+                    " ".join(self.pending))
+        self.used = True
+        self.pending = []
+        if not self.run(command):
+            logging.error("Unable to create directories in %s on %s" % (
+                            self.base, self.get_host()))
+            return False
+        return True
+    def remove(self):
+        """Removes the base directory and everything in it in one ssh
+        session.
+
+        """
+        if not self.used:
+            return
+        if not self.run("rm -rf %s" % quote_path(self.base)):
+            logging.warning("Unable to remove %s on %s" % (self.base,
+                                                        self.get_host()))
+        self.used = False
+    def get_host(self):
+        """Gets the name of the host the directories are on. """
+        if self.target is None:
+            return 'localhost'
+        return self.target
+    def run(self, command):
+        """Runs the shell command I{command} on the remote host.
+
+        @return: bool indicating whether the command succeeded.
+
+        """
+        return run(self.target, command, self.ssh_args)
+
+
+class DaemonDirs(RemoteDirs):
+    """Separate directories for each run in a module of an rsync daemon.
+
+    A daemon runs no shell commands, so the directories are created by
+    copying an empty tree of them with rsync, and the base directory is
+    removed by copying an empty directory over the target folder with
+    C{--delete}, limited to the base directory by filter rules.
+
+    """
+    def __init__(self, url, target_folder, rsync_args=None):
+        """Initializes the directories for a test set.
+
+        @param url: The module, as C{rsync://host/module}.
+        @type url: string
+        @param target_folder: Folder in the module to create the directories
+                              in.
+        @type target_folder: string
+        @param rsync_args: Extra arguments for rsync, such as a password
+                           file.
+        @type rsync_args: list of strings
+
+        """
+        super(DaemonDirs, self).__init__(url, target_folder)
+        if rsync_args is None:
+            rsync_args = []
+        self.rsync_args = rsync_args
+    def create(self):
+        """Creates the allocated directories with one rsync session.
+
+        @return: bool indicating whether the directories were created.
+
+        """
+        if len(self.pending) == 0:
+            return True
+        temp_dir = tempfile.mkdtemp(prefix='spodtest-dirs-')
+        try:
+            base = os.path.join(temp_dir, posixpath.basename(self.base))
+            os.mkdir(base)
+            for name in self.pending:
+                os.mkdir(os.path.join(base, name))
+            self.used = True
+            self.pending = []
+            if not self.rsync(['-r', temp_dir + '/']):
+                logging.error("Unable to create directories in %s on %s" % (
+                                self.base, self.target))
+                return False
+            return True
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    def remove(self):
+        """Removes the base directory and everything in it with one rsync
+        session.
+
+        """
+        if not self.used:
+            return
+        temp_dir = tempfile.mkdtemp(prefix='spodtest-dirs-')
+        try:
+            # Only the base directory is unprotected from --delete.
+            rules = ['--include=/%s/***' % posixpath.basename(self.base),
+                    '--exclude=*']
+            if not self.rsync(['-r', '--delete'] + rules + [temp_dir + '/']):
+                logging.warning("Unable to remove %s on %s" % (self.base,
+                                                                self.target))
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        self.used = False
+    def rsync(self, args):
+        """Runs rsync with I{args} against the folder the base directory is
+        in.
+
+        @return: bool indicating whether rsync succeeded.
+
+        """
+        destination = "%s/%s/" % (self.target, posixpath.dirname(self.base))
+        argv = ['rsync'] + self.rsync_args + args + [destination]
+        job = engine.Engine().run(engine.Job(argv,
+                                            stderr_callback=logging.debug))
+        return job.returncode == 0
+
+
+class Error(Exception):
+    pass
+
+class RemoteDirError(Error):
+    pass
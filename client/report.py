@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+#
+#            report.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import calendar
+import datetime
+import optparse
+
+from lxml import etree
+
+import stats
+import resultdb
+from utils import rfc3339_to_timestamp
+
+# Fields a configuration is identified by, in the order they are reported.
+# options holds the values of any other matrix dimensions.
+KEY_FIELDS = ('type', 'encryption', 'compression', 'compression_level',
+                'fileset', 'host', 'options')
+# Fields set by the argument sections and the matrix. The other key fields
+# decide which configurations are compared against the same baseline.
+ARG_FIELDS = ('encryption', 'compression', 'compression_level', 'options')
+SQLITE_HEADER = "SQLite format 3\x00"
+MEBIBYTE = 1024.0 * 1024.0
+
+def is_database(path):
+    """Checks whether I{path} is an SQLite database rather than an XML
+    document.
+
+    @return: bool
+
+    """
+    f = open(path, 'rb')
+    try:
+        return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    finally:
+        f.close()
+
+def iter_xml(path):
+    """Reads results from a SPODTest XML document, one at a time.
+
+    Results that failed verification are left out, since they did not
+    transfer every file:
+
+    >>> from StringIO import StringIO
+    >>> doc = StringIO('<spodtest>'
+    ...     '<testcase type="cp" total_size="100" transfer_time="2.0"/>'
+    ...     '<testcase type="cp" total_size="100" transfer_time="1.0" '
+    ...     'valid="no"/></spodtest>')
+    >>> [throughput for (key, timestamp, throughput) in iter_xml(doc)]
+    [50.0]
+
+    @return: generator of tuples of (key, timestamp, throughput).
+
+    """
+    for (event, element) in etree.iterparse(path, tag="testcase"):
+        attrib = element.attrib
+        valid = attrib.get('valid') != 'no'
+        try:
+            throughput = (float(attrib['total_size']) /
+                            float(attrib['transfer_time']))
+        except (KeyError, ValueError, ZeroDivisionError), e:
+            throughput = None
+        values = dict(attrib)
+        values['host'] = attrib.get('to')
+        values['options'] = resultdb.get_options(attrib)
+        key = tuple(values.get(field) for field in KEY_FIELDS)
+        timestamp = rfc3339_to_timestamp(attrib.get('date', ''))
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+        if throughput is not None and valid:
+            yield (key, timestamp, throughput)
+
+def iter_database(path):
+    """Reads results from a L{result database<resultdb.ResultDB>}, one at a
+    time. Results that failed verification are left out.
+
+    @return: generator of tuples of (key, timestamp, throughput).
+
+    """
+    db = resultdb.ResultDB(path)
+    try:
+        cursor = db.connection.execute(
+            "SELECT %s, timestamp, throughput FROM testcase "
+            "WHERE throughput IS NOT NULL AND %s" % (", ".join(KEY_FIELDS),
+                                                    resultdb.VALID))
+        for row in cursor:
+            yield (tuple(row[field] for field in KEY_FIELDS),
+                    row['timestamp'], row['throughput'])
+    finally:
+        db.close()
+
+def iter_results(paths):
+    """Reads results from XML documents and result databases.
+
+    @param paths: Paths of XML documents or result databases.
+    @type paths: list of strings
+    @return: generator of tuples of (key, timestamp, throughput), where key
+             holds the values of L{KEY_FIELDS}.
+
+    """
+    for path in paths:
+        if is_database(path):
+            results = iter_database(path)
+        else:
+            results = iter_xml(path)
+        for result in results:
+            yield result
+
+def parse_date(date_str):
+    """Parses a date given on the command line, either as YYYY-MM-DD in UTC
+    or as an RFC3339 date.
+
+    @return: float seconds since the epoch.
+
+    """
+    timestamp = rfc3339_to_timestamp(date_str)
+    if timestamp is not None:
+        return timestamp
+    try:
+        date = datetime.datetime.strptime(date_str.strip(), "%Y-%m-%d")
+    except ValueError, ve:
+        raise ReportError("Invalid date %s, must be YYYY-MM-DD or RFC3339" %
+                            date_str)
+    return calendar.timegm(date.timetuple())
+
+def parse_range(range_str):
+    """Parses a date range on the form START:END, where either date may be
+    left out. The range includes START and excludes END.
+
+    @return: tuple of (start, end), with None for an open end.
+
+    """
+    (start, end) = split_range(range_str)
+    return (start and parse_date(start) or None,
+            end and parse_date(end) or None)
+
+def split_range(range_str):
+    """Splits a date range in two at the colon that separates the dates.
+
+    RFC3339 dates contain colons themselves, so each colon is tried until
+    both halves are dates.
+
+    """
+    for (i, c) in enumerate(range_str):
+        if c != ':':
+            continue
+        (start, end) = (range_str[:i], range_str[i + 1:])
+        if is_date(start) and is_date(end):
+            return (start, end)
+    raise ReportError("Invalid date range %s, must be START:END" % range_str)
+
+def is_date(date_str):
+    """Checks whether I{date_str} is empty or a date L{parse_date} accepts. """
+    if date_str == '':
+        return True
+    try:
+        parse_date(date_str)
+    except ReportError, e:
+        return False
+    return True
+
+def parse_options(options):
+    """Splits an options string from L{get_options} into the values of its
+    dimensions.
+
+    @return: dict mapping dimension to value.
+
+    """
+    values = {}
+    if options == '-':
+        return values
+    dimension = None
+    for item in options.split(' '):
+        if '=' in item:
+            (dimension, value) = item.split('=', 1)
+            values[dimension] = value
+        elif dimension is not None:
+            # The value of the previous dimension contains a space.
+            values[dimension] += ' ' + item
+    return values
+
+def parse_baseline(baseline_str):
+    """Parses a baseline argument set on the form KEY=VALUE,...
+
+    Encryption, compression and compression_level are C{default} when they
+    are not given, the value used in the results when an argument section
+    does not set them. Other keys are extra matrix dimensions, and only the
+    dimensions given are part of the baseline.
+
+    @return: dict mapping the fields of L{ARG_FIELDS} other than options to
+             their values, and options to a dict of the given dimensions.
+
+    """
+    baseline = dict((field, 'default') for field in ARG_FIELDS)
+    baseline['options'] = {}
+    for item in baseline_str.split(','):
+        if item.strip() == '':
+            continue
+        if '=' not in item:
+            raise ReportError("Invalid baseline %s, must be KEY=VALUE,..." %
+                                item)
+        (field, value) = [s.strip() for s in item.split('=', 1)]
+        if field in ARG_FIELDS and field != 'options':
+            baseline[field] = value
+        else:
+            baseline['options'][field] = value
+    return baseline
+
+def in_range(timestamp, date_range):
+    """Checks whether I{timestamp} is inside I{date_range}. """
+    (start, end) = date_range
+    if start is None and end is None:
+        return True
+    if timestamp is None:
+        return False
+    return ((start is None or timestamp >= start) and
+            (end is None or timestamp < end))
+
+
+class Report(object):
+    """Throughput of configurations aggregated from stored results.
+
+    Results are aggregated as they are read, keeping only a
+    L{RunningStats<stats.RunningStats>} for each configuration and date
+    range, so the size of the result history does not matter.
+
+    A configuration is the values of L{KEY_FIELDS}. With two date ranges,
+    the configurations are ranked by the second one and each configuration
+    is tested for a significant difference between the two.
+
+    """
+    def __init__(self, ranges=None, baseline=None):
+        """Initializes an empty report.
+
+        @param ranges: Up to two date ranges from L{parse_range}. Results
+                       outside the ranges are ignored. Defaults to one
+                       range covering every result.
+        @type ranges: list of tuples
+        @param baseline: Values of L{ARG_FIELDS} that speedups are relative
+                         to, from L{parse_baseline}.
+        @type baseline: dict
+
+        """
+        if ranges is None or len(ranges) == 0:
+            ranges = [(None, None)]
+        if len(ranges) > 2:
+            raise ReportError("At most two date ranges can be compared")
+        self.ranges = ranges
+        self.baseline = baseline
+        self.groups = {}
+    def add(self, key, timestamp, throughput):
+        """Adds the result of one test case. """
+        for (i, date_range) in enumerate(self.ranges):
+            if in_range(timestamp, date_range):
+                if key not in self.groups:
+                    self.groups[key] = [stats.RunningStats()
+                                        for r in self.ranges]
+                self.groups[key][i].add(throughput)
+    def add_results(self, results):
+        """Adds every result from I{results}, as given by L{iter_results}. """
+        for (key, timestamp, throughput) in results:
+            self.add(key, timestamp, throughput)
+    def get_baseline_key(self, key):
+        """Gets the key of the baseline configuration compared with I{key}.
+
+        The dimensions the baseline names are set to their baseline values,
+        while the dimensions it does not name, such as the cache mode, keep
+        the values of I{key}.
+
+        @return: tuple, or None if no baseline is set.
+
+        """
+        if self.baseline is None:
+            return None
+        values = dict(zip(KEY_FIELDS, key))
+        options = parse_options(values['options'])
+        options.update(self.baseline['options'])
+        values.update(self.baseline)
+        values['options'] = resultdb.get_options(dict(options,
+                                            dimensions=" ".join(options)))
+        return tuple(values[field] for field in KEY_FIELDS)
+    def get_rows(self):
+        """Gets the configurations ranked by mean throughput, fastest first.
+
+        @return: list of dicts with the values of L{KEY_FIELDS}, I{ranges}
+                 with a L{RunningStats<stats.RunningStats>} for each date
+                 range, I{speedup} against the baseline and I{test} from
+                 L{welch_test<stats.welch_test>} when two ranges are given.
+                 Values that cannot be calculated are None.
+
+        """
+        current = len(self.ranges) - 1
+        rows = []
+        for (key, range_stats) in self.groups.items():
+            if range_stats[current].count == 0:
+                continue
+            row = dict(zip(KEY_FIELDS, key))
+            row['ranges'] = range_stats
+            row['speedup'] = None
+            baseline = self.groups.get(self.get_baseline_key(key))
+            if baseline is not None and baseline[current].count > 0:
+                row['speedup'] = (range_stats[current].get_mean() /
+                                    baseline[current].get_mean())
+            row['test'] = None
+            if len(self.ranges) == 2:
+                row['test'] = stats.welch_test(range_stats[0],
+                                                range_stats[1])
+            rows.append(row)
+        rows.sort(key=lambda row: row['ranges'][current].get_mean(),
+                    reverse=True)
+        return rows
+    def write(self, out):
+        """Writes the report as tab separated columns to I{out}. """
+        columns = ['rank'] + list(KEY_FIELDS)
+        if len(self.ranges) == 2:
+            columns += ['n_a', 'mean_a', 'n_b', 'mean_b', 'stddev_b',
+                        'change', 'significant']
+        else:
+            columns += ['n', 'mean', 'stddev', 'min', 'max']
+        columns.append('speedup')
+        out.write("%s\n" % "\t".join(columns))
+        for (rank, row) in enumerate(self.get_rows()):
+            values = [str(rank + 1)] + [str(row[field])
+                                        for field in KEY_FIELDS]
+            current = row['ranges'][-1]
+            if len(self.ranges) == 2:
+                previous = row['ranges'][0]
+                change = None
+                if previous.count > 0:
+                    change = 100.0 * (current.get_mean() /
+                                        previous.get_mean() - 1)
+                significant = '-'
+                if row['test'] is not None:
+                    significant = row['test'][2] and 'yes' or 'no'
+                values += [str(previous.count),
+                            format_speed(previous.get_mean()),
+                            str(current.count),
+                            format_speed(current.get_mean()),
+                            format_speed(current.get_stddev()),
+                            format_number(change, "%+.1f%%"),
+                            significant]
+            else:
+                values += [str(current.count),
+                            format_speed(current.get_mean()),
+                            format_speed(current.get_stddev()),
+                            format_speed(current.min),
+                            format_speed(current.max)]
+            values.append(format_number(row['speedup'], "%.2fx"))
+            out.write("%s\n" % "\t".join(values))
+
+def format_number(value, fmt):
+    """Formats I{value} with I{fmt}, or as - if it is None. """
+    if value is None:
+        return '-'
+    return fmt % value
+
+def format_speed(value):
+    """Formats a throughput in bytes per second as MiB/s. """
+    if value is None:
+        return '-'
+    return "%.2f" % (value/MEBIBYTE)
+
+def main(args):
+    """Runs the report subcommand.
+
+    @param args: Command line arguments after the subcommand.
+    @type args: list of strings
+    @return: int exit status
+
+    """
+    parser = optparse.OptionParser(
+        usage="%prog report [options] SOURCE...",
+        description=("Ranks configurations by mean throughput in MiB/s. "
+                    "Each SOURCE is a SPODTest XML document or a result "
+                    "database."))
+    parser.add_option("-b", "--baseline", metavar="KEY=VALUE,...",
+                    help=("argument set to show speedups against, such as "
+                        "encryption=aes128-ctr,compression=no. Fields not "
+                        "given are 'default'"))
+    parser.add_option("-a", "--range-a", metavar="START:END",
+                    help=("date range to compare against, as YYYY-MM-DD, "
+                        "including START and excluding END. Either date "
+                        "may be left out"))
+    parser.add_option("-r", "--range-b", metavar="START:END",
+                    help=("date range to rank by and compare with --range-a. "
+                        "Without --range-a, only results in this range are "
+                        "reported"))
+    (options, arguments) = parser.parse_args(args)
+    if len(arguments) < 1:
+        parser.error("at least one SOURCE is required")
+    if options.range_a is not None and options.range_b is None:
+        parser.error("--range-a requires --range-b")
+    try:
+        ranges = [parse_range(r) for r in (options.range_a, options.range_b)
+                    if r is not None]
+        baseline = None
+        if options.baseline is not None:
+            baseline = parse_baseline(options.baseline)
+        report = Report(ranges, baseline)
+        report.add_results(iter_results(arguments))
+    except (ReportError, IOError, etree.XMLSyntaxError), e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    report.write(sys.stdout)
+    return 0
+
+
+class Error(Exception):
+    pass
+
+class ReportError(Error):
+    pass
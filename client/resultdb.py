@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+#
+#            resultdb.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import json
+import time
+import sqlite3
+import optparse
+import threading
+
+from lxml import etree
+
+import stats
+import xmlpacker
+from utils import rfc3339_to_timestamp
+
+# Maps attributes of the testcase element to columns of the testcase table.
+# Attributes that are not listed here are kept as JSON in the attributes
+# column.
+COLUMNS = (
+    ('date', 'date', 'TEXT', str),
+    ('to', 'host', 'TEXT', str),
+    ('type', 'type', 'TEXT', str),
+    ('encryption', 'encryption', 'TEXT', str),
+    ('compression', 'compression', 'TEXT', str),
+    ('compression_level', 'compression_level', 'TEXT', str),
+    ('fileset', 'fileset', 'TEXT', str),
+    ('num_files', 'num_files', 'INTEGER', int),
+    ('total_size', 'total_size', 'INTEGER', int),
+    ('transfer_time', 'transfer_time', 'REAL', float),
+    ('repetitions', 'repetitions', 'INTEGER', int),
+    ('warmup', 'warmup', 'INTEGER', int),
+    ('cpu_user', 'cpu_user', 'REAL', float),
+    ('cpu_system', 'cpu_system', 'REAL', float),
+    ('handshake_time', 'handshake_time', 'REAL', float),
+    ('first_byte_time', 'first_byte_time', 'REAL', float),
+    ('ramp_up_time', 'ramp_up_time', 'REAL', float),
+    ('steady_throughput', 'steady_throughput', 'REAL', float),
+    ('valid', 'valid', 'TEXT', str),
+)
+# Columns that results can be grouped and filtered by. options holds the
+# values of the extra matrix dimensions, from get_options, and valid is no
+# for results that failed verification.
+DIMENSIONS = ('host', 'type', 'encryption', 'compression',
+                'compression_level', 'fileset', 'options', 'valid')
+# Condition leaving out results that did not transfer every file whole.
+# Results that were not verified are kept.
+VALID = "(valid IS NULL OR valid != 'no')"
+TABLES = """
+CREATE TABLE IF NOT EXISTS testcase (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL,
+    throughput REAL,
+    %s,
+    options TEXT,
+    attributes TEXT
+);
+CREATE TABLE IF NOT EXISTS sample (
+    testcase_id INTEGER NOT NULL REFERENCES testcase(id),
+    run INTEGER NOT NULL,
+    transfer_time REAL,
+    throughput REAL,
+    cpu_user REAL,
+    cpu_system REAL
+);
+""" % ",\n    ".join("%s %s" % (column, sqltype)
+                    for (attr, column, sqltype, convert) in COLUMNS)
+INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS testcase_unique ON testcase (
+    date, host, type, encryption, compression, compression_level, fileset,
+    options, transfer_time);
+CREATE INDEX IF NOT EXISTS testcase_host ON testcase (host, timestamp);
+CREATE INDEX IF NOT EXISTS testcase_type ON testcase (type);
+CREATE INDEX IF NOT EXISTS testcase_encryption ON testcase (encryption);
+CREATE INDEX IF NOT EXISTS testcase_compression ON testcase (
+    compression, compression_level);
+CREATE INDEX IF NOT EXISTS testcase_fileset ON testcase (fileset);
+CREATE INDEX IF NOT EXISTS testcase_options ON testcase (options);
+CREATE INDEX IF NOT EXISTS testcase_timestamp ON testcase (timestamp);
+CREATE INDEX IF NOT EXISTS sample_testcase ON sample (testcase_id);
+"""
+
+def get_options(attributes):
+    """Gets the values of the extra matrix dimensions of a result.
+
+    The cache mode is counted as a dimension, since it changes what is
+    measured.
+
+    @param attributes: Attributes of a testcase element.
+    @type attributes: dict
+    @return: string on the form C{dimension=value ...}, sorted by dimension,
+             or C{-} if the result has no extra dimensions.
+
+    """
+    dimensions = attributes.get('dimensions', '').split()
+    if 'cache_mode' in attributes and 'cache_mode' not in dimensions:
+        dimensions.append('cache_mode')
+    if len(dimensions) == 0:
+        return '-'
+    return " ".join("%s=%s" % (dimension, attributes.get(dimension))
+                    for dimension in sorted(dimensions))
+
+class Median(object):
+    """SQLite aggregate function giving the median of its values. """
+    def __init__(self):
+        self.values = []
+    def step(self, value):
+        if value is not None:
+            self.values.append(value)
+    def finalize(self):
+        return stats.median(self.values)
+
+
+class ResultDB(object):
+    """Test case results stored in an SQLite database.
+
+    Results are stored with the same fields as the testcase elements of the
+    XML document, and the raw samples of repeated test cases. A result that
+    is already in the database is not added again, so the same XML document
+    can be imported more than once.
+
+    """
+    def __init__(self, path):
+        """Opens the database in I{path}, creating it if it does not exist.
+
+        @param path: Path of the database file.
+        @type path: string
+
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.create_aggregate('median', 1, Median)
+        self.connection.executescript(TABLES)
+        self.upgrade()
+        self.connection.executescript(INDEXES)
+        self.xmldoc = xmlpacker.XMLDoc()
+        self.lock = threading.Lock()
+    def upgrade(self):
+        """Adds the options and valid columns to a database created without
+        them.
+
+        The values of the stored results are filled in from their
+        attributes. The unique index is replaced by one that includes the
+        options, so results that differ only in an extra matrix dimension
+        are kept apart.
+
+        """
+        columns = [row['name'] for row in
+                    self.connection.execute("PRAGMA table_info(testcase)")]
+        if 'options' in columns and 'valid' in columns:
+            return
+        with self.connection:
+            rows = self.connection.execute("SELECT id, attributes "
+                                            "FROM testcase").fetchall()
+            attributes = [(row['id'], json.loads(row['attributes'] or '{}'))
+                            for row in rows]
+            if 'options' not in columns:
+                self.connection.execute("ALTER TABLE testcase "
+                                        "ADD COLUMN options TEXT")
+                self.connection.executemany(
+                    "UPDATE testcase SET options = ? WHERE id = ?",
+                    [(get_options(attrib), testcase_id)
+                        for (testcase_id, attrib) in attributes])
+                self.connection.execute("DROP INDEX IF EXISTS "
+                                        "testcase_unique")
+            if 'valid' not in columns:
+                self.connection.execute("ALTER TABLE testcase "
+                                        "ADD COLUMN valid TEXT")
+                self.connection.executemany(
+                    "UPDATE testcase SET valid = ? WHERE id = ?",
+                    [(attrib.get('valid'), testcase_id)
+                        for (testcase_id, attrib) in attributes])
+    def close(self):
+        """Closes the database. """
+        self.connection.close()
+    def add(self, key, testcase):
+        """Adds the result of a finished test case.
+
+        Has the same signature as L{ResultSink.add<resultsink.ResultSink.add>}
+        so both can be used as callbacks for the same run.
+
+        @param key: Position of the result in the run. Not used.
+        @param testcase: The finished test case.
+        @type testcase: L{TestCase<testers.base.TestCase>}
+
+        """
+        element = self.xmldoc.create_testcase(testcase)
+        if element is None:
+            return
+        with self.lock:
+            with self.connection:
+                self.insert_element(element)
+    def insert_element(self, element):
+        """Inserts a testcase element. Must be called inside a transaction.
+
+        @param element: A testcase element.
+        @type element: lxml.etree.Element
+        @return: bool indicating whether the result was new.
+
+        """
+        attributes = dict(element.attrib)
+        values = []
+        for (attr, column, sqltype, convert) in COLUMNS:
+            value = attributes.pop(attr, None)
+            if value is not None:
+                try:
+                    value = convert(value)
+                except ValueError, ve:
+                    value = None
+            values.append(value)
+        row = dict(zip([column for (attr, column, sqltype, convert)
+                        in COLUMNS], values))
+        throughput = None
+        if row['total_size'] is not None and row['transfer_time']:
+            throughput = row['total_size']/row['transfer_time']
+        timestamp = None
+        if row['date'] is not None:
+            timestamp = rfc3339_to_timestamp(row['date'])
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO testcase (timestamp, throughput, %s, "
+            "options, attributes) VALUES (?, ?, %s, ?, ?)" % (
+                ", ".join(column for (attr, column, sqltype, convert)
+                            in COLUMNS),
+                ", ".join("?" for c in COLUMNS)),
+            [timestamp, throughput] + values +
+            [get_options(attributes), json.dumps(attributes)])
+        if cursor.rowcount == 0:
+            return False
+        testcase_id = cursor.lastrowid
+        samples = []
+        for (run, sample) in enumerate(element.iterfind("sample")):
+            samples.append((testcase_id, run,
+                            float(sample.get("transfer_time")),
+                            float(sample.get("throughput")),
+                            float(sample.get("cpu_user", "nan")),
+                            float(sample.get("cpu_system", "nan"))))
+        self.connection.executemany("INSERT INTO sample VALUES "
+                                    "(?, ?, ?, ?, ?, ?)", samples)
+        return True
+    def import_xml(self, xml_file):
+        """Imports every testcase element of a SPODTest XML document.
+
+        The document is read incrementally, so large documents are never
+        held in memory as a whole.
+
+        @param xml_file: Path of the XML document.
+        @type xml_file: string
+        @return: tuple of (new results, results already in the database).
+
+        """
+        new = 0
+        old = 0
+        with self.lock:
+            with self.connection:
+                for (event, element) in etree.iterparse(xml_file,
+                                                        tag="testcase"):
+                    if self.insert_element(element):
+                        new += 1
+                    else:
+                        old += 1
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+        return (new, old)
+    def query(self, group_by=('encryption',), since=None, until=None,
+                **filters):
+        """Summarises the throughput of stored results.
+
+        Results that failed verification are only counted when asked for:
+
+        >>> db = ResultDB(':memory:')
+        >>> for (size, valid) in (('100', 'yes'), ('300', 'no')):
+        ...     db.insert_element(etree.Element('testcase', type='cp',
+        ...             total_size=size, transfer_time='1.0', valid=valid))
+        True
+        True
+        >>> [(row['count'], row['median']) for row in db.query([])]
+        [(1, 100.0)]
+        >>> [(row['valid'], row['median']) for row in db.query(['valid'])]
+        [(u'no', 300.0), (u'yes', 100.0)]
+
+        @param group_by: Dimensions to group the results by.
+        @type group_by: list of strings from L{DIMENSIONS}
+        @param since: Only include results from this time and later.
+        @type since: float seconds since the epoch
+        @param until: Only include results from before this time.
+        @type until: float seconds since the epoch
+        @param filters: Dimensions that results must have a given value for,
+                        such as C{host='titan.uio.no'}, or
+                        C{options='streams=4'} for the extra matrix
+                        dimensions. Results that failed verification are
+                        left out unless valid is filtered or grouped by.
+        @return: list of sqlite3.Row with the group_by columns and count,
+                 median, mean, min and max throughput in bytes per second,
+                 ordered by median throughput, fastest first.
+
+        """
+        for dimension in list(group_by) + filters.keys():
+            if dimension not in DIMENSIONS:
+                raise ResultDBError("Unknown dimension %s, must be one of: "
+                                    "%s" % (dimension, ", ".join(DIMENSIONS)))
+        where = []
+        params = []
+        for (dimension, value) in sorted(filters.items()):
+            if value is not None:
+                where.append("%s = ?" % dimension)
+                params.append(value)
+        if filters.get('valid') is None and 'valid' not in group_by:
+            where.append(VALID)
+        if since is not None:
+            where.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("timestamp < ?")
+            params.append(until)
+        sql = ("SELECT %s count(*) AS count, median(throughput) AS median, "
+                "avg(throughput) AS mean, min(throughput) AS min, "
+                "max(throughput) AS max FROM testcase") % "".join(
+                    "%s, " % dimension for dimension in group_by)
+        if len(where) > 0:
+            sql += " WHERE %s" % " AND ".join(where)
+        if len(group_by) > 0:
+            sql += " GROUP BY %s" % ", ".join(group_by)
+        sql += " ORDER BY median DESC"
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+
+def import_main(args):
+    """Runs the import subcommand.
+
+    @param args: Command line arguments after the subcommand.
+    @type args: list of strings
+    @return: int exit status
+
+    """
+    parser = optparse.OptionParser(
+        usage="%prog import DATABASE XMLFILE...",
+        description="Imports SPODTest XML documents into a result database.")
+    (options, arguments) = parser.parse_args(args)
+    if len(arguments) < 2:
+        parser.error("a DATABASE and at least one XMLFILE are required")
+    db = ResultDB(arguments[0])
+    try:
+        for xml_file in arguments[1:]:
+            (new, old) = db.import_xml(xml_file)
+            sys.stdout.write("%s: %d new results, %d already stored\n" % (
+                            xml_file, new, old))
+    except (IOError, etree.XMLSyntaxError), e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    finally:
+        db.close()
+    return 0
+
+def query_main(args):
+    """Runs the query subcommand.
+
+    @param args: Command line arguments after the subcommand.
+    @type args: list of strings
+    @return: int exit status
+
+    """
+    parser = optparse.OptionParser(
+        usage="%prog query [options] DATABASE",
+        description=("Summarises throughput in a result database. Example: "
+                    "median throughput per cipher for a host over the last "
+                    "30 days: query --host HOST --days 30 "
+                    "--group-by encryption DATABASE"))
+    parser.add_option("-g", "--group-by", default="encryption",
+                    help=("comma separated dimensions to group by, from: "
+                        "%s [default: %%default]") % ", ".join(DIMENSIONS))
+    parser.add_option("-d", "--days", type="float",
+                    help="only include results from the last DAYS days")
+    for dimension in DIMENSIONS:
+        parser.add_option("--%s" % dimension.replace("_", "-"),
+                        dest=dimension,
+                        help="only include results with this %s" % dimension)
+    (options, arguments) = parser.parse_args(args)
+    if len(arguments) != 1:
+        parser.error("exactly one DATABASE is required")
+    group_by = [d.strip() for d in options.group_by.split(",") if d.strip()]
+    since = None
+    if options.days is not None:
+        since = time.time() - options.days * 86400
+    filters = dict((dimension, getattr(options, dimension))
+                    for dimension in DIMENSIONS)
+    db = ResultDB(arguments[0])
+    try:
+        rows = db.query(group_by, since=since, **filters)
+    except ResultDBError, e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    finally:
+        db.close()
+    columns = group_by + ['count', 'median', 'mean', 'min', 'max']
+    sys.stdout.write("%s\n" % "\t".join(columns))
+    for row in rows:
+        sys.stdout.write("%s\n" % "\t".join(format_value(row[column])
+                                            for column in columns))
+    return 0
+
+def format_value(value):
+    """Formats a value from a query for printing. """
+    if isinstance(value, float):
+        return "%.2f" % value
+    return str(value)
+
+
+class Error(Exception):
+    pass
+
+class ResultDBError(Error):
+    pass
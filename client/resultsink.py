@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+#            resultsink.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import logging
+import threading
+
+from lxml import etree
+
+import xmlpacker
+
+class ResultSink(object):
+    """Writes test case results to an XML document as they finish.
+
+    Each result is appended to a journal next to the document as soon as it
+    is added, so results survive if the run is interrupted. When the sink
+    is closed, the journal is compacted into the document. A journal left
+    behind by an interrupted run is compacted when the next sink for the
+    same document is opened.
+
+    The journal holds one result per line, on the form::
+
+        <key> <key> <testcase .../>
+
+    where the keys give the order of the results in the document.
+
+    """
+    def __init__(self, xml_file):
+        """Opens a sink for the document I{xml_file}.
+
+        @param xml_file: Path of the XML document. It does not have to exist.
+        @type xml_file: string
+
+        """
+        self.xml_file = xml_file
+        self.journal_file = "%s.journal" % xml_file
+        self.xmldoc = xmlpacker.XMLDoc()
+        self.lock = threading.Lock()
+        if os.path.exists(self.journal_file):
+            logging.warning("Recovering results from %s" % self.journal_file)
+            self.compact()
+        self.journal = open(self.journal_file, "a")
+    def add(self, key, testcase):
+        """Adds the result of a test case.
+
+        @param key: The position of the result in the document. Results are
+                    ordered by their keys when the journal is compacted, not
+                    by the order they were added in.
+        @type key: tuple of two ints
+        @param testcase: The finished test case.
+        @type testcase: L{TestCase<testers.base.TestCase>}
+
+        """
+        element = self.xmldoc.create_testcase(testcase)
+        if element is None:
+            return
+        line = "%d %d %s\n" % (key[0], key[1], etree.tostring(element))
+        with self.lock:
+            self.journal.write(line)
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+    def close(self):
+        """Closes the journal and compacts it into the document. """
+        with self.lock:
+            self.journal.close()
+            self.compact()
+    def read_journal(self):
+        """Reads the results in the journal.
+
+        A line that was only partly written when a run was interrupted is
+        skipped.
+
+        @return: list of elements, ordered by their keys.
+
+        """
+        entries = []
+        f = open(self.journal_file, "r")
+        for (number, line) in enumerate(f):
+            try:
+                (key1, key2, xml) = line.split(" ", 2)
+                entries.append(((int(key1), int(key2), number),
+                                etree.fromstring(xml)))
+            except (ValueError, etree.XMLSyntaxError), e:
+                logging.warning("Skipping line %d of %s: %s" % (
+                                number + 1, self.journal_file, e))
+        f.close()
+        entries.sort(key=lambda entry: entry[0])
+        return [element for (key, element) in entries]
+    def compact(self):
+        """Writes the document with the results in the journal appended,
+        and removes the journal.
+
+        The existing document is read incrementally, so it is never held in
+        memory as a whole. The new document is written to a temporary file
+        which then replaces the old one.
+
+        """
+        elements = self.read_journal()
+        tmp_file = "%s.tmp" % self.xml_file
+        with etree.xmlfile(tmp_file, encoding='utf-8') as xf:
+            xf.write_declaration()
+            existing = None
+            if os.path.exists(self.xml_file):
+                existing = etree.iterparse(self.xml_file,
+                                            events=('start', 'end'),
+                                            remove_blank_text=True)
+                (event, root) = existing.next()
+                attrib = dict(root.attrib)
+                tag = root.tag
+            else:
+                attrib = {}
+                tag = "spodtest"
+            with xf.element(tag, attrib):
+                xf.write("\n")
+                if existing is not None:
+                    self.copy_children(existing, xf)
+                for element in elements:
+                    xf.write(element, pretty_print=True)
+        os.rename(tmp_file, self.xml_file)
+        os.remove(self.journal_file)
+    def copy_children(self, events, xf):
+        """Copies the children of the root element from an iterparse of the
+        existing document to I{xf}, one at a time.
+
+        """
+        depth = 1
+        for (event, element) in events:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            xf.write(element, pretty_print=True)
+            # Frees the element and everything parsed before it.
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
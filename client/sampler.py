@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+#
+#            sampler.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import threading
+
+import timer
+import stats
+
+PROC_STAT = '/proc/stat'
+PROC_NET_DEV = '/proc/net/dev'
+PROC_DISKSTATS = '/proc/diskstats'
+SYS_BLOCK = '/sys/block'
+SYS_NET = '/sys/class/net'
+SECTOR_SIZE = 512
+LOOPBACK = 'lo'
+# Block devices that are not disks of their own. Device mapper devices are
+# left out, since their I/O is also counted on the disks below them.
+VIRTUAL_DISKS = ('loop', 'ram', 'zram', 'dm-')
+# Fields of a utilisation summary, in the order they are reported. cpu is
+# the busy share of all cores, cpu_max_core that of the busiest core, and
+# disk_busy and net_util the share of time the busiest disk was busy and of
+# the capacity of the busiest network interface. Rates are in bytes per
+# second.
+FIELDS = ('cpu', 'cpu_max_core', 'iowait', 'disk_read', 'disk_write',
+            'disk_busy', 'net_rx', 'net_tx', 'net_util')
+# Utilisation from which a resource is taken to limit the transfer.
+BOTTLENECK_THRESHOLD = 0.8
+# Bottlenecks a test case is tagged with. none means that no local resource
+# was saturated, as when the transfer waits on round trips or on the remote
+# host.
+BOTTLENECKS = ('cpu', 'disk', 'network', 'none')
+
+def read_stat():
+    """Reads the CPU times of every core from /proc/stat.
+
+    @return: tuple from L{parse_stat}
+
+    """
+    f = open(PROC_STAT)
+    try:
+        return parse_stat(f)
+    finally:
+        f.close()
+
+def parse_stat(lines):
+    """Parses the CPU times of every core from the lines of /proc/stat.
+
+    @return: tuple of (list of the busy and total jiffies of the whole
+             system, the iowait jiffies and a list of (busy, total) for each
+             core).
+
+    """
+    system = None
+    cores = []
+    for line in lines:
+        if not line.startswith('cpu'):
+            continue
+        fields = line.split()
+        values = [int(value) for value in fields[1:]]
+        # Guest time is already counted in user and nice time.
+        total = sum(values[:8])
+        idle = values[3] + values[4]
+        if fields[0] == 'cpu':
+            system = (total - idle, total, values[4])
+        else:
+            cores.append((total - idle, total))
+    return (system, cores)
+
+def read_net_dev(loopback=False):
+    """Reads the bytes received and sent on each interface.
+
+    @param loopback: Whether to read the loopback interface instead of the
+                     others.
+    @type loopback: bool
+    @return: dict mapping interface names to tuples of (received bytes,
+             sent bytes).
+
+    """
+    counters = {}
+    f = open(PROC_NET_DEV)
+    try:
+        for line in f:
+            if ':' not in line:
+                continue
+            (name, data) = line.split(':', 1)
+            name = name.strip()
+            if (name == LOOPBACK) != loopback:
+                continue
+            fields = data.split()
+            counters[name] = (int(fields[0]), int(fields[8]))
+    finally:
+        f.close()
+    return counters
+
+def read_diskstats():
+    """Reads the sectors read and written, and the time spent doing I/O, of
+    each disk.
+
+    @return: dict from L{parse_diskstats}
+
+    """
+    f = open(PROC_DISKSTATS)
+    try:
+        return parse_diskstats(f, os.listdir(SYS_BLOCK))
+    finally:
+        f.close()
+
+def parse_diskstats(lines, devices):
+    """Parses the counters of each disk from the lines of /proc/diskstats.
+
+    @param devices: Names of the block devices in /sys/block. Partitions are
+                    not among them, so they are left out along with the
+                    devices in L{VIRTUAL_DISKS}.
+    @type devices: list of strings
+    @return: dict mapping disk names to tuples of (sectors read, sectors
+             written, milliseconds spent doing I/O).
+
+    """
+    disks = set(name for name in devices
+                if not name.startswith(VIRTUAL_DISKS))
+    counters = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 13 or fields[2] not in disks:
+            continue
+        counters[fields[2]] = (int(fields[5]), int(fields[9]),
+                                int(fields[12]))
+    return counters
+
+def get_link_speed(interface):
+    """Gets the speed of a network interface.
+
+    @return: float bytes per second, or None if the interface does not
+             report its speed, as virtual interfaces do not.
+
+    """
+    try:
+        f = open(os.path.join(SYS_NET, interface, 'speed'))
+        try:
+            speed = int(f.read().strip())
+        finally:
+            f.close()
+    except (IOError, ValueError), e:
+        return None
+    if speed <= 0:
+        return None
+    return speed * 1000000.0 / 8
+
+def is_available():
+    """Checks whether the counters the sampler reads are available.
+
+    @return: bool
+
+    """
+    return all(os.access(path, os.R_OK) for path in
+                (PROC_STAT, PROC_NET_DEV, PROC_DISKSTATS, SYS_BLOCK))
+
+def classify(utilisation):
+    """Decides which resource limited a transfer.
+
+    The resource with the highest utilisation at or above
+    L{BOTTLENECK_THRESHOLD} is the bottleneck. The CPU counts as saturated
+    when either all cores or the busiest one is, since ciphers and
+    compression in ssh use a single core.
+
+    @param utilisation: Summary with the keys in L{FIELDS}.
+    @type utilisation: dict
+    @return: string in L{BOTTLENECKS}
+
+    """
+    candidates = [
+        ('cpu', max(utilisation.get('cpu') or 0.0,
+                    utilisation.get('cpu_max_core') or 0.0)),
+        ('disk', utilisation.get('disk_busy') or 0.0),
+        ('network', utilisation.get('net_util') or 0.0),
+    ]
+    (resource, value) = max(candidates, key=lambda c: c[1])
+    if value < BOTTLENECK_THRESHOLD:
+        return 'none'
+    return resource
+
+def summarize(summaries, fields=FIELDS):
+    """Combines the summaries of several runs into their medians.
+
+    @param summaries: Summaries from L{Sampler.get_summary}.
+    @type summaries: list of dicts
+    @param fields: Fields of the summaries.
+    @type fields: list of strings
+    @return: dict with the keys in I{fields}, with None for fields that no
+             run has.
+
+    """
+    combined = {}
+    for field in fields:
+        combined[field] = stats.median([summary[field]
+                                        for summary in summaries
+                                        if summary.get(field) is not None])
+    return combined
+
+
+class Snapshot(object):
+    """The counters of the host at one point in time. """
+    def __init__(self, loopback=False):
+        self.time = timer.monotonic()
+        (self.cpu, self.cores) = read_stat()
+        self.net = read_net_dev(loopback)
+        self.disks = read_diskstats()
+    def get_utilisation(self, previous, link_speeds):
+        """Gets the utilisation of the host since I{previous}.
+
+        @param previous: An earlier snapshot.
+        @type previous: L{Snapshot}
+        @param link_speeds: Speed of each interface in bytes per second, or
+                            None if it is not known.
+        @type link_speeds: dict
+        @return: dict with the keys in L{FIELDS}, with None for values that
+                 cannot be found.
+
+        """
+        elapsed = self.time - previous.time
+        utilisation = dict((field, None) for field in FIELDS)
+        if elapsed <= 0:
+            return utilisation
+        total = self.cpu[1] - previous.cpu[1]
+        if total > 0:
+            utilisation['cpu'] = float(self.cpu[0] - previous.cpu[0])/total
+            utilisation['iowait'] = float(self.cpu[2] - previous.cpu[2])/total
+        cores = [float(busy - old_busy)/(total - old_total)
+                for ((busy, total), (old_busy, old_total)) in
+                    zip(self.cores, previous.cores) if total > old_total]
+        if len(cores) > 0:
+            utilisation['cpu_max_core'] = max(cores)
+        rx = tx = 0
+        net_util = None
+        for (name, (received, sent)) in self.net.items():
+            if name not in previous.net:
+                continue
+            (old_received, old_sent) = previous.net[name]
+            rx += received - old_received
+            tx += sent - old_sent
+            speed = link_speeds.get(name)
+            if speed is not None:
+                util = max(received - old_received,
+                            sent - old_sent)/elapsed/speed
+                net_util = max(net_util, util)
+        utilisation['net_rx'] = rx/elapsed
+        utilisation['net_tx'] = tx/elapsed
+        utilisation['net_util'] = net_util
+        read = written = 0
+        busy = []
+        for (name, (sectors_read, sectors_written, ticks)) in \
+                self.disks.items():
+            if name not in previous.disks:
+                continue
+            (old_read, old_written, old_ticks) = previous.disks[name]
+            read += sectors_read - old_read
+            written += sectors_written - old_written
+            busy.append(min(1.0, (ticks - old_ticks)/1000.0/elapsed))
+        utilisation['disk_read'] = read * SECTOR_SIZE/elapsed
+        utilisation['disk_write'] = written * SECTOR_SIZE/elapsed
+        if len(busy) > 0:
+            utilisation['disk_busy'] = max(busy)
+        return utilisation
+
+
+class Sampler(object):
+    """Samples the utilisation of the CPU, disks and network of the host in
+    a background thread while a command runs.
+
+    The counters are read when the sampler is started and stopped, and every
+    I{interval} seconds in between. The summary covers the whole time from
+    start to stop, and the series has the utilisation over each interval.
+
+    """
+    def __init__(self, interval=1.0, loopback=False):
+        """Initializes a sampler that has not been started.
+
+        @param interval: Seconds between samples.
+        @type interval: float
+        @param loopback: Whether to sample the loopback interface instead
+                         of the others, for transfers to the local host.
+        @type loopback: bool
+
+        """
+        self.interval = interval
+        self.loopback = loopback
+        self.link_speeds = {}
+        self.first = None
+        self.last = None
+        self.series = []
+        self.thread = None
+        self.stopped = threading.Event()
+    def start(self):
+        """Reads the counters and starts sampling. """
+        self.first = self.last = Snapshot(self.loopback)
+        self.link_speeds = dict((name, get_link_speed(name))
+                                for name in self.first.net)
+        self.series = []
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    def run(self):
+        """Takes a sample every I{interval} seconds until stopped. """
+        while not self.stopped.wait(self.interval):
+            self.sample()
+    def sample(self):
+        """Adds the utilisation since the last sample to the series. """
+        snapshot = Snapshot(self.loopback)
+        utilisation = snapshot.get_utilisation(self.last, self.link_speeds)
+        utilisation['time'] = snapshot.time - self.first.time
+        self.series.append(utilisation)
+        self.last = snapshot
+    def stop(self):
+        """Stops sampling, and takes the last sample. """
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+    def get_summary(self):
+        """Gets the utilisation from start to stop.
+
+        @return: dict with the keys in L{FIELDS}.
+
+        """
+        return self.last.get_utilisation(self.first, self.link_speeds)
+    def get_series(self):
+        """Gets the utilisation over each interval.
+
+        @return: list of dicts with the keys in L{FIELDS}, and C{time} with
+                 the seconds from the start to the end of the interval.
+
+        """
+        return self.series
+
+
+class Error(Exception):
+    pass
+
+class SamplerError(Error):
+    pass
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+#            scheduler.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import logging
+
+class Scheduler(object):
+    """Runs test sets against several hosts at the same time.
+
+    Test sets are started in the order they were added, but a test set is
+    only started when its host has fewer than I{host_concurrency} test sets
+    running, and no more than I{workers} test sets run in total. With the
+    defaults only one test set runs at a time, which is the same as running
+    each test set in turn.
+
+    """
+    def __init__(self, workers=1, host_concurrency=1):
+        """Initializes an empty scheduler.
+
+        @param workers: Maximum number of test sets running at the same time.
+        @type workers: int
+        @param host_concurrency: Maximum number of test sets running against
+                                 the same host at the same time.
+        @type host_concurrency: int
+
+        """
+        if workers < 1 or host_concurrency < 1:
+            raise SchedulerError('workers and host_concurrency must both be '
+                                'at least 1')
+        self.workers = workers
+        self.host_concurrency = host_concurrency
+        self.test_sets = []
+        self.pending = []
+        self.running = {}
+        self.condition = threading.Condition()
+        self.callback = None
+    def add_test_set(self, test_set):
+        """Adds a test set to be run by the scheduler.
+
+        @param test_set: The test set to be run.
+        @type test_set: L{TestSet<testers.base.TestSet>}
+
+        """
+        self.test_sets.append(test_set)
+    def get_test_sets(self):
+        """Gets the test sets in the order they were added.
+
+        This order does not depend on the order the test sets finished in, so
+        results collected from it are always in the same order.
+
+        @return: list of L{TestSet<testers.base.TestSet>}
+
+        """
+        return self.test_sets
+    def run(self, callback=None):
+        """Runs all test sets and returns when every one has finished.
+
+        @param callback: Called as C{callback(key, test_case)} when a test
+                         case has finished, where key is a tuple of the
+                         position of the test set and the position of the
+                         test case in it. It may be called from several
+                         threads.
+        @type callback: function
+
+        """
+        self.callback = callback
+        self.pending = list(self.test_sets)
+        self.running = {}
+        num_workers = min(self.workers, len(self.pending))
+        if num_workers <= 1:
+            self._work()
+            return
+        threads = []
+        for i in range(num_workers):
+            t = threading.Thread(target=self._work,
+                                name="spodtest-worker-%d" % i)
+            t.daemon = True
+            threads.append(t)
+            t.start()
+        for t in threads:
+            # Joining with a timeout keeps the main thread responsive to
+            # KeyboardInterrupt.
+            while t.is_alive():
+                t.join(1)
+    def _next_test_set(self):
+        """Takes the first pending test set whose host has a free slot.
+
+        Blocks until such a test set is available.
+
+        @return: L{TestSet<testers.base.TestSet>}, or None if there are no
+                 pending test sets left.
+
+        """
+        with self.condition:
+            while True:
+                if len(self.pending) == 0:
+                    return None
+                for i, test_set in enumerate(self.pending):
+                    host = test_set.get_host()
+                    if self.running.get(host, 0) < self.host_concurrency:
+                        del self.pending[i]
+                        self.running[host] = self.running.get(host, 0) + 1
+                        return test_set
+                self.condition.wait()
+    def _make_callback(self, test_set):
+        """Creates the callback passed to I{test_set}. """
+        if self.callback is None:
+            return None
+        index = self.test_sets.index(test_set)
+        def callback(test_case):
+            key = (index, test_set.get_test_cases().index(test_case))
+            self.callback(key, test_case)
+        return callback
+    def _work(self):
+        """Runs pending test sets until there are none left. """
+        while True:
+            test_set = self._next_test_set()
+            if test_set is None:
+                return
+            logging.info("Starting test set against %s" %
+                        test_set.get_host())
+            try:
+                test_set.run(self._make_callback(test_set))
+            except Exception, e:
+                logging.exception("Test set against %s failed: %s" % (
+                                    test_set.get_host(), e))
+            finally:
+                with self.condition:
+                    self.running[test_set.get_host()] -= 1
+                    self.condition.notify_all()
+
+
+class Error(Exception):
+    pass
+
+class SchedulerError(Error):
+    pass
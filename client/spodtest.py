@@ -21,18 +21,40 @@ import logging
 import datetime
 import ConfigParser
 
-from lxml import etree
-
-from testers.rsync import RSyncCommand
+from testers.rsync import RSyncCommand, RSyncDaemonCommand
 from testers.scp import SCPCommand
 from testers.sftp import SFTPCommand
+from testers.tar import TarCommand
+from testers.local import CopyCommand, TarPipeCommand, LocalRSyncCommand
+from testers.tcp import TCPProbeCommand
 import xmlpacker
+import resultsink
+import resultdb
+import report
+import datagen
+import overhead
+from scheduler import Scheduler
 
 
 command_types = {
     'scp': SCPCommand,
     'sftp': SFTPCommand,
     'rsync': RSyncCommand,
+    'tar': TarCommand,
+    'rsync-daemon': RSyncDaemonCommand,
+    'cp': CopyCommand,
+    'tar-local': TarPipeCommand,
+    'rsync-local': LocalRSyncCommand,
+    'tcp': TCPProbeCommand,
+}
+# Subcommands given as the first command line argument. Without a subcommand
+# the tests in the configuration file are run.
+subcommands = {
+    'generate': datagen.main,
+    'overhead': overhead.main,
+    'import': resultdb.import_main,
+    'query': resultdb.query_main,
+    'report': report.main,
 }
 def log_setup(log_level, log_file):
     """Sets up basic configuration for logging. """
@@ -53,6 +75,9 @@ def log_setup(log_level, log_file):
         filename=log_file)
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in subcommands:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        sys.exit(subcommands[sys.argv[1]](sys.argv[2:]))
     SCRIPT_PATH = os.path.abspath(os.path.dirname(sys.argv[0]))
     conf = ConfigParser.SafeConfigParser()
     conf.read(os.path.join(SCRIPT_PATH, 'spodconf.cfg'))
@@ -89,8 +114,22 @@ def main():
         logging.warning(("Missing XML document file location. "
             "XML going to stdout."))
 
+    try:
+        workers = conf.getint('spod', 'workers')
+    except ConfigParser.NoOptionError, nope:
+        workers = 1
+    try:
+        host_concurrency = conf.getint('spod', 'host_concurrency')
+    except ConfigParser.NoOptionError, nope:
+        host_concurrency = 1
+    database = None
+    try:
+        database = resultdb.ResultDB(conf.get('spod', 'database'))
+    except ConfigParser.NoOptionError, nope:
+        pass
+
     testsets = testsets.split(",")
-    ts_list = []
+    scheduler = Scheduler(workers=workers, host_concurrency=host_concurrency)
     build_list = []
     for testset in testsets:
         try:
@@ -101,24 +140,26 @@ def main():
             continue
         testcase = dict(testcase)
         build_list.append(command_types[testcase['type']](conf, testset))
-        ts_list.append(build_list[-1].build_test_set())
-    if xml_file is not None and os.path.exists(xml_file):
-        xmlf = open(xml_file, "r")
-        root = etree.fromstring(xmlf.read())
-        xmlf.close()
-        xmldoc = xmlpacker.XMLDoc(root)
-    else:
-        xmldoc = xmlpacker.XMLDoc()
-    for ts in ts_list:
-        ts.run()
-        for tc in ts.get_test_cases():
-            xmldoc.add_testcase(tc)
+        scheduler.add_test_set(build_list[-1].build_test_set())
+    sinks = []
+    if database is not None:
+        sinks.append(database)
+    if xml_file is not None:
+        sinks.append(resultsink.ResultSink(xml_file))
+    def callback(key, testcase):
+        for sink in sinks:
+            sink.add(key, testcase)
+    try:
+        scheduler.run(callback=callback)
+    finally:
+        for sink in sinks:
+            sink.close()
     if xml_file is None:
+        xmldoc = xmlpacker.XMLDoc()
+        for ts in scheduler.get_test_sets():
+            for tc in ts.get_test_cases():
+                xmldoc.add_testcase(tc)
         sys.stdout.write(xmldoc.get_xml())
-    else:
-        xmlf = open(xml_file, "w")
-        xmlf.write(xmldoc.get_xml())
-        xmlf.close()
 
 
 if __name__=='__main__':
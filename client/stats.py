@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+#
+#            stats.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+
+# Two-sided 95% critical values of Student's t-distribution, indexed by
+# degrees of freedom. Larger degrees of freedom use the normal value.
+T_95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571,
+    6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+    11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131,
+    16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093, 20: 2.086,
+    21: 2.080, 22: 2.074, 23: 2.069, 24: 2.064, 25: 2.060,
+    26: 2.056, 27: 2.052, 28: 2.048, 29: 2.045, 30: 2.042,
+    40: 2.021, 60: 2.000, 120: 1.980,
+}
+Z_95 = 1.960
+
+def mean(values):
+    """Gets the arithmetic mean of I{values}.
+
+    @param values: The values to average.
+    @type values: list of float
+    @return: float, or None if I{values} is empty.
+
+    """
+    if len(values) == 0:
+        return None
+    return float(sum(values))/len(values)
+
+def median(values):
+    """Gets the median of I{values}.
+
+    @return: float, or None if I{values} is empty.
+
+    """
+    return percentile(values, 50)
+
+def stddev(values):
+    """Gets the sample standard deviation of I{values}.
+
+    @return: float, or None if I{values} has fewer than two values.
+
+    """
+    if len(values) < 2:
+        return None
+    m = mean(values)
+    return math.sqrt(sum((v - m)**2 for v in values)/(len(values) - 1))
+
+def percentile(values, p):
+    """Gets the I{p}th percentile of I{values}.
+
+    Interpolates linearly between the two closest ranks.
+
+    @param p: The percentile, between 0 and 100.
+    @type p: int, float
+    @return: float, or None if I{values} is empty.
+
+    """
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100.0
+    low = int(math.floor(rank))
+    high = int(math.ceil(rank))
+    if low == high:
+        return float(ordered[low])
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def t_critical(df):
+    """Gets the two-sided 95% critical value of the t-distribution.
+
+    @param df: Degrees of freedom.
+    @type df: int
+    @return: float
+
+    """
+    if df in T_95:
+        return T_95[df]
+    for limit in sorted(T_95.keys()):
+        if df < limit:
+            return T_95[limit]
+    return Z_95
+
+def confidence_interval(values):
+    """Gets the 95% confidence interval of the mean of I{values}.
+
+    @return: tuple of (low, high), or None if I{values} has fewer than two
+             values.
+
+    """
+    if len(values) < 2:
+        return None
+    m = mean(values)
+    margin = t_critical(len(values) - 1) * stddev(values)/math.sqrt(
+                                                            len(values))
+    return (m - margin, m + margin)
+
+def summarize(values):
+    """Gets a summary of I{values}.
+
+    @return: dict with the keys min, max, median, mean, stddev, p95,
+             ci_low and ci_high. Values that cannot be calculated from the
+             number of values given are None.
+
+    """
+    ci = confidence_interval(values)
+    if ci is None:
+        ci = (None, None)
+    return {
+        'min': min(values) if values else None,
+        'max': max(values) if values else None,
+        'median': median(values),
+        'mean': mean(values),
+        'stddev': stddev(values),
+        'p95': percentile(values, 95),
+        'ci_low': ci[0],
+        'ci_high': ci[1],
+    }
+
+class RunningStats(object):
+    """Mean and variance of values seen one at a time.
+
+    Uses Welford's method, so the values themselves are not kept.
+
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+    def add(self, value):
+        """Adds a value. """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta/self.count
+        self.m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+    def get_mean(self):
+        """@return: float, or None if no values have been added. """
+        if self.count == 0:
+            return None
+        return self.mean
+    def get_variance(self):
+        """@return: float sample variance, or None if fewer than two values
+        have been added.
+
+        """
+        if self.count < 2:
+            return None
+        return self.m2/(self.count - 1)
+    def get_stddev(self):
+        """@return: float sample standard deviation, or None if fewer than
+        two values have been added.
+
+        """
+        variance = self.get_variance()
+        if variance is None:
+            return None
+        return math.sqrt(variance)
+
+def welch_test(a, b):
+    """Tests whether the means of two samples differ, with Welch's t-test.
+
+    Welch's test does not assume that the samples have the same variance.
+
+    @param a: The first sample.
+    @type a: L{RunningStats}
+    @param b: The second sample.
+    @type b: L{RunningStats}
+    @return: tuple of (t, degrees of freedom, bool indicating whether the
+             difference is significant at the 95% level), or None if either
+             sample has fewer than two values.
+
+    """
+    if a.count < 2 or b.count < 2:
+        return None
+    va = a.get_variance()/a.count
+    vb = b.get_variance()/b.count
+    if va + vb == 0:
+        # Both samples are constant, so any difference is exact.
+        return (None, None, a.mean != b.mean)
+    t = (b.mean - a.mean)/math.sqrt(va + vb)
+    df = (va + vb)**2/(va**2/(a.count - 1) + vb**2/(b.count - 1))
+    return (t, df, abs(t) > t_critical(max(1, int(df))))
+
+def least_squares(rows, values):
+    """Fits values = rows * coefficients with ordinary least squares.
+
+    The normal equations are solved by Gaussian elimination. Each column is
+    scaled by its largest value first, so columns of very different
+    magnitude, such as file counts and bytes, do not lose precision.
+
+    @param rows: The value of each variable for each observation.
+    @type rows: list of lists of float
+    @param values: The observed value for each row.
+    @type values: list of float
+    @return: tuple of (list of coefficients, coefficient of determination or
+             None if the values are constant), or None if there are fewer
+             observations than variables or the variables are not
+             independent.
+
+    """
+    if len(rows) == 0 or len(rows) < len(rows[0]):
+        return None
+    n = len(rows[0])
+    scales = [max(abs(row[j]) for row in rows) or 1.0 for j in range(n)]
+    scaled = [[row[j]/scales[j] for j in range(n)] for row in rows]
+    # Augmented matrix of the normal equations.
+    matrix = [[sum(row[i] * row[j] for row in scaled) for j in range(n)] +
+                [sum(row[i] * y for (row, y) in zip(scaled, values))]
+                for i in range(n)]
+    for i in range(n):
+        pivot = max(range(i, n), key=lambda k: abs(matrix[k][i]))
+        if abs(matrix[pivot][i]) < 1e-12 * len(rows):
+            return None
+        (matrix[i], matrix[pivot]) = (matrix[pivot], matrix[i])
+        for k in range(i + 1, n):
+            factor = matrix[k][i]/matrix[i][i]
+            for j in range(i, n + 1):
+                matrix[k][j] -= factor * matrix[i][j]
+    solution = [0.0] * n
+    for i in reversed(range(n)):
+        solution[i] = (matrix[i][n] - sum(matrix[i][j] * solution[j]
+                        for j in range(i + 1, n)))/matrix[i][i]
+    coefficients = [solution[j]/scales[j] for j in range(n)]
+    mean_value = mean(values)
+    total = sum((y - mean_value)**2 for y in values)
+    residual = sum((y - sum(c * x for (c, x) in zip(coefficients, row)))**2
+                    for (row, y) in zip(rows, values))
+    r_squared = None
+    if total > 0:
+        r_squared = 1.0 - residual/total
+    return (coefficients, r_squared)
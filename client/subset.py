@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#
+#            subset.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import errno
+import shutil
+import logging
+import tempfile
+
+# Size of the chunks a single file is copied in.
+COPY_SIZE = 1024 * 1024
+
+def select_files(filelist, fraction):
+    """Selects an evenly spread I{fraction} of the files in I{filelist}.
+
+    Every file is taken in turn, so the selection has about the same size
+    distribution and directory layout as the whole list.
+
+    @param filelist: Paths of the files, in a fixed order.
+    @type filelist: list of strings
+    @param fraction: Fraction of the files to select, between 0 and 1.
+    @type fraction: float
+    @return: list of strings, with at least one file if I{filelist} is not
+             empty.
+
+    """
+    selected = [path for (i, path) in enumerate(filelist)
+                if int((i + 1) * fraction) > int(i * fraction)]
+    if len(selected) == 0 and len(filelist) > 0:
+        selected = [filelist[0]]
+    return selected
+
+def link_file(source, destination):
+    """Hard links I{source} to I{destination}, copying it if it cannot be
+    linked, such as across file systems.
+
+    """
+    directory = os.path.dirname(destination)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    try:
+        os.link(source, destination)
+    except OSError, e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(source, destination)
+
+def copy_head(source, destination, size):
+    """Copies the first I{size} bytes of I{source} to I{destination}. """
+    src = open(source, 'rb')
+    dst = open(destination, 'wb')
+    try:
+        while size > 0:
+            data = src.read(min(size, COPY_SIZE))
+            if len(data) == 0:
+                break
+            dst.write(data)
+            size -= len(data)
+    finally:
+        src.close()
+        dst.close()
+
+def make_temp_dir(near):
+    """Creates a temporary directory for a subset of I{near}.
+
+    The directory is created next to I{near} if possible, so the files of
+    the subset can be hard linked rather than copied.
+
+    @return: string
+
+    """
+    try:
+        return tempfile.mkdtemp(prefix='.spodtest-subset-',
+                                dir=os.path.dirname(near))
+    except OSError, e:
+        logging.debug("Unable to create subset next to %s, files will be "
+                    "copied: %s" % (near, e))
+        return tempfile.mkdtemp(prefix='spodtest-subset-')
+
+def create(path, filelist, size, fraction):
+    """Creates a subset with about I{fraction} of the data in I{path}.
+
+    The subset of a directory holds an evenly spread selection of its files,
+    hard linked in the same layout. The subset of a single file is a copy
+    of its first bytes. The subset has the same name as I{path}, so it
+    ends up at the same place on the remote host.
+
+    @param path: The file or directory to take a subset of.
+    @type path: string
+    @param filelist: Paths of the files in I{path}.
+    @type filelist: list of strings
+    @param size: Total size of I{path} in bytes.
+    @type size: int
+    @param fraction: Fraction of the data to include, between 0 and 1.
+    @type fraction: float
+    @return: tuple of (temporary directory to remove when the subset is no
+             longer needed, path of the subset, list of the files in the
+             subset, size of the subset in bytes).
+
+    """
+    path = os.path.abspath(path)
+    temp_dir = make_temp_dir(path)
+    destination = os.path.join(temp_dir, os.path.basename(path))
+    try:
+        if not os.path.isdir(path):
+            subset_size = max(1, int(size * fraction))
+            copy_head(path, destination, subset_size)
+            return (temp_dir, destination, [destination], subset_size)
+        os.mkdir(destination)
+        files = []
+        subset_size = 0
+        for source in select_files(filelist, fraction):
+            target = os.path.join(destination, os.path.relpath(source, path))
+            link_file(source, target)
+            files.append(target)
+            subset_size += os.path.getsize(target)
+        return (temp_dir, destination, files, subset_size)
+    except:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+def pack(sizes, number):
+    """Splits files into I{number} bins with about the same total size.
+
+    The largest files are placed first, each in the bin with the least
+    data so far, which keeps the largest bin within 4/3 of the best split.
+
+    @param sizes: Size of each file in bytes.
+    @type sizes: list of int
+    @param number: Number of bins.
+    @type number: int
+    @return: list of lists with the indexes of the files in each bin,
+             leaving out empty bins.
+
+    """
+    bins = [[0, i, []] for i in range(number)]
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True)
+    for i in order:
+        smallest = min(bins)
+        smallest[0] += sizes[i]
+        smallest[2].append(i)
+    return [sorted(indexes) for (size, n, indexes) in bins
+            if len(indexes) > 0]
+
+def create_shards(path, filelist, sizes, number):
+    """Splits the files of the directory I{path} into up to I{number}
+    shards with about the same total size, made with L{pack}.
+
+    Each shard is a directory with the same name as I{path}, holding its
+    files hard linked in the same layout, so transferring every shard into
+    the same folder gives the same result as transferring I{path}.
+
+    @param path: The directory to split.
+    @type path: string
+    @param filelist: Paths of the files in I{path}.
+    @type filelist: list of strings
+    @param sizes: Size of each file in I{filelist}.
+    @type sizes: list of int
+    @param number: Largest number of shards.
+    @type number: int
+    @return: tuple of (temporary directory to remove when the shards are no
+             longer needed, list of tuples of (path of the shard, list of
+             the files in the shard, size of the shard in bytes)).
+
+    """
+    path = os.path.abspath(path)
+    temp_dir = make_temp_dir(path)
+    shards = []
+    try:
+        for (n, indexes) in enumerate(pack(sizes, number)):
+            destination = os.path.join(temp_dir, str(n),
+                                        os.path.basename(path))
+            os.makedirs(destination)
+            files = []
+            for i in indexes:
+                target = os.path.join(destination,
+                                        os.path.relpath(filelist[i], path))
+                link_file(filelist[i], target)
+                files.append(target)
+            shards.append((destination, files,
+                            sum(sizes[i] for i in indexes)))
+        return (temp_dir, shards)
+    except:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
@@ -16,16 +16,58 @@
 # along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
 
 import timer
-import subprocess
+import stats
+import progress
+import engine
+import manifest
+import multiplex
+import subset
+import cache
+import remotedir
+import phases
+import localsshd
+import overhead
+import sampler
+import collector
+import verify
+import linkemu
+import probe
 import os
+import math
+import posixpath
+import shutil
+import tempfile
 import logging
 import shlex
 
+# Options in a test section starting with MATRIX_PREFIX list the values to
+# test for a dimension. ARG_DIMENSIONS maps the dimensions that argument
+# sections also set to their keys in the argument dictionaries, and
+# SSH_DIMENSIONS maps names of ssh option dimensions to the ssh option.
+MATRIX_PREFIX = 'matrix.'
+SSH_PREFIX = 'ssh_'
+ARG_DIMENSIONS = {
+    'encryption': 'enc',
+    'compression': 'comp',
+    'compression_level': 'compl',
+}
+SSH_DIMENSIONS = {
+    'macs': 'MACs',
+    'kex': 'KexAlgorithms',
+}
+# Dimension, and test section option, with the number of parallel streams.
+STREAMS_DIMENSION = 'streams'
+# Dimension, and test section option, with the emulated link to the local
+# sshd. NO_LINK connects to it directly.
+LINK_DIMENSION = 'link_profile'
+NO_LINK = 'none'
+
 class TestCase(object):
     """Abstract class that implements an interface for different test types.
 
     """
-    def __init__(self, command, f, legal_return_values=None):
+    def __init__(self, command, f, legal_return_values=None, repetitions=1,
+                    warmup=0):
         """Initializes a the test case with certain command.
 
         @param command: Command to be run.
@@ -36,6 +78,11 @@ class TestCase(object):
                                     any values other than these will result in
                                     a L{IllegalReturnValueError} being raised.
         @type legal_return_values: list, tuple
+        @param repetitions: The number of timed runs of the command.
+        @type repetitions: int
+        @param warmup: The number of untimed runs of the command before the
+                       timed runs.
+        @type warmup: int
         
         """
         self.timer = timer.Timer()
@@ -45,23 +92,293 @@ class TestCase(object):
             self.legal_return_values = (0,)
         else:
             self.legal_return_values = legal_return_values
+        self.repetitions = repetitions
+        self.warmup = warmup
+        self.progress_series = []
+        self.phase_times = []
+        # Set by L{AdaptiveTestSet} for test cases run on part of a data set.
+        self.round = None
+        self.sample_fraction = None
+        self.pruned = None
+        # Remote directory of each run, warmup runs first. Set by
+        # L{CommandBuilder.prepare_remote} when runs are isolated.
+        self.remote_dirs = None
+        # The file of each stream, and the time of each stream in every
+        # timed run when there are several.
+        self.shards = [f]
+        self.stream_times = []
+        # Utilisation of the host in each timed run, when it is sampled.
+        self.utilisation = []
+        self.utilisation_series = []
+        # Start and end of each timed run by timer.monotonic, and the
+        # utilisation of the remote host in them when it is sampled.
+        self.run_spans = []
+        self.remote_utilisation = []
+        # Whether the files arrived whole in each timed run, when verified.
+        self.verified = []
+        # Time of the raw TCP probe after each timed run, when the
+        # efficiency is measured. None for probes that failed.
+        self.raw_times = []
 
     def run(self):
         """Runs the test case.
 
+        Runs the command I{self.warmup} times without timing it, and then
+        I{self.repetitions} times with the timer running. The time of each
+        timed run is kept as a sample in the timer.
+
+        If the builder preseeds the target, each timed run is preceded by
+        an untimed run into the same remote directory. With more than one
+        stream, every run transfers the shards of the file at the same time,
+        and is timed from the start of the first to the end of the last.
+        When the efficiency is measured, each timed run is followed by a
+        raw TCP probe of the same shards.
+
         Can raise an L{IllegalReturnValueError} if the command run does not 
         return a value in I{self.legal_return_values}. This serves as a 
-        warning in case the program executed fails for some reason.
+        warning in case the program executed fails for some reason. The
+        time of the failed run is discarded, and the runs before it are
+        kept.
+
+        """
+        builder = self.command.get_builder()
+        self.shards = self.get_shards()
+        for i in range(self.warmup):
+            files = self.get_run_files(i)
+            if len(files) > 1:
+                builder.prepare_streams(self.f, self.get_target_folder(i))
+            logging.debug("Starting warmup run %d: %s" % (i + 1,
+                                                self.get_run_command(files)))
+            self.check_jobs(files, self.execute_streams(files))
+        for i in range(self.repetitions):
+            files = self.get_run_files(self.warmup + i)
+            cmd = self.get_run_command(files)
+            if len(files) > 1:
+                builder.prepare_streams(self.f,
+                                    self.get_target_folder(self.warmup + i))
+            if builder.preseed:
+                logging.debug("Preseeding target: %s" % cmd)
+                self.check_jobs(files, self.execute_streams(files))
+            builder.prepare_cache(self.f)
+            logging.debug("Starting command: %s" % cmd)
+            series = progress.ProgressSeries()
+            phase_log = None
+            if builder.phases and len(files) == 1:
+                phase_log = phases.PhaseLog()
+            output = None
+            if builder.self_timed:
+                output = [[] for f in files]
+            usage_sampler = builder.get_sampler()
+            if usage_sampler is not None:
+                usage_sampler.start()
+            try:
+                run_start = timer.monotonic()
+                self.timer.start()
+                jobs = self.execute_streams(files, series, phase_log, output)
+                self.timer.stop()
+                run_end = timer.monotonic()
+            finally:
+                # The sampler thread must not outlive a run that raised.
+                if usage_sampler is not None:
+                    usage_sampler.stop()
+            run_times = None
+            try:
+                self.check_jobs(files, jobs)
+                if output is not None:
+                    run_times = self.get_run_times(files, output)
+            except IllegalReturnValueError:
+                # A failed run is not a sample, and did not transfer the
+                # files whole.
+                self.timer.discard()
+                if builder.verify:
+                    self.verified.append(False)
+                raise
+            if run_times is not None:
+                self.timer.replace(max(run_times))
+            self.run_spans.append((run_start, run_end))
+            if usage_sampler is not None:
+                self.utilisation.append(usage_sampler.get_summary())
+                self.utilisation_series.append(usage_sampler.get_series())
+            rusage = reduce(engine.add_rusage, [job.rusage for job in jobs])
+            self.timer.add_cpu_time(rusage.ru_utime, rusage.ru_stime)
+            series.finish()
+            self.progress_series.append(series)
+            if phase_log is not None:
+                self.phase_times.append(phase_log.get_phases(
+                        jobs[0].get_duration(), series.get_first_byte_time()))
+            if len(files) > 1:
+                self.stream_times.append(run_times or
+                                        [job.get_duration() for job in jobs])
+            if builder.verify:
+                self.verified.append(builder.verify_run(self.f,
+                            self.get_target_folder(self.warmup + i)))
+            if builder.efficiency:
+                self.raw_times.append(builder.run_probe(self.command.args,
+                                                        self.shards))
+        self.remote_utilisation = builder.get_remote_utilisation(
+                                                            self.run_spans)
+    def get_shards(self):
+        """Gets the files each stream of the command transfers.
+
+        @return: list of L{FileObject}, with only I{self.f} for a single
+                 stream.
+
+        """
+        streams = self.command.args.get_streams()
+        if streams == 1:
+            return [self.f]
+        return self.command.get_builder().get_shards(self.f, streams)
+    def get_run_files(self, run):
+        """Gets the files to format the command with for run number I{run},
+        one for each stream.
+
+        @return: list of L{FileObject}, or of dicts with the target folder
+                 set to the remote directory of the run if runs are
+                 isolated. The streams of a run share its directory.
+
+        """
+        if self.remote_dirs is None:
+            return self.shards
+        return [dict(shard.get_dict(), target_folder=self.remote_dirs[run])
+                for shard in self.shards]
+    def get_target_folder(self, run):
+        """Gets the folder run number I{run} transferred to. """
+        if self.remote_dirs is None:
+            return self.command.get_builder().target_folder
+        return self.remote_dirs[run]
+    def get_run_command(self, files):
+        """Gets the commands of a run on I{files} as a string, for logging.
+
+        """
+        return " & ".join([self.command.get_command(f) for f in files])
+    def execute_streams(self, files, series=None, phase_log=None,
+                        output=None):
+        """Executes the command on each of I{files} at the same time, and
+        waits for all of them to finish.
+
+        A single file is run with L{execute}. The jobs of several streams
+        are run by one L{Engine<engine.Engine>}, without progress or phase
+        timing.
+
+        @param files: The files to format the command with.
+        @type files: list of L{FileObject} or dicts
+        @param output: A list for each of I{files} that the lines its
+                       command writes to standard output are added to.
+        @type output: list of lists
+        @return: list of the finished L{Job<engine.Job>}, in the order of
+                 I{files}.
+
+        """
+        if output is None:
+            output = [None for f in files]
+        if len(files) == 1:
+            return [self.execute(self.command.get_command_list(files[0]),
+                                series, phase_log, output[0])]
+        builder = self.command.get_builder()
+        runner = engine.Engine()
+        jobs = []
+        try:
+            for (f, lines) in zip(files, output):
+                callback = None
+                if lines is not None:
+                    callback = lines.append
+                jobs.append(runner.start(engine.Job(
+                                    self.command.get_command_list(f),
+                                    line_callback=callback,
+                                    timeout=builder.timeout)))
+        except:
+            runner.cancel()
+            runner.wait(jobs)
+            raise
+        return runner.wait(jobs)
+    def execute(self, argv, series=None, phase_log=None, output=None):
+        """Executes I{argv} and waits for it to finish.
+
+        The command is run directly by an L{Engine<engine.Engine>}, without a
+        shell, and its output is read as it is written. If the builder of the
+        command has a progress parser, each progress line is added to
+        I{series}. Commands that only show progress on a terminal are given a
+        pseudo terminal as their standard output. If I{phase_log} is given,
+        the debug output of ssh on standard error is added to it.
+
+        @param argv: The command to execute.
+        @type argv: list of strings
+        @param series: Series to add progress to.
+        @type series: L{ProgressSeries<progress.ProgressSeries>}
+        @param phase_log: Log to time the phases of the connection with.
+        @type phase_log: L{PhaseLog<phases.PhaseLog>}
+        @param output: List that the lines the command writes to standard
+                       output are added to.
+        @type output: list
+        @return: the finished L{Job<engine.Job>}, with the return value and
+                 resource usage of the command's process tree.
 
         """
-        cmd = self.command.get_command(self.f)
-        logging.debug("Starting command: %s" % cmd)
-        self.timer.start()
-        p = subprocess.call(cmd, shell=True, stdout=subprocess.PIPE)
-        self.timer.stop()
-        if p not in self.legal_return_values:
+        builder = self.command.get_builder()
+        parser = builder.get_progress_parser()
+        callback = None
+        if output is not None:
+            callback = output.append
+        if parser is not None and series is not None:
+            def callback(line):
+                if output is not None:
+                    output.append(line)
+                nbytes = parser.parse(line)
+                if nbytes is not None:
+                    series.add(timer.monotonic() - job.start_time, nbytes)
+        stderr_callback = None
+        if phase_log is not None:
+            def stderr_callback(line):
+                phase_log.add(timer.monotonic() - job.start_time, line)
+                if not line.startswith('debug'):
+                    logging.info(line)
+        job = engine.Job(argv, line_callback=callback,
+                        stderr_callback=stderr_callback,
+                        use_pty=parser is not None and builder.progress_tty,
+                        timeout=builder.timeout)
+        return engine.Engine().run(job)
+    def get_run_times(self, files, output):
+        """Gets the time each stream of a self timed command gave for its
+        transfer.
+
+        Raises an L{IllegalReturnValueError} if a command did not give its
+        time.
+
+        @param output: The lines each stream wrote to standard output.
+        @type output: list of lists of strings
+        @return: list of float seconds, in the order of I{files}.
+
+        """
+        builder = self.command.get_builder()
+        run_times = []
+        for (f, lines) in zip(files, output):
+            seconds = builder.get_run_time(lines)
+            if seconds is None:
+                raise IllegalReturnValueError(('command %s did not give the '
+                                'time of its transfer') %
+                                self.command.get_command(f))
+            run_times.append(seconds)
+        return run_times
+    def check_job(self, cmd, job):
+        """Raises an L{IllegalReturnValueError} if I{job} was cancelled or
+        returned an illegal value.
+
+        """
+        if job.is_cancelled():
+            raise IllegalReturnValueError(('command %s was cancelled after '
+                                '%.1f seconds') % (cmd, job.get_duration()))
+        self.check_return_value(cmd, job.returncode)
+    def check_jobs(self, files, jobs):
+        """Checks the job of each stream with L{check_job}. """
+        for (f, job) in zip(files, jobs):
+            self.check_job(self.command.get_command(f), job)
+    def check_return_value(self, cmd, value):
+        """Raises an L{IllegalReturnValueError} if I{value} is not legal.
+
+        """
+        if value not in self.legal_return_values:
             raise IllegalReturnValueError(('command %s returned an illegal '
-                                'value: %d') % (cmd, p))
+                                'value: %d') % (cmd, value))
     
     def get_timer(self):
         """Gets the timer for the test case.
@@ -70,13 +387,191 @@ class TestCase(object):
 
         """
         return self.timer
+    def get_samples(self):
+        """Gets the time of each timed run of the command.
+
+        @return: list of float
+
+        """
+        return self.timer.get_intervals()
+    def get_progress_series(self):
+        """Gets the progress of each timed run.
+
+        The series are empty unless the builder of the command has a progress
+        parser.
+
+        @return: list of L{ProgressSeries<progress.ProgressSeries>}
+
+        """
+        return self.progress_series
+    def get_phase_times(self):
+        """Gets the time of each phase of the connection, as the median over
+        the timed runs.
+
+        @return: list of tuples of (phase, float seconds), in the order of
+                 L{PHASES<phases.PHASES>}. Empty unless the builder times
+                 phases.
+
+        """
+        times = {}
+        for run in self.phase_times:
+            for (phase, seconds) in run:
+                times.setdefault(phase, []).append(seconds)
+        return [(phase, stats.median(times[phase]))
+                for (phase, start, end) in phases.PHASES if phase in times]
+    def get_streams(self):
+        """Gets the transfer time and throughput of each stream, as the
+        median over the timed runs.
+
+        The throughput of the test case as a whole is over the span of all
+        the streams.
+
+        @return: list of tuples of (L{FileObject} of the stream, float
+                 seconds, float bytes per second). Empty with a single
+                 stream.
+
+        """
+        if len(self.stream_times) == 0:
+            return []
+        streams = []
+        for (n, shard) in enumerate(self.shards):
+            seconds = stats.median([run[n] for run in self.stream_times])
+            streams.append((shard, seconds,
+                            float(shard.get_size())/seconds))
+        return streams
+    def get_utilisation(self):
+        """Gets the utilisation of the host while the command ran, as the
+        median over the timed runs.
+
+        @return: dict with the keys in L{FIELDS<sampler.FIELDS>}, or None
+                 if the utilisation was not sampled.
+
+        """
+        if len(self.utilisation) == 0:
+            return None
+        return sampler.summarize(self.utilisation)
+    def get_bottleneck(self):
+        """Gets the resource of the host that limited the transfer, with
+        L{classify<sampler.classify>}.
+
+        @return: string in L{BOTTLENECKS<sampler.BOTTLENECKS>}, or None if
+                 the utilisation was not sampled.
+
+        """
+        utilisation = self.get_utilisation()
+        if utilisation is None:
+            return None
+        return sampler.classify(utilisation)
+    def is_valid(self):
+        """Checks whether every verified run transferred the files whole.
+
+        @return: bool, or None if the runs were not verified.
+
+        """
+        if len(self.verified) == 0:
+            return None
+        return all(self.verified)
+    def get_efficiency(self):
+        """Gets the throughput of the command as a share of the raw TCP
+        throughput, as the median over the timed runs.
+
+        Each run is compared to the probe that followed it, so both saw
+        about the same link.
+
+        @return: float, or None if the efficiency was not measured.
+
+        """
+        ratios = [raw/seconds for (seconds, raw) in
+                    zip(self.get_samples(), self.raw_times)
+                    if raw is not None and seconds > 0]
+        if len(ratios) == 0:
+            return None
+        return stats.median(ratios)
+    def get_raw_throughput(self):
+        """Gets the raw TCP throughput in bytes per second, as the median
+        over the probes.
+
+        @return: float, or None if the efficiency was not measured.
+
+        """
+        raw_times = [raw for raw in self.raw_times if raw is not None]
+        if len(raw_times) == 0:
+            return None
+        return float(self.f.get_size())/stats.median(raw_times)
+    def get_remote_utilisation(self):
+        """Gets the utilisation of the remote host while the command ran,
+        as the median over the timed runs.
+
+        @return: dict with the keys in L{FIELDS<collector.FIELDS>}, or None
+                 if the remote host was not sampled.
+
+        """
+        if len(self.remote_utilisation) == 0:
+            return None
+        return sampler.summarize(self.remote_utilisation, collector.FIELDS)
+    def get_remote_bottleneck(self):
+        """Gets the resource of the remote host that limited the transfer,
+        with L{classify<sampler.classify>}.
+
+        @return: string in L{BOTTLENECKS<sampler.BOTTLENECKS>}, or None if
+                 the remote host was not sampled.
+
+        """
+        utilisation = self.get_remote_utilisation()
+        if utilisation is None:
+            return None
+        return sampler.classify(utilisation)
+    def get_utilisation_series(self):
+        """Gets the utilisation over each sample interval of each timed
+        run.
+
+        @return: list of lists of dicts from
+                 L{Sampler.get_series<sampler.Sampler.get_series>}
+
+        """
+        return self.utilisation_series
+    def get_cpu_time(self):
+        """Gets the CPU time used by the command's process tree.
+
+        Like L{get_transfer_time}, this is the median over the timed runs.
+
+        @return: tuple of (user, system) CPU time in seconds, or None if no
+                 runs have been timed.
+
+        """
+        cpu_times = self.timer.get_cpu_times()
+        if len(cpu_times) == 0:
+            return None
+        return (stats.median([user for (user, system) in cpu_times]),
+                stats.median([system for (user, system) in cpu_times]))
+    def get_transfer_time(self):
+        """Gets the time used to transfer the file.
+
+        This is the median of the timed runs, so that a single noisy run does
+        not decide the result when the command is repeated.
+
+        @return: float
+
+        """
+        samples = self.get_samples()
+        if len(samples) == 0:
+            return self.timer.get_processing_time()
+        return stats.median(samples)
     def get_speed(self):
         """Gets the speed of the test case in bytes per second.
 
         @return: float represetning the bytes passed per second.
 
         """
-        return float(self.f.get_size())/self.timer.get_processing_time()
+        return float(self.f.get_size())/self.get_transfer_time()
+    def get_sample_speeds(self):
+        """Gets the speed of each timed run in bytes per second.
+
+        @return: list of float
+
+        """
+        return [float(self.f.get_size())/sample
+                    for sample in self.get_samples()]
     def get_speed_string(self):
         """Gets a string representation of the speed for the test case.
 
@@ -112,10 +607,28 @@ class TestSet(object):
     """Defines a set of tests.
 
     """
-    def __init__(self):
+    def __init__(self, host=None, builder=None):
         """Initializes an empty test set.
+
+        @param host: The host the test cases in this set runs against.
+        @type host: string
+        @param builder: The builder that created this test set. Its
+                        L{setup<CommandBuilder.setup>} and
+                        L{teardown<CommandBuilder.teardown>} are run before
+                        and after the test cases.
+        @type builder: L{CommandBuilder}
+
         """
         self.test_cases = []
+        self.host = host
+        self.builder = builder
+    def get_host(self):
+        """Gets the host this test set runs against.
+
+        @return: string
+
+        """
+        return self.host
     def add_test_case(self, test_case):
         """Adds a test case to the test set.
 
@@ -136,18 +649,172 @@ class TestSet(object):
 
         """
         return self.test_cases
-    def run(self):
+    def run(self, callback=None):
         """Runs the test cases in this test set.
 
         Loops through each test case and runs it's L{run<TestCase.run>} 
         function.
 
+        @param callback: Called with each test case when it has finished,
+                         whether it succeeded or not.
+        @type callback: function
+
         """
-        for test_case in self.test_cases:
-            try:
-                test_case.run()
-            except IllegalReturnValueError, irve:
-                logging.error(irve)
+        if self.builder is not None:
+            self.builder.setup()
+        try:
+            if self.builder is not None:
+                self.builder.prepare_remote(self.test_cases)
+            for test_case in self.test_cases:
+                try:
+                    test_case.run()
+                except IllegalReturnValueError, irve:
+                    logging.error(irve)
+                if callback is not None:
+                    callback(test_case)
+            if self.builder is not None and self.builder.overhead_files:
+                for (command, model) in overhead.fit_test_cases(
+                                                        self.test_cases):
+                    logging.info("Overhead of %s against %s: %s" % (command,
+                                    self.host, overhead.describe(model)))
+        finally:
+            if self.builder is not None:
+                self.builder.teardown()
+
+class AdaptiveTestSet(TestSet):
+    """A test set that prunes slow commands before running the full data
+    set, with successive halving.
+
+    Every command of the builder is first run on a subset with the fraction
+    I{start} of each file set. The slowest commands are then pruned,
+    keeping the fraction I{keep} of them, and the rest are run again on
+    subsets that are larger by the factor 1/I{keep}. Only the commands left
+    when the subsets would reach the full size, or when no more than
+    I{survivors} are left, are run on the whole file sets.
+
+    Commands are ranked by their total throughput over every file set in
+    the round. Each test case records its round, the fraction of the data
+    it was run on and whether its command was pruned after the round.
+
+    """
+    def __init__(self, host=None, builder=None, start=0.1, keep=0.5,
+                    survivors=1):
+        """Initializes a test set for the commands and files of
+        I{builder}.
+
+        @param start: Fraction of each file set in the first round.
+        @type start: float
+        @param keep: Fraction of the commands kept after each round.
+        @type keep: float
+        @param survivors: The least number of commands run on the whole
+                          file sets.
+        @type survivors: int
+
+        """
+        super(AdaptiveTestSet, self).__init__(host=host, builder=builder)
+        self.start = start
+        self.keep = keep
+        self.survivors = survivors
+        self.failed = set()
+    def run(self, callback=None):
+        """Runs the rounds of the test set.
+
+        The callback for the test cases of a round is called when the round
+        has finished and the pruned commands are known.
+
+        """
+        self.builder.setup()
+        try:
+            candidates = list(self.builder.commands)
+            fraction = self.start
+            round_number = 0
+            while True:
+                final = fraction >= 1 or len(candidates) <= self.survivors
+                if final:
+                    fraction = 1.0
+                test_cases = self.run_round(candidates, round_number,
+                                            fraction)
+                survivors = candidates
+                if not final:
+                    survivors = self.prune(candidates, test_cases)
+                for (command, cases) in zip(candidates, test_cases):
+                    for test_case in cases:
+                        test_case.pruned = command not in survivors
+                        self.test_cases.append(test_case)
+                        if callback is not None:
+                            callback(test_case)
+                if final:
+                    return
+                logging.info(("Round %d of %s against %s kept %d of %d "
+                            "commands") % (round_number, self.builder.name,
+                            self.host, len(survivors), len(candidates)))
+                candidates = survivors
+                fraction = fraction/self.keep
+                round_number += 1
+        finally:
+            self.builder.teardown()
+    def run_round(self, candidates, round_number, fraction):
+        """Runs every command in I{candidates} on I{fraction} of each file
+        set.
+
+        @return: list with a list of test cases for each command.
+
+        """
+        temp_dirs = []
+        files = self.builder.files
+        try:
+            if fraction < 1:
+                files = []
+                for f in self.builder.files:
+                    (temp_dir, subset_file) = self.builder.build_subset(f,
+                                                                fraction)
+                    temp_dirs.append(temp_dir)
+                    files.append(subset_file)
+            test_cases = [[TestCase(command=command, f=f,
+                                    repetitions=self.builder.repetitions,
+                                    warmup=self.builder.warmup)
+                            for f in files] for command in candidates]
+            self.builder.prepare_remote([test_case for cases in test_cases
+                                        for test_case in cases])
+            for cases in test_cases:
+                for test_case in cases:
+                    test_case.round = round_number
+                    test_case.sample_fraction = fraction
+                    try:
+                        test_case.run()
+                    except IllegalReturnValueError, irve:
+                        logging.error(irve)
+                        self.failed.add(test_case)
+            return test_cases
+        finally:
+            for temp_dir in temp_dirs:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+    def prune(self, candidates, test_cases):
+        """Gets the commands to keep after a round.
+
+        Commands whose test cases failed are ranked last.
+
+        @return: list of L{Command}, in the order of I{candidates}.
+
+        """
+        scores = {}
+        for (command, cases) in zip(candidates, test_cases):
+            size = 0
+            transfer_time = 0
+            for test_case in cases:
+                if test_case in self.failed:
+                    size = 0
+                    break
+                size += test_case.f.get_size()
+                transfer_time += test_case.get_transfer_time()
+            scores[command] = 0
+            if size > 0 and transfer_time > 0:
+                scores[command] = size/transfer_time
+        ranked = sorted(candidates, key=lambda command: scores[command],
+                        reverse=True)
+        kept = ranked[:max(self.survivors,
+                            int(math.ceil(len(candidates) * self.keep)))]
+        return [command for command in candidates if command in kept]
 
 class CommandBuilder(object):
     """Abstract class defining useful stuff for creating a test set from a
@@ -165,22 +832,158 @@ class CommandBuilder(object):
 
         """
         self.name = cmdname
+        self.local_sshd = None
+        if (self.use_ssh and config.has_option(cfgname, 'local_sshd') and
+                config.getboolean(cfgname, 'local_sshd')):
+            self.local_sshd = localsshd.LocalSSHD()
         # Required parameters
-        self.host = config.get(cfgname, 'host')
-        self.target_folder = config.get(cfgname, 'target_folder')
-        self.arguments = config.get(cfgname, 'arguments')
+        if self.local_sshd is not None:
+            self.host = self.local_sshd.address
+        elif self.local and not config.has_option(cfgname, 'host'):
+            self.host = 'localhost'
+        else:
+            self.host = config.get(cfgname, 'host')
+        self.target_folder = None
+        if self.needs_target_folder or config.has_option(cfgname,
+                                                        'target_folder'):
+            self.target_folder = config.get(cfgname, 'target_folder')
+        if self.local and self.target_folder is not None:
+            # Local commands run without a shell to expand ~.
+            self.target_folder = os.path.expanduser(self.target_folder)
         # Optional parameters
         self.username = None
-        if config.has_option(cfgname, 'username'):
+        if self.local_sshd is not None:
+            self.username = self.local_sshd.user
+        elif config.has_option(cfgname, 'username'):
             self.username = config.get(cfgname, 'username')
         if self.username is not None:
             self.target = "%s@%s" % (self.username, self.host)
         else:
             self.target = self.host
+        self.repetitions = 1
+        if config.has_option(cfgname, 'repetitions'):
+            self.repetitions = max(1, config.getint(cfgname, 'repetitions'))
+        self.multiplex = False
+        if config.has_option(cfgname, 'multiplex'):
+            self.multiplex = config.getboolean(cfgname, 'multiplex')
+        self.masters = {}
+        self.control_dir = None
+        self.use_manifest = True
+        if config.has_option(cfgname, 'manifest'):
+            self.use_manifest = config.getboolean(cfgname, 'manifest')
+        self.timeout = None
+        if config.has_option(cfgname, 'timeout'):
+            self.timeout = config.getfloat(cfgname, 'timeout')
+        self.progress = False
+        if config.has_option(cfgname, 'progress'):
+            self.progress = config.getboolean(cfgname, 'progress')
+        self.warmup = 0
+        if config.has_option(cfgname, 'warmup'):
+            self.warmup = max(0, config.getint(cfgname, 'warmup'))
+        self.adaptive = False
+        if config.has_option(cfgname, 'adaptive'):
+            self.adaptive = config.getboolean(cfgname, 'adaptive')
+        self.adaptive_start = 0.1
+        if config.has_option(cfgname, 'adaptive_start'):
+            self.adaptive_start = config.getfloat(cfgname, 'adaptive_start')
+        self.adaptive_keep = 0.5
+        if config.has_option(cfgname, 'adaptive_keep'):
+            self.adaptive_keep = config.getfloat(cfgname, 'adaptive_keep')
+        self.adaptive_survivors = 1
+        if config.has_option(cfgname, 'adaptive_survivors'):
+            self.adaptive_survivors = max(1, config.getint(cfgname,
+                                                'adaptive_survivors'))
+        self.cache_mode = 'none'
+        if config.has_option(cfgname, 'cache_mode'):
+            self.cache_mode = config.get(cfgname, 'cache_mode').lower()
+        if self.cache_mode not in cache.MODES:
+            raise cache.CacheError(("Unknown cache_mode %s in section %s, "
+                                    "must be one of: %s") % (self.cache_mode,
+                                    cfgname, ", ".join(cache.MODES)))
+        if self.cache_mode == 'cold' and cache.fadvise is None:
+            raise cache.CacheError(("cache_mode cold in section %s needs "
+                                    "posix_fadvise()") % cfgname)
+        self.cache_dir = cache.STAGE_DIR
+        if config.has_option(cfgname, 'cache_dir'):
+            self.cache_dir = config.get(cfgname, 'cache_dir')
+        self.staged = []
+        self.isolate = True
+        if config.has_option(cfgname, 'isolate'):
+            self.isolate = config.getboolean(cfgname, 'isolate')
+        self.preseed = False
+        if config.has_option(cfgname, 'preseed'):
+            self.preseed = config.getboolean(cfgname, 'preseed')
+        self.remote_dirs = None
+        self.phases = False
+        if config.has_option(cfgname, 'phases'):
+            self.phases = config.getboolean(cfgname, 'phases')
+        self.sample_interval = None
+        if config.has_option(cfgname, 'sample_interval'):
+            self.sample_interval = config.getfloat(cfgname, 'sample_interval')
+            if self.sample_interval <= 0:
+                raise sampler.SamplerError(("sample_interval must be "
+                                    "positive in section %s") % cfgname)
+            if not sampler.is_available():
+                raise sampler.SamplerError(("sample_interval in section %s "
+                                    "needs /proc and /sys of Linux") %
+                                    cfgname)
+        self.sample_series = False
+        if config.has_option(cfgname, 'sample_series'):
+            self.sample_series = config.getboolean(cfgname, 'sample_series')
+        self.remote_metrics = False
+        if config.has_option(cfgname, 'remote_metrics'):
+            self.remote_metrics = config.getboolean(cfgname, 'remote_metrics')
+        self.remote_metrics_interval = 1.0
+        if config.has_option(cfgname, 'remote_metrics_interval'):
+            self.remote_metrics_interval = config.getfloat(cfgname,
+                                                'remote_metrics_interval')
+            if self.remote_metrics_interval <= 0:
+                raise collector.CollectorError(("remote_metrics_interval "
+                                "must be positive in section %s") % cfgname)
+        self.collector = None
+        self.verify = False
+        if config.has_option(cfgname, 'verify'):
+            self.verify = config.getboolean(cfgname, 'verify')
+        self.verify_hash = 'md5'
+        if config.has_option(cfgname, 'verify_hash'):
+            self.verify_hash = config.get(cfgname, 'verify_hash').lower()
+        if self.verify_hash not in verify.ALGORITHMS:
+            raise verify.VerifyError(("Unknown verify_hash %s in section %s, "
+                                "must be one of: %s") % (self.verify_hash,
+                                cfgname, ", ".join(sorted(verify.ALGORITHMS))))
+        if self.verify and not (self.use_ssh or self.local):
+            raise verify.VerifyError(("verify in section %s needs a shell on "
+                                "the host, which %s does not log in to") % (
+                                cfgname, cmdname))
+        self.probe_port = probe.PORT
+        if config.has_option(cfgname, 'probe_port'):
+            self.probe_port = config.getint(cfgname, 'probe_port')
+        self.efficiency = False
+        if config.has_option(cfgname, 'efficiency'):
+            self.efficiency = config.getboolean(cfgname, 'efficiency')
+        self.receiver = None
+        self.probe_proxies = {}
+        if self.target_folder is None:
+            # Nothing is written on the host to isolate.
+            self.isolate = False
+        if not self.use_ssh:
+            # There is no ssh connection to share or time.
+            self.multiplex = False
+            self.phases = False
+        if not 0 < self.adaptive_start <= 1 or not 0 < self.adaptive_keep < 1:
+            raise AdaptiveError(("adaptive_start must be in (0, 1] and "
+                                "adaptive_keep in (0, 1) in section %s") %
+                                cfgname)
         # Argument parameters
         self.arguments = []
-        args = config.get(cfgname, 'arguments').split(",")
+        matrix = self.get_matrix(config, cfgname)
+        args = []
+        # Without argument sections, the command is run with its default
+        # arguments and any matrix options.
+        if config.has_option(cfgname, 'arguments'):
+            args = config.get(cfgname, 'arguments').split(",")
         for arg in args:
+            arg = arg.strip()
             enc = None
             comp = None
             compl = None
@@ -194,13 +997,753 @@ class CommandBuilder(object):
                 except ValueError, ve:
                     pass
             self.arguments.append({'enc': enc, 'comp': comp, 'compl': compl})
+        if len(self.arguments) == 0:
+            self.arguments.append({'enc': None, 'comp': None, 'compl': None})
+        self.arguments = self.expand_matrix(self.arguments, matrix)
+        # The streams and link_profile options are reported as dimensions,
+        # unless the matrix already has them.
+        for dimension in (STREAMS_DIMENSION, LINK_DIMENSION):
+            if not config.has_option(cfgname, dimension):
+                continue
+            value = config.get(cfgname, dimension).strip()
+            self.arguments = [arg
+                    if dimension in dict(arg['dimensions'])
+                    else self.set_dimension(arg, dimension, value)
+                    for arg in self.arguments]
+        self.link_profiles = self.get_link_profiles(config, cfgname)
+        self.proxies = {}
+        self.argvs = set()
+        self.shards = {}
+        self.shard_dirs = []
 
         self.files = []
         self.test_args = []
         self.commands = []
-        files = config.get(cfgname, 'files').split(",")
+        files = []
+        # The files may be left out when a graded series is generated.
+        self.overhead_files = self.get_overhead_files(config, cfgname)
+        if config.has_option(cfgname, 'files') or not self.overhead_files:
+            files = config.get(cfgname, 'files').split(",")
+        files.extend(self.get_overhead_series(config, cfgname))
         for f in files:
-            self.files.append(self.build_file(f.strip()))
+            self.files.append(self.build_file(self.stage_file(f.strip())))
+    def get_link_profiles(self, config, cfgname):
+        """Reads the link profiles the arguments of the test section
+        I{cfgname} are emulated over, with
+        L{read_profile<linkemu.read_profile>}.
+
+        @return: dict mapping names to L{LinkProfile<linkemu.LinkProfile>}
+
+        """
+        profiles = {}
+        for arg in self.arguments:
+            name = dict(arg['dimensions']).get(LINK_DIMENSION, NO_LINK)
+            if name == NO_LINK or name in profiles:
+                continue
+            if self.local_sshd is None:
+                raise linkemu.LinkEmulationError(("link_profile in section "
+                                    "%s needs local_sshd") % cfgname)
+            profiles[name] = linkemu.read_profile(config, name)
+        return profiles
+    def get_overhead_files(self, config, cfgname):
+        """Reads the numbers of files of the graded series of the test
+        section I{cfgname}, from the C{overhead_files} option.
+
+        @return: list of int, empty if the section has no graded series.
+
+        """
+        if not config.has_option(cfgname, 'overhead_files'):
+            return []
+        try:
+            files = [int(n) for n in
+                        config.get(cfgname, 'overhead_files').split(",")
+                        if n.strip() != '']
+        except ValueError, ve:
+            raise overhead.OverheadError(("overhead_files must be integers "
+                                            "in section %s") % cfgname)
+        if len(files) < 2 or min(files) < 1:
+            raise overhead.OverheadError(("overhead_files needs at least two "
+                                    "positive numbers of files in section "
+                                    "%s") % cfgname)
+        return files
+    def get_overhead_series(self, config, cfgname):
+        """Generates the data sets of the graded series of the test
+        section I{cfgname} with L{overhead.generate_series}.
+
+        @return: list of strings with the paths of the data sets.
+
+        """
+        if not self.overhead_files:
+            return []
+        sizes = list(overhead.DEFAULT_SIZES)
+        if config.has_option(cfgname, 'overhead_sizes'):
+            try:
+                sizes = [int(size) for size in
+                            config.get(cfgname, 'overhead_sizes').split(",")
+                            if size.strip() != '']
+            except ValueError, ve:
+                raise overhead.OverheadError(("overhead_sizes must be "
+                                    "integers in section %s") % cfgname)
+        directory = os.path.join(tempfile.gettempdir(), 'spodtest-graded')
+        if config.has_option(cfgname, 'overhead_dir'):
+            directory = config.get(cfgname, 'overhead_dir')
+        profile = 'tiny'
+        if config.has_option(cfgname, 'overhead_profile'):
+            profile = config.get(cfgname, 'overhead_profile')
+        seed = 0
+        if config.has_option(cfgname, 'overhead_seed'):
+            seed = config.getint(cfgname, 'overhead_seed')
+        return overhead.generate_series(directory, self.overhead_files,
+                                        sizes, profile, seed)
+    # Extra matrix dimensions the command takes arguments for, mapping the
+    # name of each dimension to the arguments it adds, with %s replaced by
+    # the value. Every command also takes the ssh options in SSH_DIMENSIONS
+    # and any ssh option as a dimension named ssh_<option>.
+    matrix_options = {}
+    def get_matrix(self, config, cfgname):
+        """Reads the matrix options of the test section I{cfgname}.
+
+        A matrix option is on the form C{matrix.<dimension>=<value>,...} and
+        lists the values to test for a dimension.
+
+        @return: list of tuples of (dimension, list of values), in the order
+                 they are given in the section.
+
+        """
+        matrix = []
+        for option in config.options(cfgname):
+            if not option.startswith(MATRIX_PREFIX):
+                continue
+            dimension = option[len(MATRIX_PREFIX):]
+            if not self.is_dimension(dimension):
+                raise MatrixError(("Unknown matrix dimension %s in section "
+                                    "%s") % (dimension, cfgname))
+            values = [value.strip() for value in
+                        config.get(cfgname, option).split(",")
+                        if value.strip() != '']
+            if len(values) == 0:
+                raise MatrixError("No values for %s in section %s" % (
+                                    option, cfgname))
+            if dimension == 'compression_level':
+                try:
+                    values = [int(value) for value in values]
+                except ValueError, ve:
+                    raise MatrixError(("Compression levels must be integers "
+                                        "in section %s") % cfgname)
+            matrix.append((dimension, values))
+        return matrix
+    def is_dimension(self, dimension):
+        """Checks whether the command can take I{dimension} in a matrix.
+
+        Commands that do not use ssh take no ssh options.
+
+        @return: bool
+
+        """
+        if (dimension in ARG_DIMENSIONS or dimension in self.matrix_options or
+                dimension == STREAMS_DIMENSION):
+            return True
+        return self.use_ssh and (dimension in SSH_DIMENSIONS or
+                                dimension == LINK_DIMENSION or
+                                (dimension.startswith(SSH_PREFIX) and
+                                    len(dimension) > len(SSH_PREFIX)))
+    def expand_matrix(self, arguments, matrix):
+        """Expands each argument dictionary into the cross product of the
+        values in I{matrix}.
+
+        Values for encryption, compression and compression level replace the
+        ones from the argument sections. The values of the other dimensions
+        are kept in a list of tuples under the key C{dimensions}.
+
+        @return: list of dicts
+
+        """
+        expanded = []
+        for arg in arguments:
+            combinations = [dict(arg, dimensions=[])]
+            for (dimension, values) in matrix:
+                combinations = [self.set_dimension(c, dimension, value)
+                                for c in combinations for value in values]
+            expanded.extend(combinations)
+        return expanded
+    def set_dimension(self, arg, dimension, value):
+        """Gets a copy of the argument dictionary I{arg} with I{dimension}
+        set to I{value}.
+
+        """
+        arg = dict(arg, dimensions=list(arg['dimensions']))
+        if dimension in ARG_DIMENSIONS:
+            arg[ARG_DIMENSIONS[dimension]] = value
+        else:
+            arg['dimensions'].append((dimension, value))
+        return arg
+    def add_test_arg(self, arglist, arg, encryption=None, compression=None,
+                        compression_level=None, format_data=None):
+        """Adds the L{Args} for the argument dictionary I{arg}.
+
+        The arguments for the extra matrix dimensions of I{arg} are added to
+        I{arglist}. Combinations that give the same arguments as one that is
+        already added are skipped, such as an encryption the command does
+        not take and the default encryption.
+
+        @param arglist: Arguments for the encryption and compression.
+        @type arglist: list of strings
+        @param arg: Argument dictionary from I{self.arguments}.
+        @type arg: dict
+        @param format_data: Extra values for I{self.cmd_format}, such as
+                            arguments that are not given to the command as
+                            I{test_args}.
+        @type format_data: dict
+        @return: bool indicating whether the arguments were added.
+
+        """
+        arglist = list(arglist)
+        ssh_options = []
+        streams = 1
+        link_profile = None
+        for (dimension, value) in arg.get('dimensions', []):
+            if dimension == LINK_DIMENSION:
+                if value != NO_LINK:
+                    link_profile = value
+            elif dimension == STREAMS_DIMENSION:
+                try:
+                    streams = int(value)
+                except ValueError, ve:
+                    streams = 0
+                if streams < 1:
+                    raise MatrixError(("The number of streams must be a "
+                                        "positive integer for %s, not %s") % (
+                                        self.name, value))
+            elif dimension in self.matrix_options:
+                arglist.extend([a.replace('%s', str(value))
+                                for a in self.matrix_options[dimension]])
+            elif dimension in SSH_DIMENSIONS:
+                ssh_options.append("%s=%s" % (SSH_DIMENSIONS[dimension],
+                                                value))
+            else:
+                ssh_options.append("%s=%s" % (dimension[len(SSH_PREFIX):],
+                                                value))
+        test_arg = Args(arglist, encryption, compression, compression_level,
+                        dimensions=arg.get('dimensions'),
+                        ssh_options=ssh_options, format_data=format_data,
+                        streams=streams, link_profile=link_profile)
+        argv = (tuple(arglist + ssh_options) +
+                tuple(sorted(test_arg.get_format_data().items())) +
+                (streams, link_profile))
+        if argv in self.argvs:
+            logging.info("Skipping %s for %s, its arguments are already "
+                        "tested" % (test_arg.get_name(), self.name))
+            return False
+        self.argvs.add(argv)
+        self.test_args.append(test_arg)
+        return True
+    # Commands that copy to a local path instead of a remote host set local.
+    # Their host only names the results. Commands that do not run ssh, such
+    # as the local ones, set use_ssh to False and take no ssh options.
+    local = False
+    use_ssh = True
+    # Commands that do not write the files to the host, such as the raw TCP
+    # probe, set needs_target_folder to False, and those that send to the
+    # probe receiver set needs_receiver.
+    needs_target_folder = True
+    needs_receiver = False
+    # Commands whose streams can create the same directories in the target
+    # folder at the same time, as rsync and tar can, set parallel_dirs_safe.
+    # For the others, such as cp and scp, the directories of a file are
+    # created before each run with more than one stream.
+    parallel_dirs_safe = False
+    # Subclasses that can parse the progress output of their command set
+    # these. progress_args are added to the common arguments when the
+    # progress option is set, and progress_tty is True for commands that only
+    # show progress on a terminal.
+    progress_parser = None
+    progress_args = []
+    progress_tty = False
+    def get_progress_parser(self):
+        """Gets a new parser for the progress output of the command.
+
+        @return: L{ProgressParser<progress.ProgressParser>}, or None if the
+                 progress option is not set or the command has no parser.
+
+        """
+        if not self.progress or self.progress_parser is None:
+            return None
+        return self.progress_parser()
+    # Commands that time the transfer themselves, such as the sender of the
+    # raw TCP probe, set self_timed and give their time with get_run_time.
+    # The time of each run is then the time the command gave, without the
+    # startup of the command.
+    self_timed = False
+    def get_run_time(self, lines):
+        """Gets the time a self timed command gave for its transfer.
+
+        @param lines: The lines the command wrote to standard output.
+        @type lines: list of strings
+        @return: float seconds, or None if the command did not give it.
+
+        """
+        return None
+    # Encryption types the command accepts, and whether the compression
+    # arguments of the command are passed on to ssh. Commands that compress
+    # the data themselves set ssh_compression to False.
+    legal_encryption = ()
+    ssh_compression = True
+    def get_master(self, test_arg):
+        """Gets the SSH master connection for commands using I{test_arg}.
+
+        @param test_arg: Arguments of the command.
+        @type test_arg: L{Args}
+        @return: L{ControlMaster<multiplex.ControlMaster>}
+
+        """
+        # Only arguments that reach ssh decide which master is used.
+        key = tuple(self.get_master_args(test_arg))
+        if key not in self.masters:
+            if self.control_dir is None:
+                self.control_dir = tempfile.mkdtemp(prefix='spodtest-')
+            self.masters[key] = multiplex.ControlMaster(self.target,
+                                            self.get_master_args(test_arg),
+                                            self.control_dir)
+        return self.masters[key]
+    def get_master_args(self, test_arg):
+        """Gets the ssh arguments for a master connection that matches the
+        encryption and compression of I{test_arg}.
+
+        @return: list of strings
+
+        """
+        args = []
+        if test_arg.get_encryption().lower() in self.legal_encryption:
+            args.extend(['-c', test_arg.get_encryption().lower()])
+        if self.ssh_compression:
+            if test_arg.get_compression().lower() in ('yes', 'no'):
+                args.append('-oCompression=%s' %
+                            test_arg.get_compression().lower())
+            if test_arg.get_compression_level() != Args.NOTSET:
+                args.append('-oCompressionLevel=%s' %
+                            test_arg.get_compression_level())
+        args.extend(['-o%s' % option for option in test_arg.get_ssh_options()])
+        args.extend(['-o%s' % option
+                    for option in self.get_sshd_options(test_arg)])
+        return args
+    def get_sshd_options(self, test_arg=None):
+        """Gets the ssh options for logging in to the local sshd, if the
+        commands use one.
+
+        Commands whose arguments have a link profile connect through the
+        L{LinkProxy<linkemu.LinkProxy>} emulating it. Without I{test_arg},
+        as for creating the remote directories, the sshd is reached
+        directly.
+
+        @return: list of strings on the form Key=Value.
+
+        """
+        if self.local_sshd is None:
+            return []
+        port = None
+        if test_arg is not None and test_arg.get_link_profile() is not None:
+            port = self.get_proxy(test_arg.get_link_profile()).listen()
+        return self.local_sshd.get_ssh_options(port)
+    def get_proxy(self, name):
+        """Gets the proxy emulating the link profile I{name} in front of
+        the local sshd.
+
+        @return: L{LinkProxy<linkemu.LinkProxy>}
+
+        """
+        if name not in self.proxies:
+            self.local_sshd.get_directory()
+            self.proxies[name] = linkemu.LinkProxy(self.link_profiles[name],
+                                self.local_sshd.port, self.local_sshd.address)
+        return self.proxies[name]
+    def get_ssh_options(self, test_arg):
+        """Gets extra ssh options for commands using I{test_arg}.
+
+        Options from the matrix are decided by the master connection when
+        multiplexing. When phases are timed, ssh is made to log the debug
+        messages they are timed by.
+
+        @return: list of strings on the form Key=Value.
+
+        """
+        if not self.use_ssh:
+            return []
+        options = test_arg.get_ssh_options()
+        if self.multiplex:
+            options = self.get_master(test_arg).get_client_options()
+        options = options + self.get_sshd_options(test_arg)
+        if self.phases:
+            options = options + [phases.SSH_OPTION]
+        return options
+    def get_ssh_args(self, test_arg):
+        """Gets the arguments passing L{get_ssh_options} on to ssh.
+
+        Commands that take ssh options directly use this as it is, others
+        must override it.
+
+        @return: list of strings
+
+        """
+        return ['-o%s' % option for option in self.get_ssh_options(test_arg)]
+    def get_sampler(self):
+        """Gets a new sampler for the utilisation of the host during a
+        timed run.
+
+        Transfers to the local host go over the loopback interface, so it
+        is sampled instead of the others.
+
+        @return: L{Sampler<sampler.Sampler>}, or None if the utilisation is
+                 not sampled.
+
+        """
+        if self.sample_interval is None:
+            return None
+        return sampler.Sampler(self.sample_interval,
+                        loopback=self.local or self.local_sshd is not None)
+    def get_handshake_time(self, test_arg):
+        """Gets the time used to set up the SSH connection shared by the
+        commands using I{test_arg}.
+
+        @return: float seconds, or None if connections are not shared.
+
+        """
+        if not self.multiplex:
+            return None
+        return self.get_master(test_arg).get_handshake_time()
+    def setup(self):
+        """Prepares for running the test set.
+
+        Starts the local sshd if the commands use one, and the SSH master
+        connections when multiplexing is enabled.
+
+        """
+        if self.local_sshd is not None:
+            self.local_sshd.start()
+        for proxy in self.proxies.values():
+            proxy.start()
+        if self.multiplex:
+            for test_arg in self.test_args:
+                self.get_master(test_arg).start()
+        if self.remote_metrics:
+            self.collector = self.get_collector()
+            try:
+                self.collector.start()
+            except collector.CollectorError, e:
+                logging.warning(e)
+                self.collector = None
+        if self.needs_receiver or self.efficiency:
+            self.receiver = self.get_receiver()
+            try:
+                self.receiver.start()
+            except probe.ProbeError, e:
+                self.receiver = None
+                if self.needs_receiver:
+                    raise
+                logging.warning("%s, the efficiency is not measured" % e)
+    def get_collector(self):
+        """Creates the L{RemoteCollector<collector.RemoteCollector>} that
+        samples the utilisation of the host.
+
+        The collector logs in like the commands do, and goes through the
+        first master connection when multiplexing. Local commands are
+        sampled with a local shell.
+
+        @return: L{RemoteCollector<collector.RemoteCollector>}
+
+        """
+        target = self.target
+        if self.local:
+            target = None
+        options = self.get_sshd_options()
+        if self.multiplex and len(self.test_args) > 0:
+            options = (self.get_master(self.test_args[0]).get_client_options()
+                        + options)
+        return collector.RemoteCollector(target, self.remote_metrics_interval,
+                                    ['-o%s' % option for option in options])
+    def get_remote_utilisation(self, spans):
+        """Gets the utilisation of the host over each of I{spans}.
+
+        @param spans: tuples of (start, end) of the timed runs, by
+                      L{timer.monotonic}.
+        @type spans: list of tuples
+        @return: list of dicts with the keys in
+                 L{FIELDS<collector.FIELDS>}, leaving out runs without
+                 snapshots around them. Empty if the host is not sampled.
+
+        """
+        if self.collector is None:
+            return []
+        utilisation = [self.collector.get_utilisation(start, end)
+                        for (start, end) in spans]
+        return [u for u in utilisation if u is not None]
+    def get_receiver(self):
+        """Creates the L{Receiver<probe.Receiver>} the raw TCP probes are
+        sent to.
+
+        The receiver is started on the host with ssh, like the remote
+        directories are created. Commands to the local host, or to the
+        local sshd, have it started with a local shell.
+
+        @return: L{Receiver<probe.Receiver>}
+
+        """
+        target = self.target
+        if self.local or self.local_sshd is not None:
+            target = None
+        return probe.Receiver(target, self.probe_port,
+                    ['-o%s' % option for option in self.get_sshd_options()])
+    def get_probe_address(self, test_arg):
+        """Gets the address and port the probes of commands using
+        I{test_arg} connect to.
+
+        Arguments with a link profile go through a
+        L{LinkProxy<linkemu.LinkProxy>} of their own in front of the
+        receiver, so the probe sees the same emulated link as the command.
+
+        @return: tuple of (string host, int port)
+
+        """
+        if self.receiver.target is not None:
+            return (self.host, self.receiver.port)
+        name = test_arg.get_link_profile()
+        if name is None:
+            return (linkemu.ADDRESS, self.receiver.port)
+        if name not in self.probe_proxies:
+            self.probe_proxies[name] = linkemu.LinkProxy(
+                    self.link_profiles[name], self.receiver.port)
+            self.probe_proxies[name].start()
+        return (linkemu.ADDRESS, self.probe_proxies[name].port)
+    def run_probe(self, test_arg, shards):
+        """Sends I{shards} to the receiver over plain TCP, one connection
+        for each at the same time, with L{probe.send_streams}.
+
+        @param test_arg: Arguments of the command the probe is compared to.
+        @type test_arg: L{Args}
+        @param shards: The files of each stream of the command.
+        @type shards: list of L{FileObject}
+        @return: float seconds, or None if the probe failed.
+
+        """
+        if self.receiver is None:
+            return None
+        (host, port) = self.get_probe_address(test_arg)
+        try:
+            return probe.send_streams(host, port,
+                                [shard.get_filelist() for shard in shards],
+                                self.timeout)
+        except probe.ProbeError, e:
+            logging.warning(e)
+            return None
+    def prepare_streams(self, f, target_folder):
+        """Creates the directories of I{f} in I{target_folder} before a run
+        with more than one stream, unless the command is
+        I{parallel_dirs_safe}.
+
+        Every shard has the same directories, so streams that create them
+        at the same time fail when one finds a directory another has just
+        made. The directories are made with one ssh session, or a local
+        shell for local commands, outside the timed run.
+
+        Raises an L{IllegalReturnValueError} if they cannot be created.
+
+        """
+        if self.parallel_dirs_safe or not f.is_dir():
+            return
+        target = self.target
+        if self.local:
+            target = None
+        path = self.get_remote_path(f, target_folder)
+        dirs = set()
+        for name in f.get_filelist():
+            dirs.add(os.path.dirname(os.path.relpath(name, f.get_path())))
+        dirs.discard('')
+        if not remotedir.make_tree(target, path, sorted(dirs),
+                    ['-o%s' % option for option in self.get_sshd_options()]):
+            raise IllegalReturnValueError(("Unable to create the directories "
+                                "of %s in %s on %s") % (f.get_path(), path,
+                                target or 'localhost'))
+    def get_remote_path(self, f, target_folder):
+        """Gets where the command puts I{f} when it transfers it to
+        I{target_folder}.
+
+        Commands that copy a directory into the target folder under its own
+        name use this as it is, others must override it.
+
+        @param f: The transferred file or directory.
+        @type f: L{FileObject}
+        @return: string
+
+        """
+        return posixpath.join(target_folder, os.path.basename(f.get_path()))
+    def verify_run(self, f, target_folder):
+        """Checks that I{f} arrived whole in I{target_folder}.
+
+        The local digests come from L{verify.hashes}, and those on the host
+        are computed with one ssh session, or a local shell for local
+        commands, like the remote directories are created.
+
+        @param f: The transferred file or directory.
+        @type f: L{FileObject}
+        @param target_folder: The folder it was transferred to.
+        @type target_folder: string
+        @return: bool indicating whether every file arrived with the same
+                 contents.
+
+        """
+        target = self.target
+        if self.local:
+            target = None
+        path = self.get_remote_path(f, target_folder)
+        local = verify.hashes.get_digests(f, self.verify_hash,
+                                        self.use_manifest)
+        try:
+            remote = verify.list_remote(target, path, f.is_dir(),
+                        self.verify_hash,
+                        ['-o%s' % option for option in self.get_sshd_options()])
+        except verify.VerifyError, e:
+            logging.error(e)
+            return False
+        (missing, mismatched) = verify.compare(local, remote)
+        if len(missing) > 0 or len(mismatched) > 0:
+            logging.error(("Verification of %s in %s failed: %d of %d files "
+                        "missing, %d with other contents") % (f.get_path(),
+                        path, len(missing), len(local), len(mismatched)))
+            for name in (missing + mismatched)[:10]:
+                logging.debug("Not transferred whole: %s" % name)
+            return False
+        return True
+    def stage_file(self, f):
+        """Copies I{f} into a tmpfs if the cache mode is C{staged}.
+
+        @param f: Location of a file or folder.
+        @type f: string
+        @return: string with the location the commands should use.
+
+        """
+        if self.cache_mode != 'staged':
+            return f
+        path = cache.stager.stage(f, self.cache_dir)
+        self.staged.append(f)
+        return path
+    def prepare_cache(self, f):
+        """Prepares the page cache for a timed run on I{f}.
+
+        With the cache mode C{cold} the pages of the files are dropped from
+        the page cache, and with C{warm} the files are read into it.
+
+        @param f: The file or directory about to be transferred.
+        @type f: L{FileObject}
+
+        """
+        if self.cache_mode == 'cold':
+            cache.evict(f.get_filelist())
+        elif self.cache_mode == 'warm':
+            cache.warm(f.get_filelist())
+    def prepare_remote(self, test_cases):
+        """Creates a separate remote directory for each run of
+        I{test_cases}, if runs are isolated.
+
+        The directories are created with a single ssh session, and are
+        removed by L{teardown}. Raises a
+        L{RemoteDirError<remotedir.RemoteDirError>} if they cannot be
+        created, rather than letting every run fail on its own.
+
+        @param test_cases: Test cases about to be run.
+        @type test_cases: list of L{TestCase}
+
+        """
+        if not self.isolate:
+            return
+        if self.remote_dirs is None:
+            self.remote_dirs = self.get_remote_dirs()
+        for test_case in test_cases:
+            test_case.remote_dirs = self.remote_dirs.allocate(
+                                    test_case.warmup + test_case.repetitions)
+        if not self.remote_dirs.create():
+            raise remotedir.RemoteDirError(("Unable to create the run "
+                                "directories in %s on %s") % (
+                                self.remote_dirs.base,
+                                self.remote_dirs.get_host()))
+    def get_remote_dirs(self):
+        """Creates the L{RemoteDirs<remotedir.RemoteDirs>} the runs are
+        isolated in.
+
+        The directories are made with ssh, or with a local shell for local
+        commands. Commands that reach the target some other way override
+        this.
+
+        @return: L{RemoteDirs<remotedir.RemoteDirs>}
+
+        """
+        target = self.target
+        if self.local:
+            target = None
+        return remotedir.RemoteDirs(target, self.target_folder,
+                    ['-o%s' % option for option in self.get_sshd_options()])
+    def get_shards(self, f, number):
+        """Splits I{f} into up to I{number} shards of about the same size,
+        one for each stream, with L{subset.create_shards}.
+
+        The shards of a file are made once, and are removed by L{teardown}.
+        A single file cannot be split, so it is sent in one stream.
+
+        @param f: The file or directory to split.
+        @type f: L{FileObject}
+        @param number: The number of streams.
+        @type number: int
+        @return: list of L{FileObject}
+
+        """
+        key = (f.get_path(), number)
+        if key in self.shards:
+            return self.shards[key]
+        shards = [f]
+        if f.is_dir():
+            (temp_dir, paths) = subset.create_shards(f.get_path(),
+                            f.get_filelist(), f.get_file_sizes(), number)
+            self.shard_dirs.append(temp_dir)
+            shards = []
+            for (path, filelist, size) in paths:
+                shard = self.build_file(path)
+                shard.filelist = filelist
+                shard.size = size
+                shard.num_files = len(filelist)
+                shards.append(shard)
+        if len(shards) < number:
+            logging.warning("%s can only be split into %d streams, not %d" % (
+                            f.get_path(), len(shards), number))
+        self.shards[key] = shards
+        return shards
+    def teardown(self):
+        """Cleans up after running the test set. """
+        if self.collector is not None:
+            self.collector.stop()
+            self.collector = None
+        for proxy in self.probe_proxies.values():
+            proxy.stop()
+        self.probe_proxies = {}
+        if self.receiver is not None:
+            self.receiver.stop()
+            self.receiver = None
+        if self.remote_dirs is not None:
+            self.remote_dirs.remove()
+            self.remote_dirs = None
+        for temp_dir in self.shard_dirs:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        self.shard_dirs = []
+        self.shards = {}
+        for f in self.staged:
+            cache.stager.release(f)
+        self.staged = []
+        for master in self.masters.values():
+            master.stop()
+        if self.control_dir is not None:
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+        for proxy in self.proxies.values():
+            proxy.stop()
+        self.proxies = {}
+        if self.local_sshd is not None:
+            self.local_sshd.stop()
     def build_file(self, f):
         """Creates a L{FileObject} from I{f}.
 
@@ -209,7 +1752,33 @@ class CommandBuilder(object):
         @return: L{FileObject} representation of I{f}
 
         """
-        return FileObject(f)
+        return FileObject(f, use_manifest=self.use_manifest)
+    def build_subset(self, f, fraction):
+        """Creates a L{FileObject} with about I{fraction} of the data in
+        I{f}, made with L{subset.create}.
+
+        The file set of the subset is named after the file set of I{f} and
+        the fraction, so its results are not mixed up with those of the
+        whole file set.
+
+        @param f: The file or directory to take a subset of.
+        @type f: L{FileObject}
+        @param fraction: Fraction of the data to include.
+        @type fraction: float
+        @return: tuple of (temporary directory to remove when the subset is
+                 no longer needed, L{FileObject})
+
+        """
+        (temp_dir, path, filelist, size) = subset.create(f.get_path(),
+                                    f.get_filelist(), f.get_size(), fraction)
+        subset_file = self.build_file(path)
+        subset_file.filelist = filelist
+        subset_file.size = size
+        subset_file.num_files = len(filelist)
+        subset_file.fs_name = "%s@%g" % (f.get_fs_name() or
+                                        os.path.basename(f.get_path()),
+                                        fraction)
+        return (temp_dir, subset_file)
     def build(self):
         """Builds the commands.
 
@@ -220,14 +1789,19 @@ class CommandBuilder(object):
 
         """
         self.commands = []
+        common_args = list(self.common_args)
+        if self.get_progress_parser() is not None:
+            common_args.extend(self.progress_args)
         for test_arg in self.test_args:
             formatdata = {
                 'base_command': self.base_cmd,
-                'common_args': " ".join(self.common_args),
-                'test_args': " ".join(test_arg.get_args()),
+                'common_args': " ".join(common_args),
+                'test_args': " ".join(test_arg.get_args() +
+                                        self.get_ssh_args(test_arg)),
                 'target': self.target,
                 'target_folder': self.target_folder,
             }
+            formatdata.update(test_arg.get_format_data())
             self.commands.append(Command(command=self.cmd_format, 
                                     command_name=self.name, 
                                     args=test_arg,
@@ -243,10 +1817,17 @@ class CommandBuilder(object):
 
         """
         self.build()
-        test_set = TestSet()
+        if self.adaptive:
+            return AdaptiveTestSet(host=self.host, builder=self,
+                                    start=self.adaptive_start,
+                                    keep=self.adaptive_keep,
+                                    survivors=self.adaptive_survivors)
+        test_set = TestSet(host=self.host, builder=self)
         for command in self.commands:
             for f in self.files:
-                test_set.add_test_case(TestCase(command=command, f=f))
+                test_set.add_test_case(TestCase(command=command, f=f,
+                                            repetitions=self.repetitions,
+                                            warmup=self.warmup))
         return test_set
 
 
@@ -301,6 +1882,8 @@ class Command(object):
                     'filename': '<filename>',
                     'filelocation': '<filelocation>',
                     'filedir': '<filedir>',
+                    'filebasename': '<filebasename>',
+                    'fileparent': '<fileparent>',
                     'usagefile': '<usagefile>',
                 })
         return self.command % formatdata
@@ -330,7 +1913,8 @@ class FileObject(object):
     """Class representing a file and other necessary data about it.
     
     """
-    def __init__(self, name, usage_file=None, fs_name=None):
+    def __init__(self, name, usage_file=None, fs_name=None,
+                    use_manifest=True):
         self.abspath = os.path.abspath(name)
         if os.path.isdir(self.abspath):
             self.name = ''
@@ -342,7 +1926,9 @@ class FileObject(object):
         self.num_files = None
         self.usage_file = usage_file
         self.fs_name = fs_name
+        self.use_manifest = use_manifest
         self.filelist = []
+        self.file_sizes = []
     def get_path(self):
         """Gets location of file.
 
@@ -417,12 +2003,16 @@ class FileObject(object):
         
         @return: dict containing keys filename and filelocation, representing 
                  the name of the file and the absolute location of the file, 
-                 respectively.
+                 respectively. filebasename and fileparent are the last part
+                 of the location and the directory it is in, also when this
+                 is a directory.
         
         """
         retdict = {'filename': self.name, 
                         'filelocation': self.abspath, 
                         'filedir': self.directory, 
+                        'filebasename': os.path.basename(self.abspath),
+                        'fileparent': os.path.dirname(self.abspath),
                         'usagefile': self.usage_file}
         return retdict
     def is_dir(self):
@@ -452,6 +2042,16 @@ class FileObject(object):
         if len(self.filelist) == 0:
             self.get_file_info()
         return self.filelist
+    def get_file_sizes(self):
+        """Gets the size of each file in L{get_filelist}.
+
+        @return: list of int, in the order of L{get_filelist}.
+
+        """
+        filelist = self.get_filelist()
+        if len(self.file_sizes) != len(filelist):
+            self.file_sizes = [os.path.getsize(path) for path in filelist]
+        return self.file_sizes
     def get_size_string(self):
         total_size = float(self.get_size())
         if total_size > 1024*1024*1024:
@@ -469,23 +2069,34 @@ class FileObject(object):
         The number of files will always be B{1} if self represents a file, 
         otherwise the number will be the number of files in the directory.
 
-        Will ignore any file named C{fs_name}.
+        Will ignore any file named C{fs_name} or C{fs_profile} in the root
+        of a directory. Directories are listed through a
+        L{Manifest<manifest.Manifest>}, which is stored next to the
+        directory unless I{self.use_manifest} is False, so that later runs
+        only list the directories that have changed.
 
         """
         if not self.is_dir():
-            self.filelist.append(self.abspath)
+            self.filelist = [self.abspath]
             self.size = os.path.getsize(self.abspath)
-            self.num = 1
+            self.file_sizes = [self.size]
+            self.num_files = 1
+            return
+        files = manifest.Manifest(self.abspath)
+        if self.use_manifest:
+            files.load()
+        files.update()
+        if self.use_manifest:
+            files.save()
+        self.filelist = []
+        self.file_sizes = []
         size = 0
-        num = 0
-        for (path, dirs, files) in os.walk(self.abspath):
-            for f in files:
-                if f != "fs_name":
-                    self.filelist.append(os.path.join(path, f))
-                    size += os.path.getsize(os.path.join(path, f))
-                    num += 1
+        for (path, (fsize, mtime, inode)) in files.get_files():
+            self.filelist.append(path)
+            self.file_sizes.append(fsize)
+            size += fsize
         self.size = size
-        self.num_files = num
+        self.num_files = len(self.filelist)
 
 
 class Args(object):
@@ -499,7 +2110,9 @@ class Args(object):
     """
     NOTSET = "default"
     def __init__(self, args, encryption=None, 
-                    compression=None, compression_level=None):
+                    compression=None, compression_level=None,
+                    dimensions=None, ssh_options=None, format_data=None,
+                    streams=1, link_profile=None):
         if encryption is None:
             encryption = self.NOTSET
         if compression is None:
@@ -513,8 +2126,55 @@ class Args(object):
         if isinstance(compression_level, int):
             compression_level = "%d" % compression_level
         self.compression_level = compression_level
+        if dimensions is None:
+            dimensions = []
+        self.dimensions = [(name, str(value)) for (name, value) in dimensions]
+        if ssh_options is None:
+            ssh_options = []
+        self.ssh_options = ssh_options
+        if format_data is None:
+            format_data = {}
+        self.format_data = format_data
+        self.streams = streams
+        self.link_profile = link_profile
     def get_args(self):
         return self.args
+    def get_format_data(self):
+        """Gets the extra values the command is formatted with.
+
+        @return: dict
+
+        """
+        return self.format_data
+    def get_dimensions(self):
+        """Gets the values of the matrix dimensions other than encryption,
+        compression and compression level.
+
+        @return: list of tuples of (dimension, value)
+
+        """
+        return self.dimensions
+    def get_ssh_options(self):
+        """Gets the ssh options set by the matrix dimensions.
+
+        @return: list of strings on the form Key=Value.
+
+        """
+        return self.ssh_options
+    def get_streams(self):
+        """Gets the number of parallel streams the command is run with.
+
+        @return: int
+
+        """
+        return self.streams
+    def get_link_profile(self):
+        """Gets the name of the link profile the command is emulated over.
+
+        @return: string, or None if the command connects directly.
+
+        """
+        return self.link_profile
     def get_encryption(self):
         return self.encryption
     def get_compression(self):
@@ -522,8 +2182,11 @@ class Args(object):
     def get_compression_level(self):
         return self.compression_level
     def get_name(self):
-        return "ENC:%s|COMP:%s|COMPL:%s" % (self.encryption, self.compression, 
+        name = "ENC:%s|COMP:%s|COMPL:%s" % (self.encryption, self.compression,
                                             self.compression_level)
+        for (dimension, value) in self.dimensions:
+            name += "|%s:%s" % (dimension, value)
+        return name
 
 class Error(Exception):
     """Base class for testers errors. """
@@ -543,3 +2206,9 @@ class IllegalReturnValueError(Error):
 
 class SetupNotFinishedError(Error):
     pass
+
+class MatrixError(Error):
+    pass
+
+class AdaptiveError(Error):
+    pass
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+#            testers/local.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+from testers.base import CommandBuilder
+from progress import RSyncProgressParser
+
+class LocalCommand(CommandBuilder):
+    """Abstract builder for commands that copy the files to a local folder.
+
+    The copies involve no network or encryption, so their results are a
+    baseline of what the disks and CPU of the host manage. The target
+    folder is a local path, and C{host} is optional and only names the
+    results. Encryption and compression in the argument sections are
+    ignored, so one test is run for each value of the matrix options of the
+    command.
+
+    """
+    local = True
+    use_ssh = False
+    def __init__(self, cmdname, config, name):
+        super(LocalCommand, self).__init__(cmdname, config, name)
+        for arg in self.arguments:
+            self.add_test_arg([], arg)
+
+
+class CopyCommand(LocalCommand):
+    """Copies the files with C{cp -r}.
+
+    The section needs no argument sections:
+
+    >>> import ConfigParser
+    >>> config = ConfigParser.SafeConfigParser()
+    >>> config.add_section('copy')
+    >>> config.set('copy', 'files', '/dev/null')
+    >>> config.set('copy', 'target_folder', '/tmp/copies')
+    >>> builder = CopyCommand(config, 'copy')
+    >>> test_set = builder.build_test_set()
+    >>> [command.get_command(builder.files[0])
+    ...     for command in builder.commands]
+    ['cp -r  /dev/null /tmp/copies']
+
+    """
+    def __init__(self, config, name):
+        super(CopyCommand, self).__init__('cp', config, name)
+        self.base_cmd = 'cp'
+        self.common_args = ['-r']
+        self.cmd_format = ("%(base_command)s %(common_args)s "
+                        "%(test_args)s %(filelocation)s %(target_folder)s")
+
+
+class TarPipeCommand(LocalCommand):
+    """Copies the files with one tar creating an archive and another
+    extracting it, connected by a pipe.
+
+    """
+    parallel_dirs_safe = True
+    def __init__(self, config, name):
+        super(TarPipeCommand, self).__init__('tar-local', config, name)
+        self.base_cmd = 'tar'
+        self.common_args = []
+        self.cmd_format = ("%(base_command)s %(common_args)s %(test_args)s "
+                        "-C %(fileparent)s -cf - %(filebasename)s | "
+                        "%(base_command)s -C %(target_folder)s -xf -")
+
+
+class LocalRSyncCommand(LocalCommand):
+    """Copies the files with rsync to a local path. """
+    progress_parser = RSyncProgressParser
+    progress_args = ['--info=progress2']
+    parallel_dirs_safe = True
+    matrix_options = {
+        'block_size': ['--block-size=%s'],
+    }
+    def __init__(self, config, name):
+        super(LocalRSyncCommand, self).__init__('rsync-local', config, name)
+        self.base_cmd = 'rsync'
+        self.common_args = ['-r', '-W']
+        self.cmd_format = ("%(base_command)s %(common_args)s "
+                        "%(test_args)s %(filelocation)s %(target_folder)s")
@@ -15,21 +15,28 @@
 # You should have received a copy of the GNU General Public License
 # along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
 
-from testers.base import CommandBuilder, Args
+from testers.base import CommandBuilder
+from progress import RSyncProgressParser
+import remotedir
 
 class RSyncCommand(CommandBuilder):
+    progress_parser = RSyncProgressParser
+    progress_args = ['--info=progress2']
+    ssh_compression = False
+    parallel_dirs_safe = True
+    matrix_options = {
+        'block_size': ['--block-size=%s'],
+    }
+    legal_encryption = ('3des', 'blowfish')
     def __init__(self, config, name):
         super(RSyncCommand, self).__init__('rsync', config, name)
         self.base_cmd = 'rsync'
         legal_compression = ('yes', 'no')
-        legal_encryption = ('3des', 'blowfish')
         for arg in self.arguments:
             arglist = []
             enc = arg.get('enc')
             comp = arg.get('comp')
             compl = arg.get('compl')
-            if enc is not None and enc in legal_encryption:
-                arglist.append('-e "ssh -c %s"' % enc)
             if comp is not None and comp in legal_compression:
                 if comp.lower() == 'yes':
                     arglist.append('-z')
@@ -41,9 +48,88 @@ class RSyncCommand(CommandBuilder):
                 else:
                     if compl <= 9 and compl >= 1:
                         arglist.append('--compress-level=%d' % compl)
-            self.test_args.append(Args(arglist, enc, comp, compl))
+            self.add_test_arg(arglist, arg, enc, comp, compl)
 
         self.common_args = ['-r', '-W']
         self.cmd_format = ("%(base_command)s %(common_args)s "
                         "%(test_args)s %(filelocation)s "
                         "%(target)s:%(target_folder)s")
+    def get_ssh_args(self, test_arg):
+        """Gets the remote shell argument for rsync.
+
+        rsync does not take ssh options itself, so the encryption and any
+        other ssh options are passed on through C{-e}.
+
+        """
+        ssh_args = []
+        enc = test_arg.get_encryption()
+        if enc in self.legal_encryption:
+            ssh_args.extend(['-c', enc])
+        ssh_args.extend(['-o%s' % option
+                            for option in self.get_ssh_options(test_arg)])
+        if len(ssh_args) == 0:
+            return []
+        return ['-e "%s"' % " ".join(['ssh'] + ssh_args)]
+
+
+class RSyncDaemonCommand(CommandBuilder):
+    """Transfers the files to a module of an rsync daemon, over the
+    C{rsync://} protocol.
+
+    The test section must set C{rsync_module}, and may set C{rsync_port}
+    and C{rsync_password_file}. The target folder is a path inside the
+    module. The data is not encrypted, so only compression is tested.
+
+    """
+    progress_parser = RSyncProgressParser
+    progress_args = ['--info=progress2']
+    matrix_options = {
+        'block_size': ['--block-size=%s'],
+    }
+    use_ssh = False
+    parallel_dirs_safe = True
+    def __init__(self, config, name):
+        super(RSyncDaemonCommand, self).__init__('rsync-daemon', config, name)
+        self.base_cmd = 'rsync'
+        module = config.get(name, 'rsync_module').strip('/')
+        port = ''
+        if config.has_option(name, 'rsync_port'):
+            port = ':%d' % config.getint(name, 'rsync_port')
+        self.url = 'rsync://%s%s/%s' % (self.target, port, module)
+        self.target_folder = self.target_folder.strip('/') or '.'
+        self.daemon_args = []
+        if config.has_option(name, 'rsync_password_file'):
+            self.daemon_args.append('--password-file=%s' %
+                            config.get(name, 'rsync_password_file'))
+        legal_compression = ('yes', 'no')
+        for arg in self.arguments:
+            arglist = []
+            comp = arg.get('comp')
+            compl = arg.get('compl')
+            if comp is not None and comp in legal_compression:
+                if comp.lower() == 'yes':
+                    arglist.append('-z')
+            if compl is not None:
+                try:
+                    compl = int(compl)
+                except ValueError, ve:
+                    compl = None
+                else:
+                    if compl <= 9 and compl >= 1:
+                        arglist.append('--compress-level=%d' % compl)
+            self.add_test_arg(arglist, arg, None, comp, compl,
+                                format_data={'url': self.url})
+
+        self.common_args = ['-r', '-W'] + self.daemon_args
+        self.cmd_format = ("%(base_command)s %(common_args)s "
+                        "%(test_args)s %(filelocation)s "
+                        "%(url)s/%(target_folder)s/")
+    def get_remote_dirs(self):
+        """Creates the directories the runs are isolated in with rsync, as
+        the daemon runs no commands.
+
+        @return: L{DaemonDirs<remotedir.DaemonDirs>}
+
+        """
+        return remotedir.DaemonDirs(self.url, self.target_folder,
+                                    self.daemon_args)
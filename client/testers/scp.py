@@ -15,20 +15,23 @@
 # You should have received a copy of the GNU General Public License
 # along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
 
-from testers.base import CommandBuilder, Args
+from testers.base import CommandBuilder
+from progress import MeterProgressParser
 
 class SCPCommand(CommandBuilder):
+    progress_parser = MeterProgressParser
+    progress_tty = True
+    legal_encryption = ('blowfish', '3des')
     def __init__(self, config, name):
         super(SCPCommand, self).__init__('SCP', config, name)
         self.base_cmd = 'scp'
-        legal_encryption = ('blowfish', '3des')
         legal_compression = ('yes', 'no')
         for arg in self.arguments:
             arglist = []
             enc = arg.get('enc', None)
             comp = arg.get('comp', None)
             compl = arg.get('compl', None)
-            if enc is not None and enc in legal_encryption:
+            if enc is not None and enc in self.legal_encryption:
                 arglist.extend(['-c', enc])
             if comp is not None and comp in legal_compression:
                 if comp.lower() == 'yes':
@@ -41,7 +44,7 @@ class SCPCommand(CommandBuilder):
                 else:
                     if compl <= 9 and compl >= 1:
                         arglist.append('-oCompressionLevel=%d' % compl)
-            self.test_args.append(Args(arglist, enc, comp, compl))
+            self.add_test_arg(arglist, arg, enc, comp, compl)
 
 
         self.common_args = ['-B', '-r']
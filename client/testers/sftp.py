@@ -15,10 +15,21 @@
 # You should have received a copy of the GNU General Public License
 # along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
 
-from testers.base import CommandBuilder, Args, FileObject, \
+import os
+import posixpath
+
+from testers.base import CommandBuilder, FileObject, \
                             SetupNotFinishedError
+from progress import MeterProgressParser
 
 class SFTPCommand(CommandBuilder):
+    progress_parser = MeterProgressParser
+    progress_tty = True
+    matrix_options = {
+        'buffer_size': ['-B', '%s'],
+        'requests': ['-R', '%s'],
+    }
+    legal_encryption = ('blowfish', '3des')
     def __init__(self, config, name):
         """Initializes the SFTP command builder.
 
@@ -33,6 +44,7 @@ class SFTPCommand(CommandBuilder):
         The following arguments are optional::
 
             username=<remote username>
+            matrix.<dimension>=<value>,<value>,...
 
         The C{fileset} must be the name of another section in the config 
         defining each file or folder contained in the file set.
@@ -44,12 +56,18 @@ class SFTPCommand(CommandBuilder):
             encryption=<(blowfish|3des)>
             compression_level=<1-9>
 
+        Besides the dimensions of the argument sections, the matrix takes
+        C{buffer_size} and C{requests}, the C{-B} and C{-R} options of sftp.
+
         @param config: Configuration object
         @type config: ConfigParser.SafeConfigParser
         @param name: Name of section in I{config} defining this test
         @type name: string
 
         """
+        # Batch files written by build_file, including those of the subsets
+        # and shards of the file sets.
+        self.batch_files = []
         super(SFTPCommand, self).__init__('SFTP', config, name)
         self.base_cmd = 'sftp'
         # self.arguments now contains a list of dictionaries on the form
@@ -57,26 +75,26 @@ class SFTPCommand(CommandBuilder):
         # where each dictionary represents the arguments that should be passed 
         # to a single test case. 
         legal_compression = ('yes', 'no',)
-        legal_encryption = ('blowfish', '3des')
         for arg in self.arguments:
             arglist = []
             enc = arg.get("enc")
             comp = arg.get("comp")
             compl = arg.get("compl")
-            if enc is not None and enc.lower() in legal_encryption:
+            if enc is not None and enc.lower() in self.legal_encryption:
                 arglist.append('-oCipher=%s' % enc.lower())
             if comp is not None and comp.lower() in legal_compression:
                 arglist.append('-oCompression=%s' % comp.lower())
             if compl is not None and compl <= 9 and compl >= 1:
                 arglist.append('-oCompressionLevel=%d' % compl)
 
-            self.test_args.append(Args(arglist, enc, comp, compl))
+            self.add_test_arg(arglist, arg, enc, comp, compl)
 
 
         self.common_args = ['-b',] # Arguments that should be passed to every
                                    # run of the command.
         self.cmd_format = ("%(base_command)s %(test_args)s "
-                        "%(common_args)s %(usagefile)s %(target)s")
+                        "%(common_args)s %(usagefile)s "
+                        "%(target)s:%(target_folder)s")
     def build_file(self, f):
         """Builds a file set from the file dict.
 
@@ -89,9 +107,12 @@ class SFTPCommand(CommandBuilder):
 
         """
         real_file = super(SFTPCommand, self).build_file(f)
-        sftpcmds = [
-            'cd %s' % self.target_folder,
-            ]
+        # The remote directory is given with the target, so each run can
+        # use its own.
+        sftpcmds = []
+        if self.get_progress_parser() is not None:
+            # Progress is turned off in batch mode, this turns it back on.
+            sftpcmds.append('progress')
         curlocaldir = ""
         if curlocaldir != real_file.get_dir():
             curlocaldir = real_file.get_dir()
@@ -99,10 +120,35 @@ class SFTPCommand(CommandBuilder):
         if real_file.is_dir():
             sftpcmds.append('put *')
         else:
-            sftpcmds.append('put %s' % f.get_name())
-        newfile = '/tmp/spodtest.%s.sftp' % id(self)
+            sftpcmds.append('put %s' % real_file.get_name())
+        newfile = '/tmp/spodtest.%s.%s.sftp' % (id(self), id(real_file))
         f = open(newfile, "w")
         f.write("\n".join(sftpcmds))
         f.close()
+        self.batch_files.append(newfile)
         real_file.set_usage_file(newfile)
         return real_file
+    def teardown(self):
+        """Cleans up after running the test set, and removes the batch
+        files of the subsets and shards of the file sets.
+
+        """
+        super(SFTPCommand, self).teardown()
+        keep = set(f.usage_file for f in self.files)
+        for batch_file in self.batch_files:
+            if batch_file in keep:
+                continue
+            try:
+                os.remove(batch_file)
+            except OSError, e:
+                pass
+        self.batch_files = [batch_file for batch_file in self.batch_files
+                            if batch_file in keep]
+    def get_remote_path(self, f, target_folder):
+        """Gets where sftp puts I{f}. The files of a directory are put
+        straight into I{target_folder} by C{put *}.
+
+        """
+        if f.is_dir():
+            return target_folder
+        return posixpath.join(target_folder, f.get_name())
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+#            testers/tar.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+from testers.base import CommandBuilder
+
+# Compressors that can be put between tar and ssh, with their highest
+# compression level. none sends the archive as it is.
+COMPRESSORS = {
+    'none': None,
+    'gzip': ('gzip', 9),
+    'zstd': ('zstd', 19),
+    'lz4': ('lz4', 12),
+}
+
+class TarCommand(CommandBuilder):
+    """Transfers the files as a tar archive piped through ssh, as in
+    C{tar -cf - files | ssh host "tar -xf -"}.
+
+    The archive can be compressed by a separate stage of the pipeline, and
+    decompressed before it is extracted on the remote host. The compressor
+    is set with C{compressor=<name>} in the test section, or tested as the
+    matrix dimension C{compressor}. The compression level of the argument
+    sections is the level of the compressor, while C{compression} turns on
+    the compression of ssh.
+
+    """
+    parallel_dirs_safe = True
+    matrix_options = {
+        'compressor': [],
+    }
+    legal_encryption = ('blowfish', '3des')
+    def __init__(self, config, name):
+        super(TarCommand, self).__init__('tar', config, name)
+        self.base_cmd = 'tar'
+        compressor = 'none'
+        if config.has_option(name, 'compressor'):
+            compressor = config.get(name, 'compressor').lower()
+        legal_compression = ('yes', 'no')
+        for arg in self.arguments:
+            arglist = []
+            enc = arg.get('enc')
+            comp = arg.get('comp')
+            compl = arg.get('compl')
+            if enc is not None and enc in self.legal_encryption:
+                arglist.extend(['-c', enc])
+            if comp is not None and comp in legal_compression:
+                if comp.lower() == 'yes':
+                    arglist.append('-C')
+            # The compressor is always reported, also when it is not a
+            # matrix dimension.
+            dimensions = dict(arg['dimensions'])
+            if 'compressor' not in dimensions:
+                arg = self.set_dimension(arg, 'compressor', compressor)
+                dimensions['compressor'] = compressor
+            if dimensions['compressor'] not in COMPRESSORS:
+                raise CompressorError(("Unknown compressor %s in section %s, "
+                                "must be one of: %s") % (
+                                dimensions['compressor'], name,
+                                ", ".join(sorted(COMPRESSORS))))
+            (compl, format_data) = self.get_stages(dimensions['compressor'],
+                                                    compl)
+            self.add_test_arg(arglist, arg, enc, comp, compl,
+                                format_data=format_data)
+
+        self.common_args = []
+        self.cmd_format = ("%(base_command)s %(common_args)s "
+                        "-C %(fileparent)s -cf - %(filebasename)s"
+                        "%(compress)s | ssh %(test_args)s %(target)s "
+                        "\"%(decompress)s%(base_command)s "
+                        "-C %(target_folder)s -xf -\"")
+    def get_stages(self, compressor, compression_level=None):
+        """Gets the compression and decompression stages of the pipeline.
+
+        @param compressor: Name of the compressor in L{COMPRESSORS}.
+        @type compressor: string
+        @param compression_level: Level to compress at, if the compressor
+                                  takes it.
+        @type compression_level: int
+        @return: tuple of (the compression level used, or None, dict with
+                 the stages as C{compress} and C{decompress})
+
+        """
+        if COMPRESSORS[compressor] is None:
+            return (None, {'compress': '', 'decompress': ''})
+        (program, max_level) = COMPRESSORS[compressor]
+        compress = "%s -c -q" % program
+        if compression_level is not None and \
+                1 <= compression_level <= max_level:
+            compress += " -%d" % compression_level
+        else:
+            compression_level = None
+        return (compression_level, {
+                    'compress': " | %s" % compress,
+                    'decompress': "%s -dc -q | " % program})
+
+
+class Error(Exception):
+    pass
+
+class CompressorError(Error):
+    pass
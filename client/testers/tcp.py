@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+#            testers/tcp.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+
+from testers.base import CommandBuilder
+import probe
+
+class TCPProbeCommand(CommandBuilder):
+    """Sends the files over a plain TCP connection to the receiver of
+    L{probe}, started on the host for the test set.
+
+    The files are sent with sendfile() and only counted by the receiver, so
+    the results are the raw throughput of the link that the other commands
+    can be compared to. Encryption and compression in the argument sections
+    are ignored, and the target folder is not needed.
+
+    The sender times the sending itself, so the startup of the interpreter
+    and the listing of the files are not part of the transfer time.
+
+    """
+    use_ssh = False
+    needs_target_folder = False
+    needs_receiver = True
+    parallel_dirs_safe = True
+    self_timed = True
+    def __init__(self, config, name):
+        super(TCPProbeCommand, self).__init__('tcp', config, name)
+        if self.probe_port == 0:
+            raise probe.ProbeError(("The tcp command in section %s needs a "
+                                    "fixed probe_port") % name)
+        # The command is the probe itself.
+        self.efficiency = False
+        for arg in self.arguments:
+            self.add_test_arg([], arg, format_data={
+                                    'probe_host': self.host,
+                                    'probe_port': self.probe_port})
+        self.base_cmd = sys.executable
+        self.common_args = [probe.SCRIPT_PATH, 'send']
+        self.cmd_format = ("%(base_command)s %(common_args)s "
+                        "%(probe_host)s %(probe_port)d %(filelocation)s")
+    def get_run_time(self, lines):
+        """Gets the time the sender spent sending, from its last line. """
+        for line in reversed(lines):
+            sent = probe.parse_sent(line)
+            if sent is not None:
+                return sent[1]
+        return None
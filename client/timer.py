@@ -15,7 +15,52 @@
 # You should have received a copy of the GNU General Public License
 # along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import sys
 import time
+import ctypes
+import ctypes.util
+import logging
+
+CLOCK_MONOTONIC = 1
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def load_monotonic():
+    """Finds a monotonic clock with high resolution.
+
+    Uses time.monotonic where it exists, otherwise calls clock_gettime() with
+    CLOCK_MONOTONIC through ctypes. Falls back to time.time() if neither is
+    available.
+
+    @return: function returning the clock as float seconds.
+
+    """
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    if not sys.platform.startswith('linux'):
+        logging.warning("No monotonic clock on %s, using time.time()" %
+                        sys.platform)
+        return time.time
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1',
+                            use_errno=True)
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError), e:
+        logging.warning("Unable to load clock_gettime(), using time.time(): "
+                        "%s" % e)
+        return time.time
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    def monotonic():
+        t = timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return t.tv_sec + t.tv_nsec * 1e-9
+    return monotonic
+
+monotonic = load_monotonic()
 
 class Timer(object):
     """Class to time execution of code. 
@@ -23,12 +68,19 @@ class Timer(object):
     Keeps track of execution time and provides some utilities functions
     for showing time.
 
+    Intervals are measured with a monotonic clock, so they are not affected
+    by changes to the system clock. The CPU time used by child processes
+    during each interval can be added with L{add_cpu_time}.
+
     """
     def __init__(self):
         """Sets the initial processing time to 0. """
         self.processing_time = 0.0
         self.start_time = None
         self.end_time = None
+        self.first_start_time = None
+        self.intervals = []
+        self.cpu_times = []
     def start(self):
         """Starts the timer. 
         
@@ -39,7 +91,9 @@ class Timer(object):
         if self.end_time is not None:
             raise OrderError('attempting to start timer that is already '
                                 'running.')
-        self.start_time = time.time()
+        if self.first_start_time is None:
+            self.first_start_time = time.time()
+        self.start_time = monotonic()
     def stop(self):
         """Stops the timer and increases processing time.
         
@@ -49,16 +103,73 @@ class Timer(object):
         if self.start_time is None:
             raise OrderError('attempting to stop timer that has not been '
                                 'started')
-        self.end_time = time.time()
+        self.end_time = monotonic()
         self.processing_time += self.end_time - self.start_time
+        self.intervals.append(self.end_time - self.start_time)
         self.end_time = None
+    def discard(self):
+        """Discards the last interval and the CPU time added for it, as for
+        a run that failed.
+
+        """
+        if len(self.intervals) == 0:
+            return
+        if len(self.cpu_times) == len(self.intervals):
+            self.cpu_times.pop()
+        self.processing_time -= self.intervals.pop()
+        if len(self.intervals) == 0:
+            self.processing_time = 0.0
+            self.first_start_time = None
+    def replace(self, seconds):
+        """Replaces the last interval with I{seconds}, as for a command that
+        timed its own work more precisely than the interval around it.
+
+        """
+        if len(self.intervals) == 0:
+            return
+        self.processing_time += seconds - self.intervals[-1]
+        self.intervals[-1] = seconds
     def get_processing_time(self):
         """Gets the processing time for the timer.
 
-        @return: float containing processing time in time.time() format.
+        @return: float containing processing time in seconds.
 
         """
         return self.processing_time
+    def get_intervals(self):
+        """Gets the time of each start/stop interval of the timer.
+
+        The sum of the intervals is the processing time.
+
+        @return: list of float, in the order the intervals were timed.
+
+        """
+        return self.intervals
+    def add_cpu_time(self, user, system):
+        """Adds the CPU time used by child processes during the last interval.
+
+        @param user: User CPU time in seconds.
+        @type user: float
+        @param system: System CPU time in seconds.
+        @type system: float
+
+        """
+        self.cpu_times.append((user, system))
+    def get_cpu_times(self):
+        """Gets the CPU time added for each interval.
+
+        @return: list of (user, system) tuples.
+
+        """
+        return self.cpu_times
+    def get_first_start_time(self):
+        """Gets the time the timer was first started.
+
+        @return: float in time.time() format, or None if the timer has never
+                 been started.
+
+        """
+        return self.first_start_time
     def get_string_processing_time(self):
         """Gets a string representation of the processing time.
 
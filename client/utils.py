@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
 
+import calendar
 import datetime
 import time
 import re
@@ -77,3 +78,25 @@ def rfc3339_to_date(date_str):
         return False
         
     return dt_obj
+
+def rfc3339_to_timestamp(date_str):
+    """Converts an RFC3339 string to seconds since the epoch.
+
+    Unlike L{rfc3339_to_date}, this takes the UTC offset of the string into
+    account.
+
+    Returns None for any string that is not valid RFC3339.
+
+    """
+    date = rfc3339_to_date(date_str)
+    if date is False:
+        return None
+    timestamp = calendar.timegm(date.timetuple())
+    match = re.search(r"([+-])(\d{2}):(\d{2})$", date_str.strip())
+    if match is not None:
+        offset = int(match.group(2)) * 3600 + int(match.group(3)) * 60
+        if match.group(1) == "+":
+            timestamp -= offset
+        else:
+            timestamp += offset
+    return timestamp
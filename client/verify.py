@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+#            verify.py is part of SPODTest.
+#
+# All of SPODTest is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# SPODTest is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SPODTest.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import mmap
+import pipes
+import hashlib
+import logging
+import posixpath
+from multiprocessing.pool import ThreadPool
+
+import engine
+import manifest
+import remotedir
+
+# Hash algorithms of the verify_hash option, with the program computing the
+# same digest on the remote host.
+ALGORITHMS = {
+    'md5': 'md5sum',
+    'sha1': 'sha1sum',
+    'sha256': 'sha256sum',
+}
+# Number of files hashed at the same time. hashlib releases the GIL while it
+# hashes, so the threads use several cores.
+WORKERS = 8
+# Bytes of a file mapped at a time, so large files do not need as much
+# address space.
+MAP_SIZE = 64 * 1024 * 1024
+
+def hash_file(path, algorithm='md5'):
+    """Hashes the file I{path}, reading it through mmap.
+
+    @return: string with the hex digest.
+
+    """
+    digest = hashlib.new(algorithm)
+    f = open(path, 'rb')
+    try:
+        size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset < size:
+            length = min(MAP_SIZE, size - offset)
+            data = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ,
+                            offset=offset)
+            try:
+                digest.update(data)
+            finally:
+                data.close()
+            offset += length
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+def unescape(name):
+    """Undoes the escaping of a file name in the output of md5sum, which is
+    used for names with backslashes or newlines.
+
+    """
+    result = []
+    i = 0
+    while i < len(name):
+        if name[i] == '\\' and i + 1 < len(name):
+            result.append({'n': '\n', '\\': '\\'}.get(name[i + 1],
+                                                        name[i + 1]))
+            i += 2
+        else:
+            result.append(name[i])
+            i += 1
+    return ''.join(result)
+
+def parse_listing(lines):
+    """Parses the output of md5sum and its siblings.
+
+    @return: dict mapping relative paths to hex digests.
+
+    """
+    digests = {}
+    for line in lines:
+        escaped = line.startswith('\\')
+        if escaped:
+            line = line[1:]
+        (digest, sep, name) = line.rstrip('\n').partition('  ')
+        if sep == '':
+            continue
+        if escaped:
+            name = unescape(name)
+        if name.startswith('./'):
+            name = name[2:]
+        digests[name] = digest
+    return digests
+
+def list_remote(target, path, is_dir, algorithm='md5', ssh_args=None):
+    """Hashes the files in I{path} on the remote host with one ssh session.
+
+    @param target: The host, or user@host, or None for the local host.
+    @type target: string
+    @param path: The transferred file or directory on the host.
+    @type path: string
+    @param is_dir: Whether I{path} is a directory.
+    @type is_dir: bool
+    @param ssh_args: Extra arguments for ssh.
+    @type ssh_args: list of strings
+    @return: dict mapping paths relative to I{path}, or the name of the file,
+             to hex digests.
+
+    """
+    program = ALGORITHMS[algorithm]
+    if is_dir:
+        command = "cd %s && find . -type f -exec %s {} +" % (
+                    remotedir.quote_path(path), program)
+    else:
+        command = "cd %s && %s %s" % (
+                    remotedir.quote_path(posixpath.dirname(path) or '.'),
+                    program,
+                    pipes.quote(posixpath.basename(path)))
+    if target is None:
+        argv = ['sh', '-c', command]
+    else:
+        argv = ['ssh', '-oBatchMode=yes'] + (ssh_args or []) + [target, command]
+    lines = []
+    job = engine.Engine().run(engine.Job(argv, line_callback=lines.append,
+                                        stderr_callback=logging.debug))
+    # Files that cannot be read make the command fail, but the others are
+    # still listed.
+    if job.returncode != 0 and len(lines) == 0:
+        raise VerifyError("Unable to list %s on %s, %s exited with %d" % (
+                        path, target or 'localhost', argv[0], job.returncode))
+    return parse_listing(lines)
+
+def compare(local, remote):
+    """Compares the local digests to those on the remote host.
+
+    Files on the remote host that are not in the data set are ignored.
+
+    @return: tuple of (sorted list of missing files, sorted list of files
+             with other contents).
+
+    """
+    missing = sorted(name for name in local if name not in remote)
+    mismatched = sorted(name for (name, digest) in local.items()
+                        if name in remote and remote[name] != digest)
+    return (missing, mismatched)
+
+
+class HashCache(object):
+    """Digests of local files, computed once for each version of a file.
+
+    The digests of a data set are kept in its L{Manifest<manifest.Manifest>}
+    when manifests are used, so they are reused by later runs of SPODTest.
+    Within a run, every file is only hashed once, also when it is linked
+    into a subset or shard.
+
+    """
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        # Maps (algorithm, device, inode, size, mtime) to hex digests.
+        self.digests = {}
+    def get_digests(self, f, algorithm='md5', use_manifest=True):
+        """Gets the digest of every file of I{f}.
+
+        @param f: The transferred file or directory.
+        @type f: L{FileObject<testers.base.FileObject>}
+        @param algorithm: Name of the hash algorithm.
+        @type algorithm: string
+        @param use_manifest: Whether the digests should be kept in the
+                             manifest of the data set.
+        @type use_manifest: bool
+        @return: dict mapping paths relative to a directory, or the name of
+                 a file, to hex digests.
+
+        """
+        if f.is_dir():
+            root = f.get_path()
+        else:
+            root = f.get_dir()
+        stored = None
+        if f.is_dir() and use_manifest:
+            stored = manifest.Manifest(root)
+            stored.load()
+        entries = {}
+        pending = []
+        for path in f.get_filelist():
+            relpath = os.path.relpath(path, root)
+            st = os.stat(path)
+            key = (algorithm, st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+            digest = self.digests.get(key)
+            if digest is None and stored is not None:
+                digest = stored.get_hash(relpath, algorithm, st.st_size,
+                                        st.st_mtime)
+            if digest is None:
+                pending.append((relpath, path, key))
+            else:
+                self.digests[key] = digest
+            entries[relpath] = [st.st_size, st.st_mtime, key]
+        if len(pending) > 0:
+            logging.debug("Hashing %d files of %s" % (len(pending), root))
+            pool = ThreadPool(self.workers)
+            try:
+                digests = pool.map(lambda path: hash_file(path, algorithm),
+                                    [path for (relpath, path, key) in pending])
+            finally:
+                pool.close()
+            for ((relpath, path, key), digest) in zip(pending, digests):
+                self.digests[key] = digest
+        result = {}
+        for (relpath, entry) in entries.items():
+            result[relpath] = self.digests[entry[2]]
+            entry[2] = result[relpath]
+        if stored is not None:
+            stored.set_hashes(algorithm, entries)
+            stored.save()
+        return result
+
+hashes = HashCache()
+
+
+class Error(Exception):
+    pass
+
+class VerifyError(Error):
+    pass
@@ -18,6 +18,9 @@
 from lxml import etree
 import logging
 from utils import date_to_rfc3339
+import stats
+import sampler
+import collector
 
 class XMLDoc(object):
     """Class for handling XML packing of SPODTest data. """
@@ -34,6 +37,23 @@ class XMLDoc(object):
         @type testcase: L{TestCase}
 
         """
+        element = self.create_testcase(testcase)
+        if element is not None:
+            self.root.append(element)
+    def create_testcase(self, testcase):
+        """Creates the element for a test case, without adding it to the
+        document.
+
+        @param testcase: The test case to create an element for.
+        @type testcase: L{TestCase}
+        @return: the testcase element, or None if the test case was never
+                 timed.
+
+        """
+        if testcase.get_timer().get_first_start_time() is None:
+            logging.warning("Test case %s on %s was never timed, skipping." %
+                            (testcase.command, testcase.f))
+            return None
         logging.debug(("Command: %s "
                         "Time used: %s "
                         "Size transferred: %s "
@@ -43,7 +63,7 @@ class XMLDoc(object):
                             testcase.f.get_size_string(),
                             testcase.get_speed_string(),
                             ))
-        self.root.append(etree.Element("testcase",
+        element = etree.Element("testcase",
             type=testcase.command.command_name,
             encryption=testcase.command.args.get_encryption(),
             compression=testcase.command.args.get_compression(),
@@ -51,10 +71,150 @@ class XMLDoc(object):
             num_files=str(testcase.f.get_num_files()),
             total_size=str(testcase.f.get_size()),
             fileset=str(testcase.f.get_fs_name()),
-            transfer_time=str(testcase.timer.get_processing_time()),
+            transfer_time=str(testcase.get_transfer_time()),
             to=testcase.command.builder.host,
-            date=date_to_rfc3339(testcase.timer.start_time),
-            ))
+            date=date_to_rfc3339(testcase.timer.get_first_start_time()),
+            repetitions=str(testcase.repetitions),
+            warmup=str(testcase.warmup),
+            )
+        dimensions = testcase.command.args.get_dimensions()
+        if len(dimensions) > 0:
+            # Lists the matrix dimensions, so they can be told apart from
+            # the other attributes.
+            element.set("dimensions", " ".join(
+                                    [name for (name, value) in dimensions]))
+            for (name, value) in dimensions:
+                element.set(name, value)
+        if testcase.command.builder.cache_mode != 'none':
+            element.set("cache_mode", testcase.command.builder.cache_mode)
+        if testcase.round is not None:
+            element.set("round", str(testcase.round))
+            element.set("sample_fraction", str(testcase.sample_fraction))
+            element.set("pruned", testcase.pruned and "yes" or "no")
+        handshake_time = testcase.command.builder.get_handshake_time(
+                                                testcase.command.args)
+        if handshake_time is not None:
+            element.set("handshake_time", str(handshake_time))
+        valid = testcase.is_valid()
+        if valid is not None:
+            element.set("valid", valid and "yes" or "no")
+        efficiency = testcase.get_efficiency()
+        if efficiency is not None:
+            element.set("efficiency", str(efficiency))
+            element.set("raw_throughput", str(testcase.get_raw_throughput()))
+        cpu_time = testcase.get_cpu_time()
+        if cpu_time is not None:
+            element.set("cpu_user", str(cpu_time[0]))
+            element.set("cpu_system", str(cpu_time[1]))
+        if len(testcase.get_samples()) > 1:
+            self.add_samples(element, testcase)
+        self.add_progress(element, testcase)
+        self.add_utilisation(element, testcase)
+        self.add_remote_utilisation(element, testcase)
+        for (phase, seconds) in testcase.get_phase_times():
+            etree.SubElement(element, "phase", name=phase, time=str(seconds))
+        for (index, (shard, seconds, speed)) in enumerate(
+                                                    testcase.get_streams()):
+            etree.SubElement(element, "stream",
+                index=str(index),
+                num_files=str(shard.get_num_files()),
+                total_size=str(shard.get_size()),
+                transfer_time=str(seconds),
+                throughput=str(speed),
+                )
+        return element
+    def add_samples(self, element, testcase):
+        """Adds a throughput summary and the raw samples of a repeated test
+        case to I{element}.
+
+        Throughput is given in bytes per second.
+
+        """
+        summary = stats.summarize(testcase.get_sample_speeds())
+        throughput = etree.SubElement(element, "throughput")
+        for key in ('min', 'median', 'mean', 'stddev', 'p95', 'max',
+                    'ci_low', 'ci_high'):
+            if summary[key] is not None:
+                throughput.set(key, str(summary[key]))
+        for (sample, speed, cpu_time) in zip(testcase.get_samples(),
+                                    testcase.get_sample_speeds(),
+                                    testcase.get_timer().get_cpu_times()):
+            etree.SubElement(element, "sample",
+                transfer_time=str(sample),
+                throughput=str(speed),
+                cpu_user=str(cpu_time[0]),
+                cpu_system=str(cpu_time[1]),
+                )
+    def add_utilisation(self, element, testcase):
+        """Adds the utilisation of the host and the bottleneck of a test
+        case to I{element}, if it was sampled.
+
+        The summary is the median over the timed runs. The series of each
+        run is only added if the builder keeps it.
+
+        """
+        utilisation = testcase.get_utilisation()
+        if utilisation is None:
+            return
+        element.set("bottleneck", testcase.get_bottleneck())
+        summary = etree.SubElement(element, "utilisation")
+        for field in sampler.FIELDS:
+            if utilisation[field] is not None:
+                summary.set(field, str(utilisation[field]))
+        if not testcase.command.builder.sample_series:
+            return
+        for (run, series) in enumerate(testcase.get_utilisation_series()):
+            run_element = etree.SubElement(element, "utilisation_series",
+                                            run=str(run))
+            for point in series:
+                point_element = etree.SubElement(run_element, "point",
+                                                time=str(point['time']))
+                for field in sampler.FIELDS:
+                    if point[field] is not None:
+                        point_element.set(field, str(point[field]))
+    def add_remote_utilisation(self, element, testcase):
+        """Adds the utilisation of the remote host and its bottleneck to
+        I{element}, if it was sampled.
+
+        """
+        utilisation = testcase.get_remote_utilisation()
+        if utilisation is None:
+            return
+        element.set("remote_bottleneck", testcase.get_remote_bottleneck())
+        summary = etree.SubElement(element, "remote_utilisation")
+        for field in collector.FIELDS:
+            if utilisation[field] is not None:
+                summary.set(field, str(utilisation[field]))
+    def add_progress(self, element, testcase):
+        """Adds the progress series of each timed run to I{element}.
+
+        The time to first byte, ramp up time and steady state throughput of
+        the test case are the medians over the timed runs.
+
+        """
+        metrics = {
+            'first_byte_time': [],
+            'ramp_up_time': [],
+            'steady_throughput': [],
+        }
+        for (run, series) in enumerate(testcase.get_progress_series()):
+            if len(series.get_points()) == 0:
+                continue
+            progress = etree.SubElement(element, "progress", run=str(run))
+            for (key, value) in (
+                    ('first_byte_time', series.get_first_byte_time()),
+                    ('ramp_up_time', series.get_ramp_up_time()),
+                    ('steady_throughput', series.get_steady_state_speed())):
+                if value is not None:
+                    progress.set(key, str(value))
+                    metrics[key].append(value)
+            for (elapsed, nbytes) in series.get_points():
+                etree.SubElement(progress, "point",
+                    time=str(elapsed),
+                    bytes=str(nbytes))
+        for key in ('first_byte_time', 'ramp_up_time', 'steady_throughput'):
+            if len(metrics[key]) > 0:
+                element.set(key, str(stats.median(metrics[key])))
     def get_xml(self):
         """Gets the document as a string.
 